@@ -12,6 +12,7 @@ import zipfile
 from datamart_core.common import log_future
 from datamart_geo import GeoData
 from datamart_materialize import get_writer
+from datamart_profiler.spatial import RedisNominatimCache
 
 from .graceful_shutdown import GracefulApplication
 
@@ -156,8 +157,10 @@ class Application(GracefulApplication):
         self.lazo_client = lazo
         if os.environ.get('NOMINATIM_URL'):
             self.nominatim = os.environ['NOMINATIM_URL']
+            self.nominatim_cache = RedisNominatimCache(redis_client)
         else:
             self.nominatim = None
+            self.nominatim_cache = None
             logger.warning(
                 "$NOMINATIM_URL is not set, not resolving addresses"
             )
@@ -17,11 +17,12 @@ from datamart_core.common import PrefixedElasticsearch, setup_logging
 from datamart_core.objectstore import get_object_store
 from datamart_core.prom import PromMeasureRequest
 import datamart_profiler
+from datamart_profiler.spatial import resolve_name_all
 
 from .augment import Augment, AugmentResult
 from .base import BUCKETS, BaseHandler, Application
 from .download import DownloadId, Download, Metadata
-from .profile import Profile
+from .profile import Profile, ProfileStatus
 from .search import Search
 from .sessions import SessionNew, SessionGet
 from .upload import Upload
@@ -81,7 +82,7 @@ class LocationSearch(BaseHandler):
     def post(self):
         query = self.get_body_argument('q').strip()
         geo_data = self.application.geo_data
-        areas = geo_data.resolve_name_all(query)
+        areas = resolve_name_all(geo_data, query)
         area = min_or_none(areas, key=lambda a: a.type.value)
         if area is not None:
             bounds = area.bounds
@@ -194,6 +195,11 @@ def make_app(debug=False):
         [
             ApiRule('/profile', '1', Profile),
             ApiRule('/profile/fast', '1', Profile, {'fast': True}),
+            ApiRule(
+                '/profile/progressive', '1',
+                Profile, {'progressive': True},
+            ),
+            ApiRule('/profile/status/([0-9a-f]+)', '1', ProfileStatus),
             ApiRule('/search', '1', Search),
             ApiRule('/download/([^/]+)', '1', DownloadId),
             ApiRule('/download', '1', Download),
@@ -1,3 +1,4 @@
+import asyncio
 import elasticsearch
 import logging
 import hashlib
@@ -10,6 +11,7 @@ import tempfile
 import time
 import tornado.web
 
+from datamart_core.common import log_future
 from datamart_core.materialize import detect_format_convert_to_csv
 from datamart_core.prom import PromMeasureRequest
 from datamart_fslock.cache import cache_get_or_set
@@ -34,6 +36,25 @@ PROM_PROFILE = PromMeasureRequest(
         buckets=BUCKETS,
     ),
 )
+PROM_PROFILE_STATUS = PromMeasureRequest(
+    count=prometheus_client.Counter(
+        'req_profile_status_count',
+        "Profile status requests",
+    ),
+    time=prometheus_client.Histogram(
+        'req_profile_status_seconds',
+        "Profile status request time",
+        buckets=BUCKETS,
+    ),
+)
+
+
+# How long a profile can run in the background before it is considered lost
+PROFILE_PENDING_TTL = 3600
+
+# Maximum time the status endpoint waits for a profile to complete
+MAX_STATUS_WAIT = 60
+STATUS_POLL_INTERVAL = 0.5
 
 
 class ProfilePostedData(tornado.web.RequestHandler):
@@ -136,6 +157,7 @@ class ProfilePostedData(tornado.web.RequestHandler):
                             data=data,
                             lazo_client=self.application.lazo_client,
                             nominatim=self.application.nominatim,
+                            nominatim_cache=self.application.nominatim_cache,
                             geo_data=self.application.geo_data,
                             search=True,
                             include_sample=True,
@@ -184,9 +206,19 @@ def get_data_profile_from_es(es, dataset_id):
     return data_profile
 
 
+def get_profile_error(redis, data_hash):
+    """Get the error from profiling in the background, or None.
+    """
+    error = redis.get('profile-error:' + data_hash)
+    if error is None:
+        return None
+    return "Error profiling data: %s" % error.decode('utf-8')
+
+
 class Profile(BaseHandler, GracefulHandler, ProfilePostedData):
-    def initialize(self, *, fast=False):
+    def initialize(self, *, fast=False, progressive=False):
         self.fast = fast
+        self.progressive = progressive
 
     @PROM_PROFILE.sync()
     def post(self):
@@ -203,6 +235,9 @@ class Profile(BaseHandler, GracefulHandler, ProfilePostedData):
                 pass
             else:
                 if profile_token_re.match(data_hash):
+                    if self.progressive:
+                        return self.send_progressive(data_hash)
+
                     if self.fast:
                         data_profile = self.application.redis.get(
                             'profile-fast:' + data_hash,
@@ -235,6 +270,14 @@ class Profile(BaseHandler, GracefulHandler, ProfilePostedData):
 
         logger.info("Got profile")
 
+        if self.progressive:
+            # Send the fast profile now, compute the full one in the
+            # background
+            _, data_hash = self.handle_data_parameter(data, fast=True)
+            if not self.application.redis.exists('profile:' + data_hash):
+                self.profile_in_background(data, data_hash)
+            return self.send_progressive(data_hash)
+
         data_profile, data_hash = self.handle_data_parameter(data, fast=self.fast)
 
         return self.send_json(dict(
@@ -242,5 +285,116 @@ class Profile(BaseHandler, GracefulHandler, ProfilePostedData):
             token=data_hash,
         ))
 
+    def send_progressive(self, data_hash):
+        """Send the full profile if it is ready, else the fast profile.
+
+        The ``status`` key is ``'done'`` for the full profile, and
+        ``'profiling'`` if it is still being computed (it can then be fetched
+        from :class:`ProfileStatus`). If computing it failed, the error is
+        sent instead.
+        """
+        redis = self.application.redis
+        # Check pending first: the full profile is stored before the pending
+        # key is removed, so it is there if profiling just finished
+        pending = redis.exists('profile-pending:' + data_hash)
+        data_profile = redis.get('profile:' + data_hash)
+        if data_profile:
+            status = 'done'
+        elif pending:
+            data_profile = redis.get('profile-fast:' + data_hash)
+            status = 'profiling'
+        if not data_profile:
+            error = get_profile_error(redis, data_hash)
+            if error is not None:
+                return self.send_error_json(500, error)
+            return self.send_error_json(404, "Data profile token expired")
+        return self.send_json(dict(
+            json.loads(data_profile),
+            token=data_hash,
+            status=status,
+        ))
+
+    def profile_in_background(self, data, data_hash):
+        """Compute the full profile in a thread, and store it in Redis.
+
+        A ``profile-pending:`` key is set while this runs, so only one full
+        profile of the same data is computed at a time, and a
+        ``profile-error:`` key is set to the error message if it fails.
+        """
+        redis = self.application.redis
+        if not redis.set(
+            'profile-pending:' + data_hash, 1,
+            nx=True, ex=PROFILE_PENDING_TTL,
+        ):
+            logger.info("Profile already in progress")
+            return
+        redis.delete('profile-error:' + data_hash)
+
+        # Don't let the application exit until this is done
+        app = self.application
+        app.nb_requests += 1
+
+        async def profile():
+            try:
+                await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    self.handle_data_parameter,
+                    data,
+                )
+            except Exception as e:
+                redis.set(
+                    'profile-error:' + data_hash, str(e) or type(e).__name__,
+                    ex=PROFILE_PENDING_TTL,
+                )
+                raise
+            finally:
+                redis.delete('profile-pending:' + data_hash)
+                async with app.close_condition:
+                    app.nb_requests -= 1
+                    app.close_condition.notify_all()
+
+        log_future(
+            asyncio.get_event_loop().create_task(profile()),
+            logger,
+            "Exception profiling in the background",
+        )
+
+
+class ProfileStatus(BaseHandler):
+    @PROM_PROFILE_STATUS.async_()
+    async def get(self, data_hash):
+        if not profile_token_re.match(data_hash):
+            return await self.send_error_json(404, "Invalid token")
+        try:
+            wait = float(self.get_query_argument('wait', '0'))
+        except ValueError:
+            return await self.send_error_json(400, "Invalid 'wait' argument")
+        deadline = time.perf_counter() + min(max(wait, 0.0), MAX_STATUS_WAIT)
+
+        redis = self.application.redis
+        while True:
+            pending = redis.exists('profile-pending:' + data_hash)
+            data_profile = redis.get('profile:' + data_hash)
+            if data_profile:
+                return await self.send_json(dict(
+                    json.loads(data_profile),
+                    token=data_hash,
+                    status='done',
+                ))
+            elif not pending:
+                error = get_profile_error(redis, data_hash)
+                if error is not None:
+                    return await self.send_error_json(500, error)
+                return await self.send_error_json(
+                    404,
+                    "Data profile token expired",
+                )
+            elif time.perf_counter() >= deadline:
+                break
+            await asyncio.sleep(STATUS_POLL_INTERVAL)
+
+        self.set_status(202)
+        return await self.send_json({'token': data_hash, 'status': 'profiling'})
+
 
 profile_token_re = re.compile(r'^[0-9a-f]{40}$')
@@ -9,6 +9,7 @@ import prometheus_client
 import time
 
 from datamart_core.prom import PromMeasureRequest
+from datamart_profiler.spatial import resolve_name
 from datamart_profiler.temporal import parse_date, temporal_aggregation_keys
 
 from ..base import BUCKETS, BaseHandler
@@ -257,7 +258,7 @@ def parse_query_variables(data, geo_data=None):
                 area_name = variable['area_name']
                 if not isinstance(area_name, str):
                     raise ClientError("Invalid geospatial variable area")
-                area = geo_data.resolve_name(area_name)
+                area = resolve_name(geo_data, area_name)
                 if area is not None and area.bounds is not None:
                     bounds = area.bounds
                     longitude1, longitude2, latitude1, latitude2 = bounds
@@ -13,7 +13,7 @@ import zipfile
 
 from datamart_core import Discoverer
 from datamart_core.common import setup_logging
-from datamart_profiler.core import count_rows_to_skip
+from datamart_profiler import count_rows_to_skip
 
 
 logger = logging.getLogger(__name__)
@@ -22,8 +22,7 @@ from datamart_materialize.pivot import pivot_table
 from datamart_materialize.spss import spss_to_csv
 from datamart_materialize.stata import stata_to_csv
 from datamart_materialize.tsv import tsv_to_csv
-from datamart_profiler import parse_date
-from datamart_profiler.core import count_rows_to_skip
+from datamart_profiler import count_rows_to_skip, parse_date
 
 from .discovery import encode_dataset_id
 from .objectstore import get_object_store
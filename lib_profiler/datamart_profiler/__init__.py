@@ -1,8 +1,32 @@
-from .core import count_rows_to_skip, process_dataset
-from .temporal import parse_date
+import importlib
 
 
 __version__ = '0.10'
 
 
 __all__ = ['count_rows_to_skip', 'process_dataset', 'parse_date']
+
+
+# The submodules are only imported when those are first used, so that
+# importing the package (e.g. only to parse dates) stays fast
+_lazy_attributes = {
+    'count_rows_to_skip': '.skip_rows',
+    'process_dataset': '.core',
+    'parse_date': '.temporal',
+}
+
+
+def __getattr__(name):
+    try:
+        module = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name),
+        ) from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
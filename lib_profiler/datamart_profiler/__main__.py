@@ -1,8 +1,12 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
 import json
 import logging
+import os
 import string
 import sys
+import traceback
 
 from datamart_profiler import process_dataset
 
@@ -37,6 +41,153 @@ def parse_size(number):
     return size
 
 
+def load_geo_data():
+    # Check for datamart-geo
+    try:
+        from datamart_geo import GeoData
+        return GeoData.from_local_cache()
+    except ImportError:
+        logger.info("datamart-geo not installed")
+        return None
+    except FileNotFoundError:
+        logger.warning("datamart-geo is installed but no data is available")
+        return None
+
+
+def list_files(paths, manifest=None):
+    """List the files to profile in batch mode.
+
+    :param paths: Files, directories (all the files in them are profiled), or
+        glob patterns
+    :param manifest: A file listing one file per line
+    :return: A list of file names, without duplicates
+    """
+    files = []
+    if manifest is not None:
+        with open(manifest) as fp:
+            for line in fp:
+                line = line.strip()
+                if line:
+                    files.append(line)
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    files.append(os.path.join(dirpath, filename))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def read_done(output):
+    """Read the files already profiled from a batch output file.
+
+    :return: A set of file names that were profiled successfully. Files that
+        failed are tried again.
+    """
+    done = set()
+    try:
+        fp = open(output)
+    except FileNotFoundError:
+        return done
+    with fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Interrupted while writing
+                continue
+            if 'metadata' in record:
+                done.add(record['file'])
+    return done
+
+
+_batch_geo_data = None
+
+
+def _init_batch_worker():
+    global _batch_geo_data
+
+    _batch_geo_data = load_geo_data()
+
+
+def _profile_batch_file(filename, options):
+    try:
+        metadata = process_dataset(
+            filename,
+            geo_data=_batch_geo_data,
+            **options
+        )
+    except Exception as e:
+        return {
+            'file': filename,
+            'error': '%s: %s' % (type(e).__name__, e),
+            'traceback': traceback.format_exc(),
+        }
+    return {'file': filename, 'metadata': metadata}
+
+
+def profile_batch(files, output, options, jobs=None):
+    """Profile many files with a pool of processes.
+
+    Results are appended to the `output` file as JSON Lines, in the order in
+    which they finish, as ``{"file": ..., "metadata": ...}`` or
+    ``{"file": ..., "error": ...}``. Files that are already in the output
+    are skipped, so an interrupted run can be resumed.
+
+    :param options: Arguments for :func:`process_dataset`
+    :return: The number of files that failed
+    """
+    done = read_done(output)
+    todo = [f for f in files if f not in done]
+    logger.info(
+        "%d files, %d already profiled, profiling %d",
+        len(files), len(files) - len(todo), len(todo),
+    )
+    failed = 0
+    with open(output, 'a') as out:
+        # Finish a line interrupted while writing
+        if out.tell() > 0:
+            with open(output, 'rb') as fp:
+                fp.seek(-1, 2)
+                if fp.read(1) != b'\n':
+                    out.write('\n')
+
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_batch_worker,
+        ) as executor:
+            futures = {
+                executor.submit(_profile_batch_file, filename, options):
+                    filename
+                for filename in todo
+            }
+            for i, future in enumerate(as_completed(futures), 1):
+                filename = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # The worker died, e.g. out of memory
+                    record = {
+                        'file': filename,
+                        'error': '%s: %s' % (type(e).__name__, e),
+                    }
+                if 'error' in record:
+                    failed += 1
+                    logger.warning(
+                        "Error profiling %s: %s",
+                        filename, record['error'],
+                    )
+                else:
+                    logger.info("Profiled %s (%d/%d)", filename, i, len(todo))
+                out.write(json.dumps(record, sort_keys=True) + '\n')
+                out.flush()
+    return failed
+
+
 def main():
     parser = argparse.ArgumentParser('datamart_profiler')
     parser.add_argument('-v', action='count',
@@ -47,14 +198,49 @@ def main():
                         help="include a few random rows to the result")
     parser.add_argument('--no-coverage',
                         action='store_false', default=True, dest='coverage',
-                        help="don't compute data ranges (using k-means)")
+                        help="don't compute data ranges")
+    parser.add_argument('--ranges-engine', action='store',
+                        choices=['optimal', 'kmeans'], default=None,
+                        help="how to compute numerical and temporal ranges")
+    parser.add_argument('--adaptive-types', action='store_true',
+                        default=False,
+                        help="only inspect as many rows as needed to "
+                             "identify types")
+    parser.add_argument('--sketches', action='store_true', default=False,
+                        help="include mergeable summaries of the columns")
+    parser.add_argument('--append-to', action='store', default=None,
+                        help="profile (JSON, with sketches) of the data the "
+                             "file is appended to; the result is the profile "
+                             "of both")
+    parser.add_argument('--diagnostics', action='store_true', default=False,
+                        help="include the time and memory used by each "
+                             "profiling stage")
     parser.add_argument('--plots',
                         action='store_true', default=False, dest='plots',
                         help="compute plots (in vega format)")
     parser.add_argument('--load-max-size', action='store', nargs=1,
                         help="target size of the data to be analyzed. The "
                              "data will be randomly sampled if it is bigger")
-    parser.add_argument('file', nargs=1, help="file to profile")
+    parser.add_argument('--load-engine', action='store',
+                        choices=['pandas', 'pyarrow'], default=None,
+                        help="how to parse the CSV file; pyarrow uses less "
+                             "memory")
+    parser.add_argument('--workers', action='store', type=int, default=None,
+                        help="number of processes used to profile columns "
+                             "in parallel")
+    parser.add_argument('--batch', action='store', default=None,
+                        metavar='OUTPUT',
+                        help="profile many files (directories, glob "
+                             "patterns, or --manifest) in parallel, writing "
+                             "the results to OUTPUT as JSON Lines. Files "
+                             "already in OUTPUT are skipped")
+    parser.add_argument('--manifest', action='store', default=None,
+                        help="in batch mode, file listing the files to "
+                             "profile, one per line")
+    parser.add_argument('--jobs', action='store', type=int, default=None,
+                        help="in batch mode, number of files profiled in "
+                             "parallel (default: number of CPUs)")
+    parser.add_argument('file', nargs='*', help="file to profile")
     args = parser.parse_args()
 
     # Set up logging
@@ -64,16 +250,13 @@ def main():
     }.get(args.verbosity, logging.DEBUG)
     logging.basicConfig(level=level)
 
-    # Check for datamart-geo
-    try:
-        from datamart_geo import GeoData
-        geo_data = GeoData.from_local_cache()
-    except ImportError:
-        logger.info("datamart-geo not installed")
-        geo_data = None
-    except FileNotFoundError:
-        logger.warning("datamart-geo is installed but no data is available")
-        geo_data = None
+    if args.batch is None:
+        if len(args.file) != 1:
+            parser.error("expected one file to profile (or --batch)")
+        if args.manifest is not None:
+            parser.error("--manifest is only used with --batch")
+    elif args.append_to:
+        parser.error("--append-to can't be used with --batch")
 
     # Parse max size
     load_max_size = None
@@ -83,14 +266,41 @@ def main():
         else:
             load_max_size = parse_size(args.load_max_size[0])
 
-    # Profile
-    metadata = process_dataset(
-        args.file[0],
-        geo_data=geo_data,
+    # Load existing profile
+    append_to = None
+    if args.append_to:
+        with open(args.append_to) as fp:
+            append_to = json.load(fp)
+
+    options = dict(
         include_sample=args.include_sample,
         coverage=args.coverage,
         plots=args.plots,
         load_max_size=load_max_size,
+        load_engine=args.load_engine,
+        ranges_engine=args.ranges_engine,
+        adaptive_types=args.adaptive_types,
+        sketches=args.sketches,
+        diagnostics=args.diagnostics,
+    )
+
+    if args.batch is not None:
+        if args.workers is not None:
+            logger.warning("--workers is ignored in batch mode, use --jobs")
+        files = list_files(args.file, args.manifest)
+        failed = profile_batch(files, args.batch, options, jobs=args.jobs)
+        if failed:
+            logger.warning("%d files failed", failed)
+            sys.exit(1)
+        return
+
+    # Profile
+    metadata = process_dataset(
+        args.file[0],
+        geo_data=load_geo_data(),
+        workers=args.workers,
+        append_to=append_to,
+        **options
     )
 
     json.dump(metadata, sys.stdout, indent=2, sort_keys=True)
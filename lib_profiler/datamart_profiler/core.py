@@ -2,10 +2,8 @@ import codecs
 import collections
 import contextlib
 import csv
-from datetime import datetime
-import itertools
+import io
 import logging
-import math
 import numpy
 import opentelemetry.trace
 import os
@@ -14,15 +12,18 @@ from pandas.errors import EmptyDataError
 import prometheus_client
 import string
 import time
-import random
-import re
 import warnings
 
+from .diagnostics import StageRecorder
 from .numerical import mean_stddev, get_numerical_ranges
-from .profile_types import identify_types, determine_dataset_type
+from .plots import histogram_categorical, histogram_numerical, \
+    histogram_temporal, histogram_text
+from .profile_types import ColumnValues, identify_types, native_kind, \
+    determine_dataset_type
 from .spatial import LatLongColumn, Geohasher, nominatim_resolve_all, \
     pair_latlong_columns, get_spatial_ranges, parse_wkt_column
-from .temporal import get_temporal_resolution
+from .sketches import column_sketch, merge_profiles
+from .temporal import get_temporal_resolution, get_timestamps
 from . import types
 
 
@@ -38,13 +39,6 @@ SAMPLE_ROWS = 20
 MAX_UNCLEAN_ADDRESSES = 0.20  # 20%
 
 
-MAX_SKIPPED_ROWS = 6
-"""Maximum number of rows to discard at the top of the file"""
-
-HEADER_CONSISTENT_ROWS = 4
-"""Stop throwing out lines when that many in a row have same number of columns
-"""
-
 MAX_GEOHASHES = 100
 
 
@@ -66,15 +60,17 @@ PROM_SPATIAL = prometheus_client.Histogram(
     'profile_spatial_seconds', "Profile spatial coverage time",
     buckets=BUCKETS,
 )
+PROM_COLUMN_STAGES = prometheus_client.Histogram(
+    'profile_column_stage_seconds', "Time spent in each stage of a column",
+    ['stage', 'structural_type'],
+    buckets=BUCKETS,
+)
 PROM_LAZO = prometheus_client.Histogram(
     'profile_lazo_seconds', "Profile time with Lazo, time",
     buckets=BUCKETS,
 )
 
 
-_re_word_split = re.compile(r'\W+')
-
-
 csv.field_size_limit(2097152)  # Default 131072
 
 
@@ -132,48 +128,230 @@ def _lazo_retry(func):
     return func()
 
 
-def count_rows_to_skip(file):
-    """Count non-data rows at the top, such as titles etc.
+def _iter_record_blocks(file, block_size=1 << 20):
+    """Iterate on the raw records of a CSV file, by blocks.
+
+    A line break only ends a record if it comes after an even number of
+    quotes, so that quoted values containing line breaks stay whole.
+
+    :return: Iterator over tuples ``(block, starts, ends)`` where `block` is a
+        bytes object holding complete records, and `starts` and `ends` are
+        arrays of offsets of each record in it (including the line break)
     """
-    # Check whether this is a binary file
-    read_sample = file.read(4)
-    binary = not isinstance(read_sample, str)
-    file.seek(0, 0)
-
-    # Decode CSV
-    if binary:
-        codec_reader = codecs.getreader('utf-8')(file)
-        reader = csv.reader(codec_reader)
-    else:
-        reader = csv.reader(file)
+    text = isinstance(file.read(0), str)
+    rest = b''
+    quotes = 0  # Number of quotes in `rest`
+    while True:
+        chunk = file.read(block_size)
+        if not chunk:
+            break
+        if text:
+            chunk = chunk.encode('utf-8')
+        block = rest + chunk
+
+        array = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        offset = len(rest)
+        quote_counts = numpy.cumsum(array == ord('"')) + quotes
+        newlines = numpy.flatnonzero(array == ord('\n'))
+        ends = newlines[quote_counts[newlines] % 2 == 0] + (offset + 1)
+        if len(ends):
+            starts = numpy.concatenate([[0], ends[:-1]])
+            yield block, starts, ends
+            rest = block[ends[-1]:]
+            quotes = quote_counts[-1] - quote_counts[ends[-1] - offset - 1]
+        else:
+            rest = block
+            quotes = quote_counts[-1] if len(quote_counts) else quotes
+    if rest:
+        yield rest, numpy.array([0]), numpy.array([len(rest)])
 
-    # Read rows until the number of items stabilizes
-    run_start = 0
-    run_cols = None
-    run_len = 0
-    try:
-        for i, row in enumerate(itertools.islice(reader, MAX_SKIPPED_ROWS + HEADER_CONSISTENT_ROWS)):
-            if i >= MAX_SKIPPED_ROWS + HEADER_CONSISTENT_ROWS:
-                raise ValueError("Can't find consistent CSV data in file")
-            if len(row) == run_cols:
-                # Number of columns matches with run
-                run_len += 1
-                if run_len == HEADER_CONSISTENT_ROWS:
-                    # 4 rows with the same size, assume we're good
-                    return run_start
+
+def reservoir_sample(file, max_size, seed=RANDOM_SEED):
+    """Sample the records of a CSV file in a single pass.
+
+    The first records that fit in `max_size` bytes set the size `k` of the
+    sample. Every record gets a random key and the records with the `k`
+    smallest keys are kept, which is a uniform sample. Only the records whose
+    key is below the current `k`-th smallest key need to be looked at.
+
+    :return: A tuple ``(sample, nb_rows)`` where `sample` is the header and
+        the sampled records, in their original order, as a single str or
+        bytes object (same as what `file` returns), and `nb_rows` is the total
+        number of records (not counting the header)
+    """
+    text = isinstance(file.read(0), str)
+    rand = numpy.random.RandomState(seed)
+    header = None
+    nb_rows = 0
+    size = 0
+    k = None
+    threshold = 1.0
+
+    # Candidate records
+    keys = numpy.empty(0, dtype=numpy.float64)
+    indexes = numpy.empty(0, dtype=numpy.int64)
+    records = []
+
+    def prune():
+        nonlocal keys, indexes, records
+        keep = numpy.argpartition(keys, k - 1)[:k]
+        keys = keys[keep]
+        indexes = indexes[keep]
+        records = [records[i] for i in keep]
+        return keys.max()
+
+    for block, starts, ends in _iter_record_blocks(file):
+        if header is None:
+            header = block[starts[0]:ends[0]]
+            starts, ends = starts[1:], ends[1:]
+        block_keys = rand.random_sample(len(starts))
+
+        if k is None:
+            # Still filling up the first `max_size` bytes
+            sizes = numpy.cumsum(ends - starts) + size
+            full = numpy.flatnonzero(sizes >= max_size)
+            if len(full):
+                k = nb_rows + full[0] + 1
             else:
-                # Number of columns doesn't match, start new run
-                run_start = i
-                run_cols = len(row)
-                run_len = 1
+                size = sizes[-1] if len(sizes) else size
+            picked = numpy.arange(len(starts))
+        else:
+            picked = numpy.flatnonzero(block_keys < threshold)
+
+        keys = numpy.concatenate([keys, block_keys[picked]])
+        indexes = numpy.concatenate([indexes, picked + nb_rows])
+        records.extend(
+            block[s:e] for s, e in zip(starts[picked], ends[picked])
+        )
+        nb_rows += len(starts)
+        if k is not None and len(keys) >= 2 * k:
+            threshold = prune()
+
+    if header is None:
+        return file.read(0), 0
+    if k is not None and len(keys) > k:
+        prune()
+
+    # Put the records back in file order
+    records = [records[i] for i in numpy.argsort(indexes, kind='stable')]
+    if records and not records[-1].endswith(b'\n'):
+        records[-1] += b'\n'
+    if not header.endswith(b'\n'):
+        header += b'\n'
+    sample = b''.join([header] + records)
+    if text:
+        sample = sample.decode('utf-8')
+    return sample, nb_rows
+
+
+def _mangle_column_names(names):
+    """Make column names unique and non-empty, the same way pandas does.
+    """
+    names = [
+        name if name else 'Unnamed: %d' % i
+        for i, name in enumerate(names)
+    ]
+    header = set(names)
+    counts = collections.defaultdict(int)
+    result = []
+    for original in names:
+        name = original
+        count = counts[name]
+        while count > 0:
+            counts[original] = count + 1
+            name = '%s.%d' % (original, count)
+            if name in header:
+                count += 1
+            else:
+                count = counts[name]
+        result.append(name)
+        counts[name] = count + 1
+    return result
+
+
+def _read_csv_pyarrow(fp, column_names):
+    """Read a CSV file with pyarrow, into Arrow-backed string columns.
+
+    Each column is a contiguous buffer rather than a Python object per cell.
+
+    :param fp: A binary file object, positioned at the start of the file.
+    :param column_names: The header row.
+    :return: A DataFrame, or None if pyarrow is not available or can't read
+        this file, in which case `fp` has been rewound.
+    """
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        logger.warning("pyarrow is not installed, loading data with pandas")
+        return None
+
+    if not column_names:
+        return None
+
+    # Use generated names, since Arrow doesn't allow duplicates
+    arrow_names = ['c%d' % i for i in range(len(column_names))]
+    start = fp.tell()
+    try:
+        table = pyarrow.csv.read_csv(
+            fp,
+            read_options=pyarrow.csv.ReadOptions(
+                use_threads=True,
+                column_names=arrow_names,
+                skip_rows=1,
+            ),
+            parse_options=pyarrow.csv.ParseOptions(
+                newlines_in_values=True,
+            ),
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types={name: pyarrow.string() for name in arrow_names},
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+    except (pyarrow.ArrowInvalid, UnicodeDecodeError) as e:
+        logger.info("Can't load data with pyarrow, using pandas: %s", e)
+        fp.seek(start, 0)
+        return None
+
+    data = table.to_pandas(
+        types_mapper={pyarrow.string(): pandas.StringDtype('pyarrow')}.get,
+    )
+    data.columns = _mangle_column_names(column_names)
+    return data
+
+
+def _read_csv(fp, column_names, engine):
+    """Read a CSV file into a DataFrame of strings.
+
+    :param engine: ``'pandas'`` or ``'pyarrow'``. pyarrow only reads binary
+        file objects.
+    """
+    if engine == 'pyarrow':
+        data = _read_csv_pyarrow(fp, column_names)
+        if data is not None:
+            return data
+
+    return pandas.read_csv(fp, dtype=str, na_filter=False)
 
-        # Reached the end of the file
-        return run_start
-    finally:
-        file.seek(0, 0)
 
+def load_data(data, load_max_size=None, indexes=True, engine=None):
+    """Load the data into a DataFrame of strings.
+
+    :param data: A filename, a file object, or a DataFrame.
+    :param load_max_size: Target size of the data to be analyzed. The data
+        will be randomly sampled if it is bigger.
+    :param indexes: Whether to turn the index of a DataFrame into columns.
+    :param engine: How to parse CSV files. ``'pandas'`` (the default) or
+        ``'pyarrow'``, which uses less memory and can use multiple threads.
+        Files that pyarrow can't read are loaded using pandas.
+    :return: A tuple ``(data, metadata, column_names)``
+    """
+    if engine is None:
+        engine = 'pandas'
+    elif engine not in ('pandas', 'pyarrow'):
+        raise ValueError("Invalid load engine %r" % engine)
 
-def load_data(data, load_max_size=None, indexes=True):
     metadata = {}
 
     if isinstance(data, pandas.DataFrame):
@@ -194,9 +372,21 @@ def load_data(data, load_max_size=None, indexes=True):
             data = data.reset_index()
 
         metadata['nb_rows'] = len(data)
-        # Change to object dtype first and do fillna() to work around bug
-        # https://github.com/pandas-dev/pandas/issues/25353 (nan as str 'nan')
-        data = data.astype(object).fillna('').astype(str)
+        # Keep numbers and datetimes, they are profiled from their dtype.
+        # Turn the other columns into strings
+        if not all(native_kind(dtype) is not None for dtype in data.dtypes):
+            columns = []
+            for i, dtype in enumerate(data.dtypes):
+                column = data.iloc[:, i]
+                if native_kind(dtype) is None:
+                    # Change to object dtype first and do fillna() to work
+                    # around bug https://github.com/pandas-dev/pandas/issues/25353
+                    # (nan as str 'nan')
+                    column = column.astype(object).fillna('').astype(str)
+                columns.append(column)
+            column_names = data.columns
+            data = pandas.concat(columns, axis=1)
+            data.columns = column_names
 
         column_names = data.columns
     else:
@@ -227,6 +417,8 @@ def load_data(data, load_max_size=None, indexes=True):
             read_sample = data.read(4)
             data.seek(0, 0)
             if isinstance(read_sample, str):
+                # pyarrow can only read bytes
+                engine = 'pandas'
                 reader = csv.reader(data)
                 try:
                     column_names = next(reader)
@@ -246,32 +438,25 @@ def load_data(data, load_max_size=None, indexes=True):
 
             # Load the data
             if metadata['size'] > load_max_size:
-                logger.info("Counting rows...")
-                metadata['nb_rows'] = sum(1 for _ in data)
+                # Sub-sample
+                logger.info("Sampling rows...")
+                sample, metadata['nb_rows'] = reservoir_sample(
+                    data, load_max_size,
+                )
                 if metadata['nb_rows'] > 0:
                     metadata['average_row_size'] = (
                         metadata['size'] / metadata['nb_rows']
                     )
-                data.seek(0, 0)
-
-                # Sub-sample
-                ratio = load_max_size / metadata['size']
-                logger.info("Loading dataframe, sample ratio=%r...", ratio)
-                rand = random.Random(RANDOM_SEED)
-                selected_rows = set(rand.sample(
-                    range(1, metadata['nb_rows']),
-                    math.ceil(ratio * (metadata['nb_rows'] - 1)),
-                ))
-                selected_rows.add(0)  # Always get the header
-                data = pandas.read_csv(
-                    data,
-                    dtype=str, na_filter=False,
-                    skiprows=lambda i: i not in selected_rows,
-                )
+                logger.info("Loading dataframe, %d rows...",
+                            metadata['nb_rows'])
+                if isinstance(sample, str):
+                    sample = io.StringIO(sample)
+                else:
+                    sample = io.BytesIO(sample)
+                data = _read_csv(sample, column_names, engine)
             else:
                 logger.info("Loading dataframe...")
-                data = pandas.read_csv(data,
-                                       dtype=str, na_filter=False)
+                data = _read_csv(data, column_names, engine)
 
                 metadata['nb_rows'] = data.shape[0]
                 if metadata['nb_rows'] > 0:
@@ -293,11 +478,33 @@ def process_column(
     coverage=True,
     geo_data=None,
     nominatim=None,
+    nominatim_cache=None,
+    ranges_engine=None,
+    adaptive_types=False,
+    sketches=False,
+    diagnostics=None,
 ):
+    # Record stages, for metrics and optionally the diagnostics
+    if diagnostics is not None:
+        recorder = diagnostics
+    else:
+        recorder = StageRecorder()
+
+    # Factorize the values, so most of the work only has to be done once for
+    # each distinct value
+    if isinstance(array, ColumnValues):
+        column = array
+    else:
+        column = ColumnValues(array)
+
     # Identify types
-    with tracer.start_as_current_span('profile/identify_types'):
+    with recorder.stage('identify_types') as stage:
         structural_type, semantic_types_dict, additional_meta = \
-            identify_types(array, column_meta['name'], geo_data, manual)
+            identify_types(
+                column, column_meta['name'], geo_data, manual,
+                adaptive=adaptive_types,
+            )
+        stage['rows'] = additional_meta.get('num_inspected_rows', len(column))
     logger.info(
         "Column type %s [%s]",
         structural_type,
@@ -319,129 +526,60 @@ def process_column(
     resolved = {}
 
     # Compute ranges for numerical data
+    numerical_values = None
     if (
         structural_type in (types.INTEGER, types.FLOAT)
-        and (coverage or plots)
+        and (coverage or plots or sketches)
     ):
         # Get numerical values needed for either ranges or plot
-        with tracer.start_as_current_span('profile/parse_numerical_values'):
-            numerical_values = []
-            for e in array:
-                try:
-                    e = float(e)
-                except ValueError:
-                    pass
-                else:
-                    if -3.4e38 < e < 3.4e38:  # Overflows in ES
-                        numerical_values.append(e)
+        with recorder.stage('parse_numerical_values', len(column)):
+            numerical_values = column.numbers()
+            numerical_values = numerical_values[
+                # Drops NaN, infinities, and values that overflow in ES
+                numpy.abs(numerical_values) < 3.4e38
+            ]
 
         # Compute ranges from numerical values
         if coverage:
-            with tracer.start_as_current_span('profile/numerical_ranges'):
+            with recorder.stage('numerical_ranges', len(numerical_values)):
                 column_meta['mean'], column_meta['stddev'] = \
                     mean_stddev(numerical_values)
 
-                ranges = get_numerical_ranges(numerical_values)
+                ranges = get_numerical_ranges(
+                    numerical_values,
+                    engine=ranges_engine,
+                )
                 if ranges:
                     column_meta['coverage'] = ranges
 
         # Compute histogram from numerical values
         if plots:
-            with tracer.start_as_current_span('profile/numerical_plot'):
-                counts, edges = numpy.histogram(
-                    numerical_values,
-                    bins=10,
-                )
-                counts = [int(i) for i in counts]
-                edges = [float(f) for f in edges]
-                column_meta['plot'] = {
-                    "type": "histogram_numerical",
-                    "data": [
-                        {
-                            "count": count,
-                            "bin_start": edges[i],
-                            "bin_end": edges[i + 1],
-                        }
-                        for i, count in enumerate(counts)
-                    ]
-                }
+            with recorder.stage('numerical_plot', len(numerical_values)):
+                column_meta['plot'] = histogram_numerical(numerical_values)
 
     if types.DATE_TIME in semantic_types_dict:
         datetimes = semantic_types_dict[types.DATE_TIME]
         resolved['datetimes'] = datetimes
-        timestamps = numpy.empty(
-            len(datetimes),
-            dtype='float32',
-        )
-        for j, dt in enumerate(datetimes):
-            timestamps[j] = dt.timestamp()
+        timestamps = get_timestamps(datetimes)
         resolved['timestamps'] = timestamps
 
         # Compute histogram from temporal values
         if plots and 'plot' not in column_meta:
-            with tracer.start_as_current_span('profile/temporal_plot'):
-                counts, edges = numpy.histogram(timestamps, bins=10)
-                counts = [int(i) for i in counts]
-                column_meta['plot'] = {
-                    "type": "histogram_temporal",
-                    "data": [
-                        {
-                            "count": count,
-                            "date_start": datetime.utcfromtimestamp(
-                                float(edges[i]),
-                            ).isoformat(),
-                            "date_end": datetime.utcfromtimestamp(
-                                float(edges[i + 1]),
-                            ).isoformat(),
-                        }
-                        for i, count in enumerate(counts)
-                    ]
-                }
+            with recorder.stage('temporal_plot', len(timestamps)):
+                column_meta['plot'] = histogram_temporal(timestamps)
 
     # Compute histogram from categorical values
     if plots and types.CATEGORICAL in semantic_types_dict:
-        with tracer.start_as_current_span('profile/categorical_plot'):
-            counter = collections.Counter()
-            for value in array:
-                if not value:
-                    continue
-                counter[value] += 1
-            counts = counter.most_common(5)
-            counts = sorted(counts)
-            column_meta['plot'] = {
-                "type": "histogram_categorical",
-                "data": [
-                    {
-                        "bin": value,
-                        "count": count,
-                    }
-                    for value, count in counts
-                ]
-            }
+        with recorder.stage('categorical_plot', len(column)):
+            column_meta['plot'] = histogram_categorical(column)
 
     # Compute histogram from textual values
     if (
         plots and types.TEXT in semantic_types_dict and
         'plot' not in column_meta
     ):
-        with tracer.start_as_current_span('profile/textual_plot'):
-            counter = collections.Counter()
-            for value in array:
-                for word in _re_word_split.split(value):
-                    word = word.lower()
-                    if word:
-                        counter[word] += 1
-            counts = counter.most_common(5)
-            column_meta['plot'] = {
-                "type": "histogram_text",
-                "data": [
-                    {
-                        "bin": value,
-                        "count": count,
-                    }
-                    for value, count in counts
-                ]
-            }
+        with recorder.stage('textual_plot', len(column)):
+            column_meta['plot'] = histogram_text(column)
 
     # Resolve addresses into coordinates
     if (
@@ -450,10 +588,11 @@ def process_column(
         types.TEXT in semantic_types_dict and
         types.ADMIN not in semantic_types_dict
     ):
-        with tracer.start_as_current_span('profile/nominatim'):
+        with recorder.stage('nominatim', len(column)):
             locations, non_empty = nominatim_resolve_all(
                 nominatim,
-                array,
+                column.array,
+                cache=nominatim_cache,
             )
         if non_empty > 0:
             unclean_ratio = 1.0 - len(locations) / non_empty
@@ -469,9 +608,260 @@ def process_column(
             column_meta['admin_area_level'] = level
         resolved['admin_areas'] = areas
 
+    # Compute mergeable sketches, used to update the profile when rows are
+    # appended
+    if sketches:
+        with recorder.stage('sketches', len(column)):
+            resolved['sketch'] = column_sketch(
+                column,
+                numerical_values,
+                resolved.get('timestamps'),
+            )
+
+    # In a worker process, the metrics are reported by the parent
+    if not _in_worker:
+        _observe_column_stages(recorder.stages, structural_type)
+    if diagnostics is not None:
+        resolved['diagnostics'] = recorder.stages
+
     return resolved
 
 
+def _observe_column_stages(stages, structural_type):
+    for name, stage in stages.items():
+        PROM_COLUMN_STAGES.labels(name, structural_type).observe(stage['time'])
+
+
+def encode_column(array):
+    """Encode a column into a compact buffer that can be shared with workers.
+
+    The layout is similar to Arrow's dictionary-encoded string arrays: the
+    codes of each row, then the offsets and UTF-8 data of the distinct values.
+    """
+    column = ColumnValues(array)
+    encoded = [value.encode('utf-8', 'surrogatepass')
+               for value in column.uniques]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(b) for b in encoded], out=offsets[1:])
+    header = numpy.array([len(column.codes), len(encoded)], dtype=numpy.int64)
+    return b''.join([
+        header.tobytes(),
+        column.codes.astype(numpy.int64).tobytes(),
+        offsets.tobytes(),
+    ] + encoded)
+
+
+def decode_column(buf):
+    """Decode a buffer created by :func:`encode_column` into `ColumnValues`.
+    """
+    nb_rows, nb_uniques = numpy.frombuffer(buf, dtype=numpy.int64, count=2)
+    pos = 16
+    codes = numpy.frombuffer(
+        buf, dtype=numpy.int64, count=nb_rows, offset=pos,
+    ).copy()
+    pos += 8 * nb_rows
+    offsets = numpy.frombuffer(
+        buf, dtype=numpy.int64, count=nb_uniques + 1, offset=pos,
+    ).tolist()
+    pos += 8 * (nb_uniques + 1)
+    data = bytes(buf[pos:pos + offsets[-1]])
+    uniques = [
+        data[offsets[i]:offsets[i + 1]].decode('utf-8', 'surrogatepass')
+        for i in range(nb_uniques)
+    ]
+    return ColumnValues.from_factorized(codes, uniques)
+
+
+class _SharedColumn(object):
+    """Encoded column, in shared memory if available, else pickled bytes.
+
+    Columns of numbers and datetimes are pickled as they are.
+    """
+    def __init__(self, array):
+        self.native = None
+        if native_kind(array.dtype) is not None:
+            self.native = array
+            self.shm = None
+            self.data = None
+            return
+        buf = encode_column(array)
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:  # Python < 3.8
+            self.shm = None
+            self.data = buf
+        else:
+            self.shm = shared_memory.SharedMemory(create=True, size=len(buf))
+            self.shm.buf[:len(buf)] = buf
+            self.data = None
+
+    def __getstate__(self):
+        if self.native is not None:
+            return {'native': self.native}
+        elif self.shm is not None:
+            return {'shm_name': self.shm.name}
+        else:
+            return {'data': self.data}
+
+    def __setstate__(self, state):
+        self.native = None
+        self.shm = None
+        self.data = None
+        self.__dict__.update(state)
+
+    def read(self):
+        if self.native is not None:
+            return ColumnValues(self.native)
+        elif self.data is not None:
+            return decode_column(self.data)
+        shm = _attach_shared_memory(self.shm_name)
+        try:
+            return decode_column(shm.buf)
+        finally:
+            shm.close()
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+def _attach_shared_memory(name):
+    """Attach to a segment created by the parent process, which owns it.
+
+    The segment must not be registered with the resource tracker here, or it
+    would be reported as leaked (and unlinked) when the worker exits.
+    """
+    from multiprocessing import resource_tracker, shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+_in_worker = False
+_worker_geo_data = None
+
+
+def _init_worker(geo_data_path):
+    global _in_worker, _worker_geo_data
+
+    _in_worker = True
+    if geo_data_path is not None:
+        from datamart_geo import GeoData
+
+        _worker_geo_data = GeoData(geo_data_path)
+
+
+def _process_column_worker(shared_column, column_meta, kwargs):
+    # Always record the stages, the parent process reports them
+    recorder = StageRecorder(memory=bool(kwargs.get('diagnostics')))
+    kwargs = dict(kwargs, diagnostics=recorder)
+    start = time.time_ns()
+    column = shared_column.read()
+    resolved = process_column(
+        column, column_meta,
+        geo_data=_worker_geo_data,
+        **kwargs
+    )
+    resolved['span'] = start, time.time_ns()
+    # Areas reference the GeoData object, send their attributes instead
+    if 'admin_areas' in resolved:
+        resolved['admin_areas'] = [
+            (
+                area.id, area.name, area.type, area.levels,
+                area.latitude, area.longitude, area.bounds,
+            )
+            if area is not None else None
+            for area in resolved['admin_areas']
+        ]
+    return column_meta, resolved
+
+
+def process_columns_parallel(data, columns, manual_columns, workers,
+                             geo_data=None, geo_data_path=None, **kwargs):
+    """Run :func:`process_column` for all columns in a pool of processes.
+
+    If `geo_data` is set, each worker loads the GeoData from `geo_data_path`,
+    or from the local cache if it is None.
+
+    The stages of each column are reported to Prometheus by the current
+    process, and a ``profile/column`` span is recorded for each column with
+    the times it was processed. The spans of the stages inside a worker are
+    not collected.
+
+    :return: A dict mapping column indexes to resolved values
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if geo_data is None:
+        geo_data_path = None
+    elif geo_data_path is None:
+        from datamart_geo import GeoData
+
+        geo_data_path = GeoData.get_local_cache_path()
+
+    shared_columns = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(geo_data_path,),
+        ) as executor:
+            futures = []
+            for column_idx, column_meta in enumerate(columns):
+                shared_column = _SharedColumn(data.iloc[:, column_idx])
+                shared_columns.append(shared_column)
+                futures.append(executor.submit(
+                    _process_column_worker,
+                    shared_column,
+                    column_meta,
+                    dict(
+                        kwargs,
+                        manual=manual_columns.get(column_meta['name']),
+                    ),
+                ))
+
+            # Get results in the original order
+            resolved_columns = {}
+            for column_idx, future in enumerate(futures):
+                column_meta, resolved = future.result()
+                columns[column_idx].update(column_meta)
+                start, end = resolved.pop('span')
+                tracer.start_span(
+                    'profile/column',
+                    attributes={'idx': column_idx, 'name': column_meta['name']},
+                    start_time=start,
+                ).end(end_time=end)
+                _observe_column_stages(
+                    resolved['diagnostics'],
+                    column_meta['structural_type'],
+                )
+                if not kwargs.get('diagnostics'):
+                    del resolved['diagnostics']
+                if 'admin_areas' in resolved:
+                    from datamart_geo import Area
+
+                    resolved['admin_areas'] = [
+                        Area(geo_data, *area) if area is not None else None
+                        for area in resolved['admin_areas']
+                    ]
+                resolved_columns[column_idx] = resolved
+    finally:
+        for shared_column in shared_columns:
+            shared_column.release()
+
+    return resolved_columns
+
+
 @PROM_LAZO.time()
 def lazo_index_data(
     data,
@@ -523,10 +913,13 @@ def get_lazo_data_sketch(
 
 @PROM_PROFILE.time()
 def process_dataset(data, dataset_id=None, metadata=None,
-                    lazo_client=None, nominatim=None, geo_data=None,
+                    lazo_client=None, nominatim=None, nominatim_cache=None,
+                    geo_data=None, geo_data_path=None,
                     search=False, include_sample=False,
                     coverage=True, plots=False, indexes=True,
-                    load_max_size=None,
+                    load_max_size=None, load_engine=None, workers=None,
+                    ranges_engine=None, adaptive_types=False,
+                    sketches=False, append_to=None, diagnostics=False,
                     **kwargs):
     """Compute all metafeatures from a dataset.
 
@@ -536,8 +929,13 @@ def process_dataset(data, dataset_id=None, metadata=None,
         very limited).
     :param lazo_client: client for the Lazo Index Server
     :param nominatim: URL of the Nominatim server
+    :param nominatim_cache: Persistent cache for the addresses resolved with
+        Nominatim, such as a `datamart_profiler.spatial.NominatimCache`
     :param geo_data: ``True`` or a datamart_geo.GeoData instance to use to
         resolve named administrative territorial entities
+    :param geo_data_path: The directory `geo_data` was loaded from, where
+        worker processes load it from (see `workers`). Defaults to the local
+        cache.
     :param search: True if this method is being called during the search
         operation (and not for indexing).
     :param include_sample: Set to True to include a few random rows to the
@@ -550,6 +948,31 @@ def process_dataset(data, dataset_id=None, metadata=None,
     :param load_max_size: Target size of the data to be analyzed. The data will
         be randomly sampled if it is bigger. Defaults to `MAX_SIZE`, currently
         5 MB. This is different from the sample data included in the result.
+    :param load_engine: How to parse CSV files, ``'pandas'`` (the default)
+        or ``'pyarrow'``, which keeps the columns in Arrow buffers rather than
+        one Python object per cell, using much less memory. Files that pyarrow
+        can't read are loaded with pandas.
+    :param workers: Number of processes to use to profile columns in
+        parallel. If None or 1 (the default), columns are processed one after
+        the other in the current process. Workers load the geo data from
+        `geo_data_path` if `geo_data` is set. The tracing spans of the stages
+        of each column are not collected from the workers.
+    :param ranges_engine: How to compute numerical and temporal ranges,
+        ``'optimal'`` (exact 1-D segmentation, the default) or ``'kmeans'``.
+    :param adaptive_types: If True, only inspect as many rows of each column
+        as needed to identify its types with high probability (in random
+        order, by blocks of increasing size). The number of rows inspected is
+        recorded as ``num_inspected_rows``, and the ratios of missing and
+        unclean values are estimated from those rows.
+    :param sketches: If True, include mergeable summaries of the columns in
+        the result, under ``sketches``.
+    :param append_to: The profile of a dataset, including sketches, to which
+        the data is appended. Only the new rows are profiled, and the result is
+        merged into that profile (textual columns are not indexed with Lazo).
+    :param diagnostics: If True, record the time, number of rows and memory
+        allocated by each stage, for the dataset and for each column, under
+        ``diagnostics``. This is meant for troubleshooting, and should not be
+        indexed. Measuring memory slows down profiling.
     :return: JSON structure (dict)
     """
     if 'sample_size' in kwargs:
@@ -572,15 +995,28 @@ def process_dataset(data, dataset_id=None, metadata=None,
     if metadata is None:
         metadata = {}
 
+    recorder = StageRecorder(memory=diagnostics)
+
+    if append_to is not None:
+        if 'sketches' not in append_to:
+            raise ValueError("Profile to append to doesn't include sketches")
+        sketches = True
+        lazo_client = None
+
     # Load or prepare data for processing
     try:
-        data, file_metadata, column_names = load_data(
-            data,
-            load_max_size=load_max_size,
-            indexes=indexes,
-        )
+        with recorder.stage('load_data') as stage:
+            data, file_metadata, column_names = load_data(
+                data,
+                load_max_size=load_max_size,
+                indexes=indexes,
+                engine=load_engine,
+            )
+            stage['rows'] = data.shape[0]
     except EmptyDataError:
         logger.warning("Dataframe is empty!")
+        if append_to is not None:
+            return append_to
         metadata['nb_rows'] = 0
         metadata['nb_profiled_rows'] = 0
         metadata['columns'] = []
@@ -606,6 +1042,8 @@ def process_dataset(data, dataset_id=None, metadata=None,
 
     if data.shape[0] == 0:
         logger.info("0 rows, returning early")
+        if append_to is not None:
+            return append_to
         metadata['types'] = []
         return metadata
 
@@ -627,25 +1065,48 @@ def process_dataset(data, dataset_id=None, metadata=None,
     # Identify types
     logger.info("Identifying types, %d columns...", len(columns))
     with PROM_TYPES.time():
-        with tracer.start_as_current_span('profile/columns'):
-            for column_idx, column_meta in enumerate(columns):
-                name = column_meta['name']
-                with tracer.start_as_current_span('profile/column', attributes={'idx': column_idx, 'name': name}):
-                    logger.info("Processing column %d %r...", column_idx, name)
-                    array = data.iloc[:, column_idx]
-                    if name in manual_columns:
-                        manual = manual_columns[name]
-                    else:
-                        manual = None
-                    # Process the column, updating the column_meta dict
-                    resolved_columns[column_idx] = process_column(
-                        array, column_meta,
-                        manual=manual,
-                        plots=plots,
-                        coverage=coverage,
-                        geo_data=geo_data,
-                        nominatim=nominatim,
-                    )
+        with recorder.stage('columns', data.shape[0] * data.shape[1]):
+            if workers is not None and workers > 1:
+                logger.info("Using %d worker processes", workers)
+                resolved_columns = process_columns_parallel(
+                    data, columns, manual_columns, workers,
+                    plots=plots,
+                    coverage=coverage,
+                    geo_data=geo_data,
+                    geo_data_path=geo_data_path,
+                    nominatim=nominatim,
+                    nominatim_cache=nominatim_cache,
+                    ranges_engine=ranges_engine,
+                    adaptive_types=adaptive_types,
+                    sketches=sketches,
+                    diagnostics=diagnostics,
+                )
+            else:
+                for column_idx, column_meta in enumerate(columns):
+                    name = column_meta['name']
+                    with tracer.start_as_current_span('profile/column', attributes={'idx': column_idx, 'name': name}):
+                        logger.info("Processing column %d %r...", column_idx, name)
+                        array = data.iloc[:, column_idx]
+                        if name in manual_columns:
+                            manual = manual_columns[name]
+                        else:
+                            manual = None
+                        # Process the column, updating the column_meta dict
+                        resolved_columns[column_idx] = process_column(
+                            array, column_meta,
+                            manual=manual,
+                            plots=plots,
+                            coverage=coverage,
+                            geo_data=geo_data,
+                            nominatim=nominatim,
+                            nominatim_cache=nominatim_cache,
+                            ranges_engine=ranges_engine,
+                            adaptive_types=adaptive_types,
+                            sketches=sketches,
+                            diagnostics=(
+                                recorder.child() if diagnostics else None
+                            ),
+                        )
 
     # Textual columns
     columns_textual = [
@@ -657,7 +1118,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
         )
     ]
     if lazo_client and columns_textual:
-        with tracer.start_as_current_span('profile/categorical'):
+        with recorder.stage('categorical', len(columns_textual)):
             # Indexing with lazo
             column_textual_names = [columns[idx]['name'] for idx in columns_textual]
             if not search:
@@ -749,7 +1210,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
         logger.info("Computing spatial coverage...")
         spatial_coverage = []
         with PROM_SPATIAL.time():
-            with tracer.start_as_current_span('profile/spatial_coverage'):
+            with recorder.stage('spatial_coverage'):
                 # Compute sketches from lat/long pairs
                 for col_lat, col_long in latlong_pairs:
                     lat_values = data.iloc[:, col_lat.index]
@@ -796,11 +1257,10 @@ def process_dataset(data, dataset_id=None, metadata=None,
                         continue
                     latlong = col.get('point_format') == 'lat,long'
                     name = col['name']
-                    values = parse_wkt_column(
+                    values, total = parse_wkt_column(
                         data.iloc[:, i],
                         latlong=latlong,
                     )
-                    total = numpy.sum(data.iloc[:, i].apply(lambda x: bool(x)))
                     if len(values) < 0.5 * total:
                         logger.warning(
                             "Most data points did not parse correctly as "
@@ -808,7 +1268,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
                             'lat,long' if latlong else 'long,lat',
                             i, col,
                         )
-                    if values:
+                    if len(values):
                         logger.info(
                             "Computing spatial sketches point=%r (%d rows)",
                             name, len(values),
@@ -928,7 +1388,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
         logging.info("Computing temporal coverage...")
         temporal_coverage = []
 
-        with tracer.start_as_current_span('profile/temporal_coverage'):
+        with recorder.stage('temporal_coverage'):
             # Datetime columns
             for idx, col in enumerate(columns):
                 if types.DATE_TIME not in col['semantic_types']:
@@ -941,7 +1401,10 @@ def process_dataset(data, dataset_id=None, metadata=None,
                 )
 
                 # Get temporal ranges
-                ranges = get_numerical_ranges(timestamps)
+                ranges = get_numerical_ranges(
+                    timestamps,
+                    engine=ranges_engine,
+                )
                 if not ranges:
                     continue
 
@@ -973,7 +1436,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
 
     # Sample data
     if include_sample:
-        with tracer.start_as_current_span('profile/sample'):
+        with recorder.stage('sample'):
             rand = numpy.random.RandomState(RANDOM_SEED)
             choose_rows = rand.choice(
                 len(data),
@@ -982,9 +1445,42 @@ def process_dataset(data, dataset_id=None, metadata=None,
             )
             choose_rows.sort()  # Keep it in order
             sample = data.iloc[choose_rows]
+            # Numbers and datetimes were kept by load_data(), turn them into
+            # strings the same way
+            sample = sample.astype(object).fillna('').astype(str)
             sample = sample.applymap(truncate_string)  # Truncate long values
             metadata['sample'] = sample.to_csv(index=False, line_terminator='\r\n')
 
+    if sketches:
+        metadata['sketches'] = {
+            'columns': [
+                resolved_columns[idx]['sketch']
+                for idx in range(len(columns))
+            ],
+        }
+
+    if append_to is not None:
+        logger.info("Merging into existing profile")
+        with recorder.stage('merge'):
+            metadata = merge_profiles(
+                append_to, metadata,
+                max_geohashes=MAX_GEOHASHES,
+            )
+
+    # Time and memory of each stage, if requested
+    if diagnostics:
+        metadata['diagnostics'] = {
+            'stages': recorder.stages,
+            'columns': [
+                {
+                    'name': col['name'],
+                    'structural_type': col['structural_type'],
+                    'stages': resolved_columns[idx]['diagnostics'],
+                }
+                for idx, col in enumerate(columns)
+            ],
+        }
+
     # Return it -- it will be inserted into Elasticsearch, and published to the
     # feed and the waiting on-demand searches
     return metadata
@@ -0,0 +1,88 @@
+import contextlib
+import opentelemetry.trace
+import time
+import tracemalloc
+
+
+tracer = opentelemetry.trace.get_tracer(__name__)
+
+
+class _TracingState(object):
+    def __init__(self):
+        self.stack = []
+        self.started = False
+
+
+class StageRecorder(object):
+    """Records the wall time, rows and allocated memory of profiling stages.
+
+    Each stage is also a tracing span, named ``profile/<stage>``.
+
+    If `memory` is True, the memory allocated during each stage is measured
+    using tracemalloc, which is only running while a stage is (unless it was
+    already started by someone else).
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+        self._state = _TracingState()
+
+    def child(self):
+        """Get a recorder for sub-stages, e.g. for a column.
+
+        Its stages are recorded separately, but memory is measured correctly
+        if they run inside a stage of this recorder.
+        """
+        recorder = StageRecorder(self.memory)
+        recorder._state = self._state
+        return recorder
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None, attributes=None):
+        """Record a stage.
+
+        This yields a dict, in which the number of rows processed can be set
+        under ``'rows'`` if it is not known beforehand.
+        """
+        state = self._state
+        info = {'rows': rows}
+        entry = None
+        if self.memory:
+            if not state.stack and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                state.started = True
+            current, peak = tracemalloc.get_traced_memory()
+            # Propagate the peak so far to the enclosing stages, since we are
+            # resetting it
+            for outer in state.stack:
+                if outer is not None:
+                    outer['peak'] = max(outer['peak'], peak)
+            tracemalloc.reset_peak()
+            entry = {'start': current, 'peak': current}
+        state.stack.append(entry)
+        start = time.perf_counter()
+        try:
+            with tracer.start_as_current_span(
+                'profile/' + name,
+                attributes=attributes,
+            ):
+                yield info
+        finally:
+            elapsed = time.perf_counter() - start
+            state.stack.pop()
+            stage = self.stages.setdefault(name, {'time': 0.0})
+            stage['time'] += elapsed
+            if info['rows'] is not None:
+                stage['rows'] = stage.get('rows', 0) + info['rows']
+            if entry is not None:
+                peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+                stage['allocated'] = max(
+                    stage.get('allocated', 0),
+                    peak - entry['start'],
+                )
+                for outer in state.stack:
+                    if outer is not None:
+                        outer['peak'] = max(outer['peak'], peak)
+                if not state.stack and state.started:
+                    tracemalloc.stop()
+                    state.started = False
@@ -1,8 +1,5 @@
 import logging
-import math
 import numpy
-from sklearn.cluster import KMeans
-from sklearn.exceptions import ConvergenceWarning
 
 from .warning_tools import ignore_warnings
 
@@ -13,69 +10,210 @@ logger = logging.getLogger(__name__)
 N_RANGES = 3
 MIN_RANGE_SIZE = 0.1  # 10%
 
+# Engine used to split values into ranges, 'kmeans' or 'optimal'
+RANGES_ENGINE = 'optimal'
+
+# Maximum number of groups of values the 'optimal' engine works with. Above
+# this number of distinct values, neighboring values get grouped into bins,
+# split at quantiles and at the biggest gaps, and only the bin edges are
+# considered
+MAX_SEGMENTATION_GROUPS = 1000
+
 
 def mean_stddev(array):
     """Compute the mean (average) and standard deviation of a numerical array.
     """
-    total = 0
-    count = 0
-    for elem in array:
-        if elem is not None:
-            total += elem
-            count += 1
-    mean = total / count if count > 0 else 0
+    if not isinstance(array, numpy.ndarray):
+        array = numpy.array(
+            [elem for elem in array if elem is not None],
+            dtype=numpy.float64,
+        )
+    if not len(array):
+        return 0, 0
+
+    mean = array.mean()
+    stddev = numpy.sqrt(((array - mean) ** 2).mean())
 
-    total = 0
-    for elem in array:
-        if elem is not None:
-            elem = elem - mean
-            total += elem * elem
-    stddev = math.sqrt(total / count) if count > 0 else 0
+    return float(mean), float(stddev)
 
-    return mean, stddev
 
+def _kmeans_segments(values, n_segments, weights=None):
+    """Split values into clusters using K-Means.
 
-def get_numerical_ranges(values):
+    :param values: 1-D array
+    :param weights: Optional weight of each value
+    :return: List of arrays, the indexes of the values in each cluster
+    """
+    # Imported here, scikit-learn takes a long time to import
+    from sklearn.cluster import KMeans
+    from sklearn.exceptions import ConvergenceWarning
+
+    clustering = KMeans(n_clusters=n_segments, random_state=0)
+    with ignore_warnings(ConvergenceWarning):
+        clustering.fit(values.reshape(-1, 1), sample_weight=weights)
+    logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
+
+    return [
+        numpy.flatnonzero(clustering.labels_ == rg)
+        for rg in range(n_segments)
+    ]
+
+
+def _optimal_segments(values, n_segments, weights=None):
+    """Split values into segments minimizing the sum of squared deviations.
+
+    This is the 1-D version of the K-Means problem, which can be solved
+    exactly with dynamic programming on sorted values (Jenks natural breaks,
+    Ckmeans). Equal values always end up in the same segment.
+
+    :param values: 1-D array
+    :param weights: Optional weight of each value
+    :return: List of arrays, the indexes of the values in each segment, in
+        order of increasing values
+    """
+    order = numpy.argsort(values, kind='stable')
+    values = values[order].astype(numpy.float64)
+    nb_values = len(values)
+    if weights is None:
+        weights = numpy.ones(nb_values)
+    else:
+        weights = weights[order]
+
+    # Start of each group of equal values
+    starts = numpy.concatenate([[0], numpy.flatnonzero(numpy.diff(values)) + 1])
+    if len(starts) > MAX_SEGMENTATION_GROUPS:
+        # Only keep group boundaries close to quantiles, and at the biggest
+        # gaps between values
+        nb_groups = MAX_SEGMENTATION_GROUPS // 2
+        cumulative = numpy.concatenate([[0.0], numpy.cumsum(weights)])
+        targets = numpy.arange(1, nb_groups) * (cumulative[-1] / nb_groups)
+        idx = numpy.searchsorted(cumulative[starts], targets)
+        gaps = values[starts[1:]] - values[starts[1:] - 1]
+        biggest = numpy.argpartition(gaps, -nb_groups)[-nb_groups:]
+        starts = numpy.unique(numpy.concatenate([
+            [0], starts[idx[idx < len(starts)]], starts[1:][biggest],
+        ]))
+    n_segments = min(n_segments, len(starts))
+
+    # Prefix sums of weights, values and squares, centered and scaled
+    mean = numpy.average(values, weights=weights)
+    centered = values - mean
+    scale = numpy.sqrt(numpy.average(centered * centered, weights=weights))
+    if scale > 0:
+        centered /= scale
+    counts = numpy.concatenate([[0.0], numpy.cumsum(
+        numpy.add.reduceat(weights, starts)
+    )])
+    sums = numpy.concatenate([[0.0], numpy.cumsum(
+        numpy.add.reduceat(weights * centered, starts)
+    )])
+    squares = numpy.concatenate([[0.0], numpy.cumsum(
+        numpy.add.reduceat(weights * centered * centered, starts)
+    )])
+
+    # cost[i, j] is the sum of squared deviations of groups i to j - 1
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cost = (
+            (squares[None, :] - squares[:, None])
+            - (sums[None, :] - sums[:, None]) ** 2
+            / (counts[None, :] - counts[:, None])
+        )
+    size = len(starts) + 1
+    cost[numpy.tril_indices(size)] = numpy.inf
+
+    # best[j] is the minimum cost of splitting groups 0 to j - 1
+    best = cost[0]
+    splits = []
+    for _ in range(n_segments - 1):
+        total = best[:, None] + cost
+        splits.append(total.argmin(axis=0))
+        best = total[splits[-1], numpy.arange(size)]
+
+    # Backtrack to find the boundaries
+    ends = [size - 1]
+    for split in reversed(splits):
+        ends.append(split[ends[-1]])
+    ends.append(0)
+    bounds = numpy.append(starts, nb_values)[ends[::-1]]
+    return [
+        order[bounds[i]:bounds[i + 1]]
+        for i in range(len(bounds) - 1)
+    ]
+
+
+_RANGES_ENGINES = {
+    'kmeans': _kmeans_segments,
+    'optimal': _optimal_segments,
+}
+
+
+def get_numerical_ranges(values, engine=None, weights=None):
     """
     Retrieve the numeral ranges given the input (timestamp, integer, or float).
 
-    This performs K-Means clustering, returning a maximum of 3 ranges.
+    This clusters the values, returning a maximum of 3 ranges.
+
+    :param engine: How to cluster the values, either ``'kmeans'`` (K-Means)
+        or ``'optimal'`` (exact 1-D segmentation). Defaults to
+        `RANGES_ENGINE`.
+    :param weights: Optional weight of each value, e.g. when the values are
+        the centroids of a `QuantileSketch`.
     """
 
     if not len(values):
         return []
 
+    if engine is None:
+        engine = RANGES_ENGINE
+    try:
+        segment = _RANGES_ENGINES[engine]
+    except KeyError:
+        raise ValueError("Unknown ranges engine %r" % (engine,))
+
     logger.info("Computing numerical ranges, %d values", len(values))
 
-    clustering = KMeans(n_clusters=min(N_RANGES, len(values)),
-                        random_state=0)
-    values_array = numpy.array(values).reshape(-1, 1)
-    with ignore_warnings(ConvergenceWarning):
-        clustering.fit(values_array)
-    logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
+    # Keep the precision of floating-point values (timestamps are float32)
+    values = numpy.asarray(values)
+    if values.dtype.kind != 'f':
+        values = values.astype(numpy.float64)
+    if weights is not None:
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        total = weights.sum()
+    else:
+        total = len(values)
+    clusters = segment(values, min(N_RANGES, len(values)), weights)
 
     # Compute confidence intervals for each range
     ranges = []
     sizes = []
-    for rg in range(N_RANGES):
-        cluster = [values[i]
-                   for i in range(len(values))
-                   if clustering.labels_[i] == rg]
-        if not cluster:
+    for cluster in clusters:
+        if not len(cluster):
             continue
+        order = numpy.argsort(values[cluster], kind='stable')
+        cluster = cluster[order]
+        if weights is None:
+            cluster_size = len(cluster)
+            min_idx = int(0.05 * cluster_size)
+            max_idx = int(0.95 * cluster_size)
+        else:
+            # Find the values at the same positions, counting the weights
+            cumulative = numpy.cumsum(weights[cluster])
+            cluster_size = cumulative[-1]
+            min_idx, max_idx = numpy.searchsorted(
+                cumulative,
+                [int(0.05 * cluster_size), int(0.95 * cluster_size)],
+                side='right',
+            ).clip(0, len(cluster) - 1)
 
         # Eliminate clusters of outliers
-        if len(cluster) < MIN_RANGE_SIZE * len(values):
+        if cluster_size < MIN_RANGE_SIZE * total:
             continue
 
-        cluster.sort()
-        min_idx = int(0.05 * len(cluster))
-        max_idx = int(0.95 * len(cluster))
         ranges.append([
-            cluster[min_idx],
-            cluster[max_idx],
+            values[cluster[min_idx]],
+            values[cluster[max_idx]],
         ])
-        sizes.append(len(cluster))
+        sizes.append(cluster_size)
     ranges.sort()
     logger.info("Ranges: %r", ranges)
     logger.info("Sizes: %r", sizes)
@@ -0,0 +1,160 @@
+"""Plots of the columns, included in the profile.
+
+Those are computed on whole arrays, or on the distinct values of a column
+(see :class:`~datamart_profiler.profile_types.ColumnValues`).
+"""
+
+from datetime import datetime
+import numpy
+import pandas
+import re
+
+
+# Number of bins in the numerical and temporal histograms
+HISTOGRAM_BINS = 10
+
+# Number of values kept in categorical and text histograms
+HISTOGRAM_TOP_VALUES = 5
+
+# Words (non-empty runs of word characters) and the separator between values
+_re_word = re.compile(r'\w+|\x00')
+
+# Translation of ASCII text, keeping only the word characters and separators
+_ASCII_WORDS = bytes(
+    b if b >= 128 or _re_word.match(chr(b)) else ord(' ')
+    for b in range(256)
+)
+
+
+def _histogram(values, weights=None):
+    counts, edges = numpy.histogram(
+        values,
+        bins=HISTOGRAM_BINS,
+        weights=weights,
+    )
+    return [int(round(c)) for c in counts], edges
+
+
+def _top_values(values, counts):
+    """Get the most common values, the first ones seen winning ties.
+
+    This returns the same as ``collections.Counter.most_common()``.
+    """
+    order = numpy.argsort(-counts, kind='stable')[:HISTOGRAM_TOP_VALUES]
+    return [(values[i], int(counts[i])) for i in order]
+
+
+def histogram_numerical(values, weights=None):
+    """Build the histogram of numerical values.
+
+    :param values: Array of numbers (float64)
+    :param weights: Optional weight of each value
+    """
+    counts, edges = _histogram(values, weights)
+    edges = [float(e) for e in edges]
+    return {
+        "type": "histogram_numerical",
+        "data": [
+            {
+                "count": count,
+                "bin_start": edges[i],
+                "bin_end": edges[i + 1],
+            }
+            for i, count in enumerate(counts)
+        ],
+    }
+
+
+def histogram_temporal(timestamps, weights=None):
+    """Build the histogram of temporal values.
+
+    :param timestamps: Array of UNIX timestamps
+    :param weights: Optional weight of each value
+    """
+    counts, edges = _histogram(timestamps, weights)
+    return {
+        "type": "histogram_temporal",
+        "data": [
+            {
+                "count": count,
+                "date_start": datetime.utcfromtimestamp(
+                    float(edges[i]),
+                ).isoformat(),
+                "date_end": datetime.utcfromtimestamp(
+                    float(edges[i + 1]),
+                ).isoformat(),
+            }
+            for i, count in enumerate(counts)
+        ],
+    }
+
+
+def histogram_categorical(column):
+    """Build the histogram of the most common values of a column.
+
+    :param column: The :class:`~datamart_profiler.profile_types.ColumnValues`
+    """
+    counts = numpy.asarray(column.counts, dtype=numpy.int64)
+    non_empty = numpy.flatnonzero(column.uniques != '')
+    top = _top_values(column.uniques[non_empty], counts[non_empty])
+    return {
+        "type": "histogram_categorical",
+        "data": [
+            {
+                "bin": value,
+                "count": count,
+            }
+            for value, count in sorted(top)
+        ],
+    }
+
+
+def _split_words(values):
+    """Split values into words, with a ``'\\x00'`` token before each value.
+    """
+    if not len(values):
+        return []
+    text = ' \x00 ' + ' \x00 '.join(values)
+    if text.count('\x00') != len(values):
+        # The values contain the separator, which is not a word anyway
+        text = ''.join([' \x00 ' + v.replace('\x00', ' ') for v in values])
+    if text.isascii():
+        # Fast path: turn everything that is not a word into spaces
+        return text.encode('ascii').translate(_ASCII_WORDS).decode(
+            'ascii',
+        ).split()
+    else:
+        return _re_word.findall(text)
+
+
+def histogram_text(column):
+    """Build the histogram of the most common words in a column.
+
+    Words are split on non-word characters, and lower-cased.
+
+    :param column: The :class:`~datamart_profiler.profile_types.ColumnValues`
+    """
+    # The separator is first, so it gets code 0
+    codes, tokens = pandas.factorize(
+        numpy.array(_split_words(column.uniques), dtype=object),
+    )
+    is_word = codes != 0
+    values = numpy.cumsum(~is_word) - 1
+    counts = numpy.asarray(column.counts, dtype=numpy.int64)[values[is_word]]
+
+    # Lower-case the distinct words, then count
+    words, lower = pandas.factorize(
+        numpy.array([w.lower() for w in tokens[1:]], dtype=object),
+    )
+    words = words[codes[is_word] - 1]
+    counts = numpy.bincount(words, weights=counts, minlength=len(lower))
+    return {
+        "type": "histogram_text",
+        "data": [
+            {
+                "bin": value,
+                "count": count,
+            }
+            for value, count in _top_values(lower, counts)
+        ],
+    }
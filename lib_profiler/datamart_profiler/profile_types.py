@@ -1,13 +1,17 @@
 import collections
 from datetime import datetime
 import dateutil.tz
+import math
+import numpy
 import opentelemetry.trace
+import pandas
 import re
 import regex
 
 from . import types
-from .spatial import LATITUDE, LONGITUDE, disambiguate_admin_areas
-from .temporal import parse_date
+from .spatial import LATITUDE, LONGITUDE, disambiguate_admin_areas, \
+    resolve_names_all
+from .temporal import parse_date_values
 
 
 tracer = opentelemetry.trace.get_tracer(__name__)
@@ -78,6 +82,37 @@ _re_latlong_point = re.compile(
 _re_whitespace = re.compile(r'\s+')
 
 
+def _combine_patterns(patterns):
+    """Build a single pattern out of multiple ones, with a named group each.
+
+    Alternatives are tried in order, so the name of the matching group
+    (``match.lastgroup``) is the first pattern that would have matched.
+    """
+    return re.compile('|'.join(
+        '(?P<%s>%s)' % (name, pattern.pattern)
+        for name, pattern in patterns
+    ))
+
+
+# Structural types that can be recognized with the standard 're' module
+# The geo_combined pattern needs the 'regex' module for Unicode classes, so it
+# is matched separately, in between those two
+_re_structural_1 = _combine_patterns([
+    ('int', _re_int),
+    ('float', _re_float),
+    ('url', _re_url),
+    ('file', _re_file),
+    ('point', _re_wkt_point),
+])
+_re_structural_2 = _combine_patterns([
+    ('other_point', _re_other_point),
+    ('latlong_point', _re_latlong_point),
+    ('polygon', _re_wkt_polygon),
+])
+
+BOOLEAN_VALUES = {'0', '1', 'true', 'false', 'y', 'n', 'yes', 'no'}
+
+
 # Tolerable ratio of unclean data
 MAX_UNCLEAN = 0.02  # 2%
 
@@ -92,40 +127,386 @@ TEXT_WORDS_THRESHOLD = 0.5  # 50%
 MAX_CATEGORICAL_RATIO = 0.10  # 10%
 
 
-def regular_exp_count(array):
+# Adaptive type inference: rows are inspected in random order, by blocks of
+# doubling size, until the decisions can't change with high probability
+ADAPTIVE_FIRST_BLOCK = 2000
+ADAPTIVE_ERROR = 0.001  # Probability of each decision being wrong
+
+
+def _structural_class(elem):
+    """Find which of the structural patterns matches a value first.
+    """
+    if not elem:
+        return 'empty'
+    m = _re_structural_1.match(elem)
+    if m is not None:
+        return m.lastgroup
+    # All the remaining point and polygon patterns end with a parenthesis
+    # ('$' also matches before a newline at the end)
+    if elem.endswith((')', ')\n')):
+        if _re_geo_combined.match(elem):
+            return 'geo_combined'
+        m = _re_structural_2.match(elem)
+        if m is not None:
+            return m.lastgroup
+    if len(_re_whitespace.findall(elem)) >= TEXT_WORDS - 1:
+        return 'text'
+    return None
+
+
+def regular_exp_count(array, counts=None):
     """Count instances matching the structure of each data type, using regexes.
+
+    Values are matched against combined patterns, so that each value goes
+    through the regex engine once or twice instead of once per type.
+
+    :param counts: Optional number of occurrences of each value, if `array`
+        only contains the distinct values.
     """
-    re_count = collections.Counter()
+    if counts is None:
+        re_count = collections.Counter(map(_structural_class, array))
+        re_count.pop(None, None)
 
-    for elem in array:
-        if not elem:
-            re_count['empty'] += 1
-        elif _re_int.match(elem):
-            re_count['int'] += 1
-        elif _re_float.match(elem):
-            re_count['float'] += 1
-        elif _re_url.match(elem):
-            re_count['url'] += 1
-        elif _re_file.match(elem):
-            re_count['file'] += 1
-        elif _re_wkt_point.match(elem):
-            re_count['point'] += 1
-        elif _re_geo_combined.match(elem):
-            re_count['geo_combined'] += 1
-        elif _re_other_point.match(elem):
-            re_count['other_point'] += 1
-        elif _re_latlong_point.match(elem):
-            re_count['latlong_point'] += 1
-        elif _re_wkt_polygon.match(elem):
-            re_count['polygon'] += 1
-        elif len(_re_whitespace.findall(elem)) >= TEXT_WORDS - 1:
-            re_count['text'] += 1
-        if elem.lower() in ('0', '1', 'true', 'false', 'y', 'n', 'yes', 'no'):
-            re_count['bool'] += 1
+        num_bool = sum(1 for elem in array if elem.lower() in BOOLEAN_VALUES)
+        if num_bool:
+            re_count['bool'] = num_bool
+    else:
+        re_count = collections.Counter()
+        for elem, count in zip(array, counts):
+            c_type = _structural_class(elem)
+            if c_type is not None:
+                re_count[c_type] += count
+            if elem.lower() in BOOLEAN_VALUES:
+                re_count['bool'] += count
 
     return re_count
 
 
+def native_kind(dtype):
+    """Get the kind of a column that can be profiled from its dtype.
+
+    :return: ``'integer'``, ``'float'``, ``'datetime'``, or None if the
+        column has to be profiled from the string representation of its
+        values
+    """
+    if isinstance(dtype, pandas.DatetimeTZDtype):
+        return 'datetime'
+    elif not isinstance(dtype, numpy.dtype):
+        return None
+    elif dtype.kind in 'iu':
+        return 'integer'
+    elif dtype.kind == 'f':
+        return 'float'
+    elif dtype.kind == 'M':
+        return 'datetime'
+    else:
+        return None
+
+
+class ColumnValues(object):
+    """The values of a column, factorized into distinct values and counts.
+
+    Classifying the distinct values then expanding the result (with
+    :meth:`expand`) is much faster for columns of low cardinality.
+
+    Columns of numbers or datetimes (see :func:`native_kind`) keep their
+    distinct values in `native`, and only get turned into strings if
+    `uniques` is used.
+    """
+    def __init__(self, array):
+        dtype = getattr(array, 'dtype', None)
+        kind = native_kind(dtype)
+        if kind is not None:
+            codes, uniques = pandas.factorize(array)
+            self._set_native(kind, codes, uniques)
+        else:
+            if isinstance(dtype, pandas.StringDtype):
+                # Factorize the Arrow buffers directly, only creating Python
+                # objects for the distinct values
+                codes, uniques = pandas.factorize(array)
+            else:
+                codes, uniques = pandas.factorize(
+                    numpy.asarray(array, dtype=object),
+                )
+            self._set_factorized(codes, uniques)
+        self._array = array
+
+    @classmethod
+    def from_factorized(cls, codes, uniques):
+        """Build from the codes and distinct values directly.
+        """
+        column = cls.__new__(cls)
+        column._set_factorized(codes, uniques)
+        column._array = None
+        return column
+
+    def _set_factorized(self, codes, uniques):
+        self.kind = None
+        self.native = None
+        self.codes = codes
+        self._uniques = numpy.asarray(uniques, dtype=object)
+        self.counts = numpy.bincount(codes, minlength=len(uniques)).tolist()
+        self._unique_numbers = None
+
+    def _set_native(self, kind, codes, uniques):
+        self.kind = kind
+        self.native = pandas.Index(uniques)
+        # Missing values get the last code
+        missing = codes < 0
+        self._has_missing = bool(missing.any())
+        if self._has_missing:
+            codes = numpy.where(missing, len(uniques), codes)
+        self.codes = codes
+        self._uniques = None
+        self.counts = numpy.bincount(
+            codes,
+            minlength=len(uniques) + self._has_missing,
+        ).tolist()
+        self._unique_numbers = None
+
+    @property
+    def uniques(self):
+        """The distinct values, as strings (empty for missing values).
+        """
+        if self._uniques is None:
+            # Same representation as a DataFrame converted with astype(str)
+            uniques = [str(v) for v in numpy.asarray(self.native, dtype=object)]
+            if self._has_missing:
+                uniques.append('')
+            self._uniques = numpy.empty(len(uniques), dtype=object)
+            self._uniques[:] = uniques
+        return self._uniques
+
+    @property
+    def array(self):
+        """The values for each row.
+        """
+        if self._array is None:
+            self._array = self.uniques[self.codes]
+        return self._array
+
+    def __len__(self):
+        return len(self.codes)
+
+    def expand(self, results):
+        """Turn results for each distinct value into results for each row.
+        """
+        if not isinstance(results, numpy.ndarray):
+            # Don't let numpy turn a list of lists into a 2D array
+            array = numpy.empty(len(results), dtype=object)
+            for i, result in enumerate(results):
+                array[i] = result
+            results = array
+        return results[self.codes]
+
+    def unique_numbers(self):
+        """The distinct values parsed as float64, NaN if they are not numbers.
+
+        This is only computed once, and shared by everything that needs the
+        numerical values of the column.
+        """
+        if self._unique_numbers is None:
+            if self.kind in ('integer', 'float'):
+                numbers = numpy.asarray(self.native, dtype=numpy.float64)
+                if self._has_missing:
+                    numbers = numpy.append(numbers, numpy.nan)
+            elif self.kind == 'datetime':
+                numbers = numpy.full(len(self.counts), numpy.nan)
+            else:
+                numbers = pandas.to_numeric(self.uniques, errors='coerce')
+            self._unique_numbers = numpy.asarray(numbers, dtype=numpy.float64)
+        return self._unique_numbers
+
+    def numbers(self):
+        """The values for each row parsed as float64, NaN if not numbers.
+        """
+        return self.unique_numbers()[self.codes]
+
+    def sample_blocks(self, first_block=ADAPTIVE_FIRST_BLOCK):
+        """Iterate on the rows in random order, by blocks of doubling size.
+
+        :return: Iterator over arrays of codes
+        """
+        order = numpy.random.RandomState(0).permutation(len(self.codes))
+        start = 0
+        size = first_block
+        while start < len(order):
+            yield self.codes[order[start:start + size]]
+            start += size
+            size *= 2
+
+    def distinct_values(self):
+        """The set of distinct non-empty values.
+        """
+        return set(e for e in self.uniques if e)
+
+    def non_empty_uniques(self):
+        """The distinct non-empty values, as an array.
+        """
+        if self.native is not None:
+            return self.uniques[:len(self.native)]
+        return self.uniques[self.uniques != '']
+
+    def num_distinct(self):
+        """The number of distinct non-empty values.
+
+        This is exact, and doesn't build a set of the values.
+        """
+        if self.native is not None:
+            return len(self.native)
+        return int(numpy.count_nonzero(self.uniques != ''))
+
+    def items(self):
+        """Iterate on ``(value, count)`` pairs, in order of first appearance.
+        """
+        return zip(self.uniques, self.counts)
+
+
+def _ratio_decided(count, total, ratio):
+    """Check whether ``count / total >= ratio`` is settled by a random sample.
+
+    This uses the Chernoff bound: the comparison is settled if the observed
+    ratio would be very unlikely (less than `ADAPTIVE_ERROR`) with a true
+    ratio on the other side of `ratio`.
+    """
+    if total == 0:
+        return False
+    observed = count / total
+    if observed == ratio:
+        return False
+    divergence = 0.0
+    if observed > 0:
+        divergence += observed * math.log(observed / ratio)
+    if observed < 1:
+        divergence += (1 - observed) * math.log((1 - observed) / (1 - ratio))
+    return math.exp(-total * divergence) < ADAPTIVE_ERROR
+
+
+def _structural_type_decided(re_count, num_rows):
+    """Check whether more rows could change the types from counts on a sample.
+    """
+    num_values = num_rows - re_count['empty']
+    ratio = 1.0 - MAX_UNCLEAN
+    checks = [
+        (re_count['int'], ratio),
+        (re_count['int'] + re_count['float'], ratio),
+        (re_count['point'], ratio),
+        (re_count['other_point'], ratio),
+        (re_count['latlong_point'], ratio),
+        (re_count['geo_combined'], ratio),
+        (re_count['polygon'], ratio),
+        (re_count['bool'], ratio),
+        (re_count['url'], ratio),
+        (re_count['file'], ratio),
+        (re_count['text'], 1.0 - TEXT_WORDS_THRESHOLD),
+    ]
+    return all(
+        _ratio_decided(count, num_values, ratio)
+        for count, ratio in checks
+    )
+
+
+def adaptive_regular_exp_count(column):
+    """Count structural types on random rows, until the types are settled.
+
+    :param column: A `ColumnValues` object
+    :return: A tuple ``(re_count, num_rows)`` with the counts over the rows
+        that were inspected, and the number of those rows
+    """
+    # Each distinct value is classified the first time it is seen, as the
+    # index of its structural class in `class_names` (-1 if not seen yet)
+    classes = numpy.full(len(column.uniques), -1, dtype=numpy.int64)
+    is_bool = numpy.zeros(len(column.uniques), dtype=bool)
+    class_names = []
+    class_indexes = {}
+    num_rows = 0
+    re_count = collections.Counter()
+    for block in column.sample_blocks():
+        block_counts = numpy.bincount(block, minlength=len(column.uniques))
+        num_rows += len(block)
+        seen = numpy.flatnonzero(block_counts)
+        for code in seen[classes[seen] == -1]:
+            elem = column.uniques[code]
+            c_type = _structural_class(elem)
+            if c_type not in class_indexes:
+                class_indexes[c_type] = len(class_names)
+                class_names.append(c_type)
+            classes[code] = class_indexes[c_type]
+            is_bool[code] = elem.lower() in BOOLEAN_VALUES
+
+        # Add the counts of this block
+        class_counts = numpy.bincount(
+            classes[seen],
+            weights=block_counts[seen],
+            minlength=len(class_names),
+        )
+        for c_type, count in zip(class_names, class_counts):
+            if c_type is not None and count:
+                re_count[c_type] += int(count)
+        num_bool = int(block_counts[is_bool].sum())
+        if num_bool:
+            re_count['bool'] += num_bool
+
+        if _structural_type_decided(re_count, num_rows):
+            break
+    return re_count, num_rows
+
+
+def adaptive_maybe_dates(column):
+    """Check on random rows whether a column might be dates.
+
+    :return: False if the rows inspected show that the column is not dates,
+        True otherwise (all the values then need to be parsed)
+    """
+    parsed = numpy.zeros(len(column.uniques), dtype=bool)
+    is_date = numpy.zeros(len(column.uniques), dtype=bool)
+    num_rows = num_dates = 0
+    for block in column.sample_blocks():
+        block = block[column.uniques[block] != '']
+        new_codes = numpy.unique(block)
+        new_codes = new_codes[~parsed[new_codes]]
+        dates = parse_date_values(column.uniques[new_codes])
+        parsed[new_codes] = True
+        is_date[new_codes] = [date is not None for date in dates]
+        num_rows += len(block)
+        num_dates += int(is_date[block].sum())
+        if _ratio_decided(num_dates, num_rows, 1.0 - MAX_UNCLEAN):
+            return num_dates >= (1.0 - MAX_UNCLEAN) * num_rows
+    return True
+
+
+def adaptive_maybe_admin_areas(values, geo_data, ratio):
+    """Check on random values whether they might be administrative areas.
+
+    :param values: The distinct values
+    :param ratio: The ratio of values that need to be recognized
+    :return: False if the values resolved show that they are not
+        administrative areas, True otherwise (all the values then need to be
+        resolved)
+    """
+    values = sorted(values)
+    numpy.random.RandomState(0).shuffle(values)
+    num_values = num_resolved = 0
+    size = ADAPTIVE_FIRST_BLOCK // 10
+    while num_values < len(values):
+        block = values[num_values:num_values + size]
+        num_resolved += sum(
+            1 for r in resolve_names_all(geo_data, block) if r
+        )
+        num_values += len(block)
+        size *= 2
+        if _ratio_decided(num_resolved, num_values, ratio):
+            return num_resolved > ratio * num_values
+    return True
+
+
+def parse_dates(column):
+    """Parse the valid dates in a column, as a list of datetimes in order.
+    """
+    dates = column.expand(parse_date_values(column.uniques))
+    return [dt for dt in dates if dt is not None]
+
+
 def unclean_values_ratio(c_type, re_count, num_total):
     """Count how many values don't match a given type.
 
@@ -150,37 +531,196 @@ def unclean_values_ratio(c_type, re_count, num_total):
     return ratio
 
 
-def parse_dates(array):
-    """Parse the valid dates in an array of strings.
+def identify_latlong(column, name, threshold, semantic_types_dict):
+    """Identify latitude and longitude from the name and range of a column.
+    """
+    with tracer.start_as_current_span('profile/parse_latlong'):
+        numbers = column.unique_numbers()
+        counts = numpy.asarray(column.counts)
+        num_long = int(counts[numpy.abs(numbers) <= 180.0].sum())
+        num_lat = int(counts[numpy.abs(numbers) <= 90.0].sum())
+
+        if num_lat >= threshold and any(n in name.lower() for n in LATITUDE):
+            semantic_types_dict[types.LATITUDE] = None
+        if num_long >= threshold and any(n in name.lower() for n in LONGITUDE):
+            semantic_types_dict[types.LONGITUDE] = None
+
+
+# Integers with fewer digits are never parsed as full dates (see
+# temporal.parse_date), this is checked by the tests
+MIN_DATE_INTEGER = 100000
+
+
+def identify_native_types(column, name, adaptive=False):
+    """Identify the types of a column of numbers or datetimes from its dtype.
+
+    This gives the same types as inspecting the string representation of the
+    values, except that all finite numbers are recognized (``1e-05`` doesn't
+    look like a float), without creating or matching strings for each value.
+
+    :param column: A `ColumnValues` object with a `native` kind
+    :return: The same as :func:`identify_types`, or None if the column needs
+        to be inspected as strings
     """
-    parsed_dates = []
-    for elem in array:
-        elem = parse_date(elem)
-        if elem is not None:
-            parsed_dates.append(elem)
-    return parsed_dates
+    num_total = len(column)
+    num_native = len(column.native)
+    native_counts = numpy.asarray(column.counts[:num_native])
+    num_empty = num_total - int(native_counts.sum())
+    if num_empty == num_total:
+        return None
+    threshold = max(1, (1.0 - MAX_UNCLEAN) * (num_total - num_empty))
+    column_meta = {}
+    semantic_types_dict = {}
+    if num_empty > 0:
+        column_meta['missing_values_ratio'] = num_empty / num_total
+    num_distinct = column.num_distinct()
+
+    if column.kind == 'datetime':
+        # Timestamps are text, and categorical if there are few of them
+        column_meta['num_distinct_values'] = num_distinct
+        max_categorical = MAX_CATEGORICAL_RATIO * (num_total - num_empty)
+        if num_distinct <= max_categorical:
+            semantic_types_dict[types.CATEGORICAL] = column.distinct_values()
+        index = pandas.DatetimeIndex(column.native)
+        if index.tz is None:
+            index = index.tz_localize(dateutil.tz.UTC)
+        # Missing values have the last code
+        dates = list(index.to_pydatetime()) + [None]
+        semantic_types_dict[types.DATE_TIME] = [
+            dt for dt in column.expand(dates) if dt is not None
+        ]
+        return types.TEXT, semantic_types_dict, column_meta
+
+    numbers = numpy.asarray(column.native, dtype=numpy.float64)
+    finite = numpy.isfinite(numbers)
+    if column.kind == 'integer':
+        is_int = finite
+    else:
+        is_int = finite & (numbers == numpy.floor(numbers))
+    re_count = collections.Counter({
+        'empty': num_empty,
+        'int': int(native_counts[is_int].sum()),
+        'float': int(native_counts[finite & ~is_int].sum()),
+    })
+    if column.kind == 'integer':
+        # Only integers are written like booleans ('0' and '1')
+        re_count['bool'] = int(
+            native_counts[(numbers == 0.0) | (numbers == 1.0)].sum()
+        )
+
+    if re_count['int'] >= threshold:
+        structural_type = types.INTEGER
+    elif re_count['int'] + re_count['float'] >= threshold:
+        structural_type = types.FLOAT
+    else:
+        return None
+    column_meta['unclean_values_ratio'] = \
+        unclean_values_ratio(structural_type, re_count, num_total)
+
+    # Identify booleans
+    if re_count['bool'] >= threshold:
+        semantic_types_dict[types.BOOLEAN] = None
+        column_meta['unclean_values_ratio'] = \
+            unclean_values_ratio(types.BOOLEAN, re_count, num_total)
+
+    if structural_type == types.INTEGER:
+        # Identify ids
+        if (name.lower().startswith('id') or
+                name.lower().endswith('id') or
+                name.lower().startswith('identifier') or
+                name.lower().endswith('identifier') or
+                name.lower().startswith('index') or
+                name.lower().endswith('index')):
+            semantic_types_dict[types.ID] = None
+
+        # Count distinct values
+        column_meta['num_distinct_values'] = num_distinct
+
+        # Identify years ('2020.0' is not read as a year)
+        if name.strip().lower() == 'year' and column.kind == 'integer':
+            years = []
+            for year in column.native:
+                try:
+                    years.append(datetime(
+                        int(year), 1, 1,
+                        tzinfo=dateutil.tz.UTC,
+                    ))
+                except (ValueError, OverflowError):
+                    years.append(None)
+            years.append(None)  # Missing values
+            dates = [dt for dt in column.expand(years) if dt is not None]
+            if len(dates) >= threshold:
+                structural_type = types.TEXT
+                semantic_types_dict[types.DATE_TIME] = dates
+
+    # Identify lat/long
+    if structural_type == types.FLOAT:
+        identify_latlong(column, name, threshold, semantic_types_dict)
+
+    # Identify dates, only integers such as 20200101 can be parsed
+    num_large = int(
+        native_counts[numpy.abs(numbers) >= MIN_DATE_INTEGER].sum()
+    )
+    if column.kind == 'integer' and num_large >= threshold:
+        with tracer.start_as_current_span('profile/parse_dates'):
+            if not adaptive or adaptive_maybe_dates(column):
+                parsed_dates = parse_dates(column)
+            else:
+                parsed_dates = []
+        if len(parsed_dates) >= threshold:
+            semantic_types_dict[types.DATE_TIME] = parsed_dates
+            if structural_type == types.INTEGER:
+                structural_type = types.TEXT
+
+    return structural_type, semantic_types_dict, column_meta
 
 
-def identify_types(array, name, geo_data, manual=None):
+def identify_types(array, name, geo_data, manual=None, adaptive=False):
     """Identify the structural type and semantic types of an array.
 
-    :param array: The list, series, or array to inspect
+    :param array: The list, series, or array to inspect, or a
+        `ColumnValues` object
     :param name: The name of this column. This is taken into account for some
         heuristics like latitude, longitude, year number.
     :param manual: Manual information provided by the user that will be
         reconciled with the observed data.
+    :param adaptive: If True, only inspect as many rows (in random order) as
+        needed to settle the types with high probability. The ratios are then
+        estimated from those rows, and their number is recorded as
+        ``num_inspected_rows``.
     :return: A tuple ``(structural_type, semantic_types_dict, column_meta)``
         where `structural_type` is the detected structural type (e.g. storage
         format), `semantic_types_dict` is a dict mapping semantic types (e.g.
         meaning) to parsed values for further processing, and `column_meta`
         contains additional information about the column (not related to type).
     """
-    num_total = len(array)
+    if isinstance(array, ColumnValues):
+        column = array
+    else:
+        column = ColumnValues(array)
+
+    # Numbers and datetimes don't need to be matched as strings
+    if column.native is not None and not manual:
+        result = identify_native_types(column, name, adaptive)
+        if result is not None:
+            return result
+
+    num_total = len(column)
     column_meta = {}
 
     # This function let you check/count how many instances match a structure of particular data type
     with tracer.start_as_current_span('profile/regular_exp_count'):
-        re_count = regular_exp_count(array)
+        if adaptive:
+            re_count, num_inspected = adaptive_regular_exp_count(column)
+            column_meta['num_inspected_rows'] = num_inspected
+            if num_inspected < num_total:
+                # Extrapolate the counts to the whole column
+                scale = num_total / num_inspected
+                re_count = collections.Counter({
+                    k: v * scale for k, v in re_count.items()
+                })
+        else:
+            re_count = regular_exp_count(column.uniques, column.counts)
 
     # Identify structural type and compute unclean values ratio
     threshold = max(1, (1.0 - MAX_UNCLEAN) * (num_total - re_count['empty']))
@@ -211,7 +751,7 @@ def identify_types(array, name, geo_data, manual=None):
     if structural_type != types.MISSING_DATA and re_count['empty'] > 0:
         column_meta['missing_values_ratio'] = re_count['empty'] / num_total
 
-    distinct_values = set(e for e in array if e)
+    num_distinct = column.num_distinct()
 
     semantic_types_dict = {}
     if manual:
@@ -223,21 +763,26 @@ def identify_types(array, name, geo_data, manual=None):
                 column_meta['unclean_values_ratio'] = \
                     unclean_values_ratio(types.BOOLEAN, re_count, num_total)
             if el == types.DATE_TIME:
-                dates = parse_dates(array)
+                dates = parse_dates(column)
                 semantic_types_dict[types.DATE_TIME] = dates
             if el == types.ADMIN:
-                if geo_data is not None and len(distinct_values) >= 3:
-                    admin_areas = geo_data.resolve_names_all(array)
+                if geo_data is not None and num_distinct >= 3:
+                    admin_areas = column.expand(
+                        resolve_names_all(geo_data, column.uniques),
+                    )
                     admin_areas = [r for r in admin_areas if r]
                     if admin_areas:
-                        admin_areas = disambiguate_admin_areas(admin_areas)
+                        admin_areas = disambiguate_admin_areas(
+                            admin_areas, geo_data,
+                        )
                         if admin_areas is not None:
                             semantic_types_dict[types.ADMIN] = admin_areas
             if el == types.CATEGORICAL or el == types.INTEGER:
                 # Count distinct values
-                column_meta['num_distinct_values'] = len(distinct_values)
+                column_meta['num_distinct_values'] = num_distinct
                 if el == types.CATEGORICAL:
-                    semantic_types_dict[types.CATEGORICAL] = distinct_values
+                    semantic_types_dict[types.CATEGORICAL] = \
+                        column.distinct_values()
     else:
         num_bool = re_count['bool']
         num_text = re_count['text']
@@ -263,13 +808,25 @@ def identify_types(array, name, geo_data, manual=None):
                 semantic_types_dict[types.FILE_PATH] = None
 
             # Administrative areas
-            if geo_data is not None and len(distinct_values) >= 3:
+            if (
+                geo_data is not None and num_distinct >= 3
+                and (
+                    not adaptive
+                    or adaptive_maybe_admin_areas(
+                        column.non_empty_uniques(), geo_data, 0.7,
+                    )
+                )
+            ):
                 with tracer.start_as_current_span('profile/admin_areas'):
-                    admin_areas = geo_data.resolve_names_all(distinct_values)
+                    admin_areas = resolve_names_all(
+                        geo_data, column.non_empty_uniques(),
+                    )
                     admin_areas = [r for r in admin_areas if r]
-                    if len(admin_areas) > 0.7 * len(distinct_values):
+                    if len(admin_areas) > 0.7 * num_distinct:
 
-                        admin_areas = disambiguate_admin_areas(admin_areas)
+                        admin_areas = disambiguate_admin_areas(
+                            admin_areas, geo_data,
+                        )
                         if admin_areas is not None:
                             semantic_types_dict[types.ADMIN] = admin_areas
                             categorical = True
@@ -284,14 +841,16 @@ def identify_types(array, name, geo_data, manual=None):
                 semantic_types_dict[types.TEXT] = None
             else:
                 # Count distinct values
-                column_meta['num_distinct_values'] = len(distinct_values)
-                max_categorical = MAX_CATEGORICAL_RATIO * (len(array) - num_empty)
+                column_meta['num_distinct_values'] = num_distinct
+                max_categorical = MAX_CATEGORICAL_RATIO * (num_total - num_empty)
                 if (
                     categorical or
-                    len(distinct_values) <= max_categorical or
+                    num_distinct <= max_categorical or
                     types.BOOLEAN in semantic_types_dict
                 ):
-                    semantic_types_dict[types.CATEGORICAL] = distinct_values
+                    # Only build the set once we know it's categorical
+                    semantic_types_dict[types.CATEGORICAL] = \
+                        column.distinct_values()
         elif structural_type == types.INTEGER:
             # Identify ids
             # TODO: is this enough?
@@ -305,47 +864,35 @@ def identify_types(array, name, geo_data, manual=None):
                 semantic_types_dict[types.ID] = None
 
             # Count distinct values
-            column_meta['num_distinct_values'] = len(distinct_values)
+            column_meta['num_distinct_values'] = num_distinct
 
             # Identify years
             if name.strip().lower() == 'year':
                 with tracer.start_as_current_span('profile/parse_years'):
-                    dates = []
-                    for year in array:
+                    years = []
+                    for year in column.uniques:
                         try:
-                            dates.append(datetime(
+                            years.append(datetime(
                                 int(year), 1, 1,
                                 tzinfo=dateutil.tz.UTC,
                             ))
                         except ValueError:
-                            pass
+                            years.append(None)
+                    dates = [dt for dt in column.expand(years) if dt is not None]
                     if len(dates) >= threshold:
                         structural_type = types.TEXT
                         semantic_types_dict[types.DATE_TIME] = dates
 
         # Identify lat/long
         if structural_type == types.FLOAT:
-            with tracer.start_as_current_span('profile/parse_latlong'):
-                num_lat = num_long = 0
-                for elem in array:
-                    try:
-                        elem = float(elem)
-                    except ValueError:
-                        pass
-                    else:
-                        if -180.0 <= float(elem) <= 180.0:
-                            num_long += 1
-                            if -90.0 <= float(elem) <= 90.0:
-                                num_lat += 1
-
-                if num_lat >= threshold and any(n in name.lower() for n in LATITUDE):
-                    semantic_types_dict[types.LATITUDE] = None
-                if num_long >= threshold and any(n in name.lower() for n in LONGITUDE):
-                    semantic_types_dict[types.LONGITUDE] = None
+            identify_latlong(column, name, threshold, semantic_types_dict)
 
         # Identify dates
         with tracer.start_as_current_span('profile/parse_dates'):
-            parsed_dates = parse_dates(array)
+            if not adaptive or adaptive_maybe_dates(column):
+                parsed_dates = parse_dates(column)
+            else:
+                parsed_dates = []
 
         if len(parsed_dates) >= threshold:
             semantic_types_dict[types.DATE_TIME] = parsed_dates
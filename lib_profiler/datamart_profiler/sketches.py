@@ -0,0 +1,593 @@
+"""Mergeable summaries of columns.
+
+Those are emitted alongside the profile, so that a dataset that only gets new
+rows appended can be re-profiled by profiling the new rows only and merging
+the result (see :func:`merge_profiles`).
+"""
+
+import base64
+import copy
+import logging
+import math
+import numpy
+import pandas
+
+from .numerical import get_numerical_ranges
+from .plots import HISTOGRAM_TOP_VALUES, histogram_numerical, \
+    histogram_temporal
+from .spatial import Geohasher, get_spatial_ranges, decode_hash
+from .temporal import temporal_aggregation_keys
+from . import types
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of registers of the HyperLogLog sketches is 2**HLL_PRECISION
+HLL_PRECISION = 12
+
+# HyperLogLog sketches keep the hashes, and count exactly, up to that many
+# distinct values
+HLL_EXACT_LIMIT = 1024
+
+# Number of centroids kept by the quantile sketches
+QUANTILE_CENTROIDS = 256
+
+
+class Moments(object):
+    """Count, mean, variance, minimum and maximum of numbers.
+
+    This uses Welford's algorithm, and the formula from Chan et al. to merge.
+    """
+    def __init__(self, count=0, mean=0.0, m2=0.0,
+                 minimum=None, maximum=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @classmethod
+    def from_values(cls, values):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if not len(values):
+            return cls()
+        mean = float(values.mean())
+        return cls(
+            count=len(values),
+            mean=mean,
+            m2=float(((values - mean) ** 2).sum()),
+            minimum=float(values.min()),
+            maximum=float(values.max()),
+        )
+
+    def merge(self, other):
+        """Get the moments of both sets of values together.
+        """
+        if not other.count:
+            return Moments(**self.to_json())
+        elif not self.count:
+            return Moments(**other.to_json())
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        return Moments(
+            count=count,
+            mean=self.mean + delta * other.count / count,
+            m2=(
+                self.m2 + other.m2
+                + delta * delta * self.count * other.count / count
+            ),
+            minimum=min(self.minimum, other.minimum),
+            maximum=max(self.maximum, other.maximum),
+        )
+
+    def scaled(self, factor):
+        """Get the moments for values repeated `factor` times.
+        """
+        return Moments(
+            count=self.count * factor,
+            mean=self.mean,
+            m2=self.m2 * factor,
+            minimum=self.minimum,
+            maximum=self.maximum,
+        )
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / self.count) if self.count else 0
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+        }
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(**obj)
+
+
+def _leading_zeros(array):
+    """Count the leading zero bits of each number in a uint64 array.
+    """
+    array = array.copy()
+    zeros = numpy.zeros(len(array), dtype=numpy.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = array < numpy.uint64(1 << (64 - shift))
+        zeros[mask] += shift
+        array[mask] <<= numpy.uint64(shift)
+    zeros[array == 0] += 1
+    return zeros
+
+
+class HyperLogLog(object):
+    """Approximate count of distinct values, in constant memory.
+
+    The hashes are kept as long as there are no more than `exact_limit` of
+    them, in which case the count is exact. Past that, they are folded into
+    the HyperLogLog registers.
+    """
+    def __init__(self, precision=HLL_PRECISION, registers=None, hashes=None,
+                 exact_limit=HLL_EXACT_LIMIT):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.registers = registers
+        if registers is None and hashes is None:
+            hashes = numpy.zeros(0, dtype=numpy.uint64)
+        self.hashes = hashes
+
+    @property
+    def exact(self):
+        return self.hashes is not None
+
+    def add(self, values):
+        """Add values, as a list or array of strings.
+        """
+        values = numpy.asarray(values, dtype=object)
+        if not len(values):
+            return
+        hashes = pandas.util.hash_array(values, categorize=False)
+        self.add_hashes(hashes)
+
+    def add_hashes(self, hashes):
+        """Add values from their 64-bit hashes.
+        """
+        hashes = numpy.asarray(hashes, dtype=numpy.uint64)
+        if self.hashes is not None:
+            hashes = numpy.union1d(self.hashes, hashes)
+            if len(hashes) <= self.exact_limit:
+                self.hashes = hashes
+                return
+            # Too many values, switch to the registers
+            self.hashes = None
+            self.registers = numpy.zeros(
+                1 << self.precision,
+                dtype=numpy.uint8,
+            )
+
+        precision = numpy.uint64(self.precision)
+        index = (hashes >> numpy.uint64(64 - self.precision)).astype(
+            numpy.intp,
+        )
+        # Rank is the position of the first 1 bit after the index bits
+        rest = (hashes << precision) | numpy.uint64(
+            1 << (self.precision - 1)
+        )
+        rank = _leading_zeros(rest) + 1
+        numpy.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge sketches of different precisions")
+        if self.exact and other.exact:
+            result = HyperLogLog(
+                self.precision, hashes=self.hashes,
+                exact_limit=self.exact_limit,
+            )
+            result.add_hashes(other.hashes)
+        elif self.exact:
+            result = other.merge(self)
+        else:
+            result = HyperLogLog(
+                self.precision, registers=self.registers.copy(),
+                exact_limit=self.exact_limit,
+            )
+            if other.exact:
+                result.add_hashes(other.hashes)
+            else:
+                numpy.maximum(
+                    result.registers, other.registers,
+                    out=result.registers,
+                )
+        return result
+
+    def count(self):
+        """Estimate the number of distinct values.
+        """
+        if self.exact:
+            return len(self.hashes)
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / numpy.sum(
+            numpy.exp2(-self.registers.astype(numpy.float64))
+        )
+        zeros = int(numpy.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            # Small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_json(self):
+        if self.exact:
+            return {
+                'precision': self.precision,
+                'hashes': base64.b64encode(
+                    self.hashes.astype('<u8').tobytes(),
+                ).decode('ascii'),
+            }
+        return {
+            'precision': self.precision,
+            'registers': base64.b64encode(
+                self.registers.tobytes(),
+            ).decode('ascii'),
+        }
+
+    @classmethod
+    def from_json(cls, obj):
+        if 'hashes' in obj:
+            hashes = numpy.frombuffer(
+                base64.b64decode(obj['hashes']),
+                dtype='<u8',
+            ).astype(numpy.uint64)
+            return cls(obj['precision'], hashes=hashes)
+        registers = numpy.frombuffer(
+            base64.b64decode(obj['registers']),
+            dtype=numpy.uint8,
+        ).copy()
+        return cls(obj['precision'], registers=registers)
+
+
+class QuantileSketch(object):
+    """Distribution of numbers, as a small number of weighted centroids.
+
+    Sorted values are grouped into at most `size` centroids of similar weight,
+    except for the minimum and maximum which are kept exactly.
+    Merging sketches merges their centroids and groups them again.
+    """
+    def __init__(self, means=(), weights=(), size=QUANTILE_CENTROIDS):
+        self.means = numpy.asarray(means, dtype=numpy.float64)
+        self.weights = numpy.asarray(weights, dtype=numpy.float64)
+        self.size = size
+
+    @classmethod
+    def from_values(cls, values, size=QUANTILE_CENTROIDS):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        sketch = cls(values, numpy.ones(len(values)), size)
+        return sketch.compressed()
+
+    def compressed(self):
+        """Group the centroids until there are no more than `size` of them.
+        """
+        order = numpy.argsort(self.means, kind='stable')
+        means = self.means[order]
+        weights = self.weights[order]
+        if len(means) <= self.size:
+            return QuantileSketch(means, weights, self.size)
+        # Group centroids by the position of their first value, keeping the
+        # minimum and maximum on their own
+        before = numpy.cumsum(weights) - weights
+        groups = 1 + (
+            before * (self.size - 2) / weights.sum()
+        ).astype(numpy.intp)
+        groups[0] = 0
+        groups[-1] = self.size - 1
+        group_weights = numpy.bincount(groups, weights=weights)
+        group_sums = numpy.bincount(groups, weights=weights * means)
+        keep = group_weights > 0
+        return QuantileSketch(
+            group_sums[keep] / group_weights[keep],
+            group_weights[keep],
+            self.size,
+        )
+
+    def merge(self, other):
+        return QuantileSketch(
+            numpy.concatenate([self.means, other.means]),
+            numpy.concatenate([self.weights, other.weights]),
+            self.size,
+        ).compressed()
+
+    def scaled(self, factor):
+        return QuantileSketch(self.means, self.weights * factor, self.size)
+
+    def to_json(self):
+        return {
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(obj['means'], obj['weights'])
+
+
+def column_sketch(column, numerical_values=None, timestamps=None):
+    """Build the sketches for a column.
+
+    :param column: The `ColumnValues` of the column
+    :param numerical_values: The numbers in the column, if numerical
+    :param timestamps: The timestamps in the column, if temporal
+    :return: A JSON-serializable dict
+    """
+    distinct = HyperLogLog()
+    distinct.add(column.non_empty_uniques())
+    sketch = {
+        'num_rows': len(column),
+        'distinct': distinct.to_json(),
+    }
+    if numerical_values is not None:
+        sketch['moments'] = Moments.from_values(numerical_values).to_json()
+        sketch['quantiles'] = QuantileSketch.from_values(
+            numerical_values,
+        ).to_json()
+    if timestamps is not None:
+        sketch['timestamps'] = QuantileSketch.from_values(
+            timestamps,
+        ).to_json()
+    return sketch
+
+
+def _merge_column_sketches(old, old_factor, new, new_factor):
+    merged = {
+        'num_rows': int(round(
+            old['num_rows'] * old_factor + new['num_rows'] * new_factor
+        )),
+        'distinct': HyperLogLog.from_json(old['distinct']).merge(
+            HyperLogLog.from_json(new['distinct']),
+        ).to_json(),
+    }
+    for key, cls in [
+        ('moments', Moments),
+        ('quantiles', QuantileSketch),
+        ('timestamps', QuantileSketch),
+    ]:
+        if key in old and key in new:
+            merged[key] = cls.from_json(old[key]).scaled(old_factor).merge(
+                cls.from_json(new[key]).scaled(new_factor),
+            ).to_json()
+        elif key in old:
+            # The new rows have no values (e.g. they are all missing)
+            merged[key] = cls.from_json(old[key]).scaled(old_factor).to_json()
+        elif key in new:
+            merged[key] = cls.from_json(new[key]).scaled(new_factor).to_json()
+    return merged
+
+
+def _merge_top_values(old_plot, old_factor, new_plot, new_factor):
+    counts = {}
+    for plot, factor in [(old_plot, old_factor), (new_plot, new_factor)]:
+        for entry in plot['data']:
+            counts[entry['bin']] = (
+                counts.get(entry['bin'], 0) + entry['count'] * factor
+            )
+    counts = sorted(counts.items(), key=lambda e: (-e[1], e[0]))
+    counts = counts[:HISTOGRAM_TOP_VALUES]
+    if old_plot['type'] == 'histogram_categorical':
+        counts = sorted(counts)
+    return {
+        'type': old_plot['type'],
+        'data': [
+            {'bin': value, 'count': int(round(count))}
+            for value, count in counts
+        ],
+    }
+
+
+def _column_ratio(column, key):
+    if (
+        key == 'missing_values_ratio'
+        and column['structural_type'] == types.MISSING_DATA
+    ):
+        # Not set on empty columns, all their values are missing
+        return 1.0
+    return column.get(key)
+
+
+def _merge_ratio(old, old_rows, new, new_rows, key):
+    old_ratio = _column_ratio(old, key)
+    new_ratio = _column_ratio(new, key)
+    if old_ratio is None and new_ratio is None:
+        return None
+    return (
+        (old_ratio or 0.0) * old_rows + (new_ratio or 0.0) * new_rows
+    ) / (old_rows + new_rows)
+
+
+def _sketches_factor(profile):
+    """Get the factor from counts in sketches and plots to the whole data.
+
+    Those are computed on the profiled rows, unless the profile is the result
+    of a merge, in which case they were scaled to the number of rows they
+    represent (recorded in the sketches).
+    """
+    represented = profile['sketches'].get(
+        'nb_rows', profile['nb_profiled_rows'],
+    )
+    return profile['nb_rows'] / max(1, represented)
+
+
+def merge_profiles(old, new, *, max_geohashes=100):
+    """Merge the profile of appended rows into the profile of a dataset.
+
+    Both profiles have to include sketches (see
+    :func:`~datamart_profiler.core.process_dataset`). The types of the
+    previous profile are kept. Counts in sketches are scaled up when a
+    profile was computed on a sample, and the sketches of the result record
+    how many rows they represent, so they don't get scaled up again.
+
+    :param old: Profile of the dataset before the rows were appended
+    :param new: Profile of the new rows
+    :param max_geohashes: Maximum number of geohashes in spatial coverage
+    :return: The profile of the whole dataset, with its sketches
+    """
+    if 'sketches' not in old or 'sketches' not in new:
+        raise ValueError("Profiles don't include sketches")
+    old_names = [col['name'] for col in old['columns']]
+    new_names = [col['name'] for col in new['columns']]
+    if old_names != new_names:
+        raise ValueError("Columns don't match")
+
+    merged = copy.deepcopy(old)
+    old_rows = old['nb_rows']
+    new_rows = new['nb_rows']
+    old_factor = _sketches_factor(old)
+    new_factor = _sketches_factor(new)
+    merged['nb_rows'] = old_rows + new_rows
+    merged['nb_profiled_rows'] = (
+        old['nb_profiled_rows'] + new['nb_profiled_rows']
+    )
+    if 'size' in old and 'size' in new:
+        merged['size'] = old['size'] + new['size']
+    if merged['nb_rows']:
+        if 'size' in merged:
+            merged['average_row_size'] = merged['size'] / merged['nb_rows']
+    if 'sample' in new:
+        merged['sample'] = new['sample']
+
+    # Columns
+    sketches = []
+    for idx, (column, new_column) in enumerate(
+        zip(merged['columns'], new['columns'])
+    ):
+        sketch = _merge_column_sketches(
+            old['sketches']['columns'][idx], old_factor,
+            new['sketches']['columns'][idx], new_factor,
+        )
+        sketches.append(sketch)
+
+        for key in ('missing_values_ratio', 'unclean_values_ratio'):
+            ratio = _merge_ratio(
+                column, old_rows, new_column, new_rows, key,
+            )
+            if ratio is None or (
+                key == 'missing_values_ratio'
+                and column['structural_type'] == types.MISSING_DATA
+            ):
+                # The types of the previous profile are kept
+                continue
+            column[key] = ratio
+        if 'num_distinct_values' in column:
+            column['num_distinct_values'] = HyperLogLog.from_json(
+                sketch['distinct'],
+            ).count()
+
+        if 'moments' in sketch:
+            moments = Moments.from_json(sketch['moments'])
+            quantiles = QuantileSketch.from_json(sketch['quantiles'])
+            if 'mean' in column:
+                column['mean'] = moments.mean
+                column['stddev'] = moments.stddev
+            if 'coverage' in column:
+                column['coverage'] = get_numerical_ranges(
+                    quantiles.means,
+                    weights=quantiles.weights,
+                )
+            if column.get('plot', {}).get('type') == 'histogram_numerical':
+                column['plot'] = histogram_numerical(
+                    quantiles.means,
+                    weights=quantiles.weights,
+                )
+        if (
+            'timestamps' in sketch
+            and column.get('plot', {}).get('type') == 'histogram_temporal'
+        ):
+            quantiles = QuantileSketch.from_json(sketch['timestamps'])
+            column['plot'] = histogram_temporal(
+                quantiles.means,
+                weights=quantiles.weights,
+            )
+        if (
+            column.get('plot', {}).get('type')
+            in ('histogram_categorical', 'histogram_text')
+            and new_column.get('plot', {}).get('type')
+            == column['plot']['type']
+        ):
+            column['plot'] = _merge_top_values(
+                column['plot'], old_factor,
+                new_column['plot'], new_factor,
+            )
+
+    # Temporal coverage
+    resolutions = list(temporal_aggregation_keys)
+    new_temporal = {
+        tuple(cov['column_indexes']): cov
+        for cov in new.get('temporal_coverage', [])
+    }
+    for cov in merged.get('temporal_coverage', []):
+        idx, = cov['column_indexes']
+        sketch = sketches[idx]
+        if 'timestamps' in sketch:
+            quantiles = QuantileSketch.from_json(sketch['timestamps'])
+            cov['ranges'] = get_numerical_ranges(
+                quantiles.means,
+                weights=quantiles.weights,
+            )
+        new_cov = new_temporal.get(tuple(cov['column_indexes']))
+        if new_cov is not None:
+            # Keep the finest resolution
+            cov['temporal_resolution'] = max(
+                cov['temporal_resolution'], new_cov['temporal_resolution'],
+                key=resolutions.index,
+            )
+
+    # Spatial coverage, from the geohashes
+    new_spatial = {
+        (cov['type'], tuple(cov['column_indexes'])): cov
+        for cov in new.get('spatial_coverage', [])
+    }
+    for cov in merged.get('spatial_coverage', []):
+        new_cov = new_spatial.get((cov['type'], tuple(cov['column_indexes'])))
+        if (
+            new_cov is None
+            or not cov.get('geohashes4') or not new_cov.get('geohashes4')
+        ):
+            continue
+        old_hashes = [
+            (h['hash'], h['number'] * old_factor) for h in cov['geohashes4']
+        ]
+        new_hashes = [
+            (h['hash'], h['number'] * new_factor)
+            for h in new_cov['geohashes4']
+        ]
+        hashes = old_hashes + new_hashes
+        # Both profiles might not have stopped at the same precision
+        builder = Geohasher(
+            number=max_geohashes,
+            precision=min(len(h) for h, _ in hashes),
+        )
+        builder.add_hashes(hashes)
+        hashes = builder.get_hashes()
+        cov['geohashes4'] = [
+            {'hash': h, 'number': int(round(n))} for h, n in hashes
+        ]
+        if 'number' in cov and 'number' in new_cov:
+            cov['number'] = cov['number'] + new_cov['number']
+        if 'ranges' in cov and len(hashes) > 0:
+            centers = []
+            for h, _ in hashes:
+                min_lat, max_lat, min_long, max_long = decode_hash(h, base=4)
+                centers.append([
+                    (min_lat + max_lat) / 2.0,
+                    (min_long + max_long) / 2.0,
+                ])
+            cov['ranges'] = get_spatial_ranges(
+                numpy.array(centers),
+                weights=[n for _, n in hashes],
+            )
+
+    # The sketches (and the plots) have been scaled to the whole data
+    merged['sketches'] = {'columns': sketches, 'nb_rows': merged['nb_rows']}
+    return merged
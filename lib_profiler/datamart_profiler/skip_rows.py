@@ -0,0 +1,58 @@
+"""Find the non-data rows at the top of CSV files.
+
+This only uses the standard library, so it can be imported without loading
+the rest of the profiler.
+"""
+
+import codecs
+import csv
+import itertools
+
+
+MAX_SKIPPED_ROWS = 6
+"""Maximum number of rows to discard at the top of the file"""
+
+HEADER_CONSISTENT_ROWS = 4
+"""Stop throwing out lines when that many in a row have same number of columns
+"""
+
+
+def count_rows_to_skip(file):
+    """Count non-data rows at the top, such as titles etc.
+    """
+    # Check whether this is a binary file
+    read_sample = file.read(4)
+    binary = not isinstance(read_sample, str)
+    file.seek(0, 0)
+
+    # Decode CSV
+    if binary:
+        codec_reader = codecs.getreader('utf-8')(file)
+        reader = csv.reader(codec_reader)
+    else:
+        reader = csv.reader(file)
+
+    # Read rows until the number of items stabilizes
+    run_start = 0
+    run_cols = None
+    run_len = 0
+    try:
+        for i, row in enumerate(itertools.islice(reader, MAX_SKIPPED_ROWS + HEADER_CONSISTENT_ROWS)):
+            if i >= MAX_SKIPPED_ROWS + HEADER_CONSISTENT_ROWS:
+                raise ValueError("Can't find consistent CSV data in file")
+            if len(row) == run_cols:
+                # Number of columns matches with run
+                run_len += 1
+                if run_len == HEADER_CONSISTENT_ROWS:
+                    # 4 rows with the same size, assume we're good
+                    return run_start
+            else:
+                # Number of columns doesn't match, start new run
+                run_start = i
+                run_cols = len(row)
+                run_len = 1
+
+        # Reached the end of the file
+        return run_start
+    finally:
+        file.seek(0, 0)
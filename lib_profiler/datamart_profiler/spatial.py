@@ -1,16 +1,16 @@
 import collections
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import json
 import logging
 import math
 import numpy
 import numpy.random
+import pandas
 import prometheus_client
 import re
-import requests
-from sklearn.cluster import KMeans
-from sklearn.exceptions import ConvergenceWarning
-from sklearn.neighbors._kd_tree import KDTree
+import sqlite3
+import threading
 import time
 import typing
 from urllib.parse import urlencode
@@ -24,6 +24,10 @@ logger = logging.getLogger(__name__)
 N_RANGES = 3
 MIN_RANGE_SIZE = 0.10  # 10%
 
+# Above this number of points, ranges are computed from weighted geohash cells
+MAX_RANGES_POINTS = 20000
+RANGES_CELLS_PRECISION = 20  # Cells of about 40m by 20m
+
 SPATIAL_RANGE_DELTA_LONG = 0.0001
 SPATIAL_RANGE_DELTA_LAT = 0.0001
 
@@ -31,12 +35,16 @@ MAX_ADDRESS_LENGTH = 90  # 90 characters
 MAX_NOMINATIM_REQUESTS = 200
 NOMINATIM_BATCH_SIZE = 20
 NOMINATIM_MIN_SPLIT_BATCH_SIZE = 2  # Batches >=this are divided on failure
+NOMINATIM_CONCURRENCY = 4  # Batches sent at the same time
+NOMINATIM_CACHE_TTL = 30 * 24 * 3600  # 30 days
 
 LATITUDE = ('latitude', 'lat', 'ycoord', 'y_coord')
 LONGITUDE = ('longitude', 'long', 'lon', 'lng', 'xcoord', 'x_coord')
 
 MAX_WRONG_LEVEL_ADMIN = 0.10  # 10%
 
+ADMIN_CACHE_SIZE = 50000  # Names and parent areas kept in memory
+
 
 PROM_NOMINATIM_REQS = prometheus_client.Counter(
     'profile_nominatim_reqs', "Queries to Nominatim",
@@ -44,48 +52,123 @@ PROM_NOMINATIM_REQS = prometheus_client.Counter(
 PROM_NOMINATIM_REQ_TIME = prometheus_client.Histogram(
     'profile_nominatim_req_seconds', "Time for Nominatim to answer a query",
 )
+PROM_ADMIN_CACHE_HITS = prometheus_client.Counter(
+    'profile_admin_cache_hits', "Admin area lookups found in memory",
+    ['cache'],
+)
+PROM_ADMIN_CACHE_MISSES = prometheus_client.Counter(
+    'profile_admin_cache_misses', "Admin area lookups not found in memory",
+    ['cache'],
+)
+PROM_NOMINATIM_CACHE_HITS = prometheus_client.Counter(
+    'profile_nominatim_cache_hits',
+    "Addresses found in the persistent Nominatim cache",
+)
+
 
+def summarize_points(points, max_cells, precision=RANGES_CELLS_PRECISION):
+    """Group lat/long points into at most `max_cells` weighted centroids.
 
-def get_spatial_ranges(values):
+    The points are put in the cells of base 4 geohashes, at the finest
+    precision for which there are no more than `max_cells` non-empty cells,
+    and each cell is replaced by the mean of its points.
+
+    :param points: Array of ``(latitude, longitude)`` of shape ``(n, 2)``
+    :return: A pair ``(centroids, counts)``
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    size = 1 << precision
+    lat_idx = numpy.floor((points[:, 0] + 90.0) * (size / 180.0))
+    long_idx = numpy.floor((points[:, 1] + 180.0) * (size / 360.0))
+    lat_idx = lat_idx.clip(0, size - 1).astype(numpy.int64)
+    long_idx = long_idx.clip(0, size - 1).astype(numpy.int64)
+
+    # Find the precision, dividing cells in 4 at each level
+    distinct = numpy.unique((long_idx << precision) | lat_idx)
+    bits = precision
+    while len(distinct) > max_cells:
+        bits -= 1
+        distinct = numpy.unique(
+            ((distinct >> (bits + 2)) << bits)
+            | ((distinct & ((2 << bits) - 1)) >> 1)
+        )
+    shift = precision - bits
+    _, cells, counts = numpy.unique(
+        ((long_idx >> shift) << bits) | (lat_idx >> shift),
+        return_inverse=True,
+        return_counts=True,
+    )
+
+    centroids = numpy.empty((len(counts), 2), dtype=numpy.float64)
+    for axis in (0, 1):
+        centroids[:, axis] = numpy.bincount(
+            cells, weights=points[:, axis],
+        ) / counts
+    return centroids, counts
+
+
+def get_spatial_ranges(values, weights=None):
     """Build a small number (3) of bounding boxes from lat/long points.
 
     This performs K-Means clustering, returning a maximum of 3 clusters as
-    bounding boxes.
+    bounding boxes. If there are more than `MAX_RANGES_POINTS` points, the
+    clustering is done on the centroids of geohash cells instead (see
+    :func:`summarize_points`), so the cost doesn't grow with the number of
+    points.
+
+    :param weights: Optional weight of each point, e.g. the number of points
+        in each geohash cell when `values` are the centers of the cells.
     """
+    values = numpy.asarray(values, dtype=numpy.float64).reshape((-1, 2))
+    if weights is None and len(values) > MAX_RANGES_POINTS:
+        values, weights = summarize_points(values, MAX_RANGES_POINTS)
+        logger.info("Summarized points into %d cells", len(values))
+
+    # Imported here, scikit-learn takes a long time to import
+    from sklearn.cluster import KMeans
+    from sklearn.exceptions import ConvergenceWarning
 
     clustering = KMeans(n_clusters=min(N_RANGES, len(values)),
                         random_state=0)
     with ignore_warnings(ConvergenceWarning):
-        clustering.fit(values)
+        clustering.fit(values, sample_weight=weights)
     logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
 
     # Compute confidence intervals for each range
+    if weights is None:
+        weights = numpy.ones(len(values), dtype=numpy.float64)
+    else:
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+    total = weights.sum()
     ranges = []
     sizes = []
     for rg in range(N_RANGES):
-        cluster = [values[i]
-                   for i in range(len(values))
-                   if clustering.labels_[i] == rg]
-        if not cluster:
+        cluster = numpy.flatnonzero(clustering.labels_ == rg)
+        if not len(cluster):
             continue
 
         # Eliminate clusters of outliers
-        if len(cluster) < MIN_RANGE_SIZE * len(values):
+        cluster_size = weights[cluster].sum()
+        if cluster_size < MIN_RANGE_SIZE * total:
             continue
 
-        cluster.sort(key=lambda p: p[0])
-        min_idx = int(0.05 * len(cluster))
-        max_idx = int(0.95 * len(cluster))
-        min_lat = cluster[min_idx][0]
-        max_lat = cluster[max_idx][0]
-        cluster.sort(key=lambda p: p[1])
-        min_long = cluster[min_idx][1]
-        max_long = cluster[max_idx][1]
+        # Find the 5% and 95% positions, counting the weights
+        positions = [int(0.05 * cluster_size), int(0.95 * cluster_size)]
+        bounds = []
+        for axis in (0, 1):
+            order = cluster[
+                numpy.argsort(values[cluster, axis], kind='stable')
+            ]
+            idx = numpy.searchsorted(
+                numpy.cumsum(weights[order]), positions, side='right',
+            ).clip(0, len(order) - 1)
+            bounds.append(values[order[idx], axis])
+        (min_lat, max_lat), (min_long, max_long) = bounds
         ranges.append([
-            [min_long, max_lat],
-            [max_long, min_lat],
+            [float(min_long), float(max_lat)],
+            [float(max_long), float(min_lat)],
         ])
-        sizes.append(len(cluster))
+        sizes.append(float(cluster_size))
     ranges.sort()
     logger.info("Ranges: %r", ranges)
     logger.info("Sizes: %r", sizes)
@@ -179,39 +262,61 @@ _re_loc = re.compile(
 )
 
 
-def _parse_point(value, latlong):
-    m = _re_loc.search(value)
-    if m is not None:
-        try:
-            x = float(m.group(1))
-            y = float(m.group(2))
-        except ValueError:
-            return None
-        if latlong:
-            x, y = y, x
-        if -180.0 < x < 180.0 and -90.0 < y < 90.0:
-            return y, x
-
-
 def parse_wkt_column(values, latlong=False):
     """Parse a pandas.Series of points in WKT format or similar "(long, lat)".
 
     :param latlong: If False (the default), read ``(long, lat)`` format. If
         True, read ``(lat, long)``.
-    :returns: A list of ``(lat, long)`` pairs
+    :returns: A pair ``(points, non_empty)``, where ``points`` is a
+        float64 array of shape ``(n, 2)`` of the ``(lat, long)`` points that
+        parsed correctly, and ``non_empty`` is the number of non-empty cells
     """
+    if (
+        values.dtype.kind in 'OSU'
+        or isinstance(values.dtype, pandas.StringDtype)
+    ):
+        non_empty = int((values != '').sum())
+    else:
+        # Numbers can't be points, but they are there
+        values = values.astype(str)
+        non_empty = len(values)
+
     # Parse points
-    values = values.apply(_parse_point, latlong=latlong)
-    # Drop NaN values
-    values = values.dropna(axis=0)
+    first, second = (
+        pandas.to_numeric(coord).to_numpy(
+            dtype=numpy.float64,
+            na_value=numpy.nan,
+        )
+        for _, coord in values.str.extract(_re_loc).items()
+    )
+    if latlong:
+        lat, long = first, second
+    else:
+        long, lat = first, second
+    # Drop values that didn't parse or are out of range (also drops NaN)
+    with numpy.errstate(invalid='ignore'):
+        mask = (
+            (-180.0 < long) & (long < 180.0)
+            & (-90.0 < lat) & (lat < 90.0)
+        )
+    points = numpy.empty((numpy.count_nonzero(mask), 2), dtype=numpy.float64)
+    points[:, 0] = lat[mask]
+    points[:, 1] = long[mask]
 
-    return list(values)
+    return points, non_empty
 
 
-_nominatim_session = requests.Session()
+_nominatim_session = None
 
 
 def nominatim_query(url, *, q):
+    global _nominatim_session
+
+    import requests
+
+    if _nominatim_session is None:
+        _nominatim_session = requests.Session()
+
     url = url.rstrip('/')
     res = start = end = None  # Avoids warnings
     for i in range(5):
@@ -253,48 +358,188 @@ def nominatim_query(url, *, q):
         return res.json()
 
 
-def _nominatim_batch(url, batch, locations, cache):
+class NominatimCache(object):
+    """Persistent cache of Nominatim results, in a SQLite database on disk.
+
+    Addresses that were not found are cached too. Entries expire after `ttl`
+    seconds. The database can be shared by threads and processes.
+    """
+    def __init__(self, path, ttl=NOMINATIM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._thread_local = threading.local()
+        with self._database as database:
+            database.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS locations(
+                    address TEXT PRIMARY KEY,
+                    latitude REAL,
+                    longitude REAL,
+                    expires REAL NOT NULL
+                );
+                '''
+            )
+
+    def __getstate__(self):
+        return {'path': self.path, 'ttl': self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def _database(self):
+        # SQLite3 doesn't allow concurrent access from different threads,
+        # so we create a separate connection per thread
+        try:
+            database = self._thread_local.database
+        except AttributeError:
+            database = sqlite3.connect(self.path, timeout=30)
+            self._thread_local.database = database
+        return database
+
+    def get_many(self, addresses):
+        """Get the cached results for addresses.
+
+        :return: A dict mapping the addresses that are in the cache to a
+            ``(lat, long)`` tuple, or None if they were not found
+        """
+        results = {}
+        now = time.time()
+        for i in range(0, len(addresses), 500):
+            chunk = addresses[i:i + 500]
+            cur = self._database.execute(
+                '''
+                SELECT address, latitude, longitude
+                FROM locations
+                WHERE address IN ({params}) AND expires > ?;
+                '''.format(params=', '.join('?' * len(chunk))),
+                list(chunk) + [now],
+            )
+            for address, lat, long in cur:
+                if lat is None:
+                    results[address] = None
+                else:
+                    results[address] = (lat, long)
+        return results
+
+    def set_many(self, locations):
+        """Store results, a dict mapping addresses to locations or None.
+        """
+        expires = time.time() + self.ttl
+        with self._database as database:
+            database.executemany(
+                '''
+                INSERT OR REPLACE INTO locations(
+                    address, latitude, longitude, expires
+                )
+                VALUES (?, ?, ?, ?);
+                ''',
+                [
+                    (address, None, None, expires)
+                    if loc is None
+                    else (address, loc[0], loc[1], expires)
+                    for address, loc in locations.items()
+                ],
+            )
+
+
+class RedisNominatimCache(object):
+    """Persistent cache of Nominatim results, in Redis.
+
+    :param redis_client: A ``redis.Redis`` object
+    """
+    def __init__(self, redis_client, ttl=NOMINATIM_CACHE_TTL,
+                 prefix='nominatim:'):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_many(self, addresses):
+        results = {}
+        if not addresses:
+            return results
+        values = self.redis.mget([self.prefix + a for a in addresses])
+        for address, value in zip(addresses, values):
+            if value is not None:
+                value = json.loads(value)
+                results[address] = tuple(value) if value else None
+        return results
+
+    def set_many(self, locations):
+        pipeline = self.redis.pipeline()
+        for address, loc in locations.items():
+            pipeline.set(
+                self.prefix + address,
+                json.dumps(loc),
+                ex=self.ttl,
+            )
+        pipeline.execute()
+
+
+def _nominatim_batch(url, batch):
+    """Resolve a list of addresses, splitting the batch if it fails.
+
+    :return: A dict mapping addresses to ``(lat, long)`` tuples or None
+    """
+    import requests
+
     try:
-        locs = nominatim_query(url, q=list(batch.keys()))
+        locs = nominatim_query(url, q=batch)
     except requests.HTTPError as e:
         if (
             e.response.status_code in (500, 414)
             and len(batch) >= max(2, NOMINATIM_MIN_SPLIT_BATCH_SIZE)
         ):
             # Try smaller batch size
-            batch_list = list(batch.items())
             mid = len(batch) // 2
-            return (
-                _nominatim_batch(url, dict(batch_list[:mid]), locations, cache)
-                +
-                _nominatim_batch(url, dict(batch_list[mid:]), locations, cache)
-            )
+            results = _nominatim_batch(url, batch[:mid])
+            results.update(_nominatim_batch(url, batch[mid:]))
+            return results
         raise e from None
 
-    not_found = 0
-    for location, (value, count) in zip(locs, batch.items()):
+    results = {}
+    for location, value in zip(locs, batch):
         if location:
-            loc = (
+            results[value] = (
                 float(location[0]['lat']),
                 float(location[0]['lon']),
             )
-            cache[value] = loc
-            locations.extend([loc] * count)
         else:
-            cache[value] = None
-            not_found += count
-    batch.clear()
-    return not_found
-
-
-def nominatim_resolve_all(url, array, max_requests=MAX_NOMINATIM_REQUESTS):
-    cache = {}
-    locations = []
-    not_found = 0  # Unique locations not found
+            results[value] = None
+    return results
+
+
+def nominatim_resolve_all(url, array, max_requests=MAX_NOMINATIM_REQUESTS,
+                          *, cache=None, concurrency=NOMINATIM_CONCURRENCY):
+    """Resolve addresses into coordinates using Nominatim.
+
+    :param url: URL of the Nominatim server
+    :param array: The addresses
+    :param max_requests: Maximum number of distinct addresses to send to
+        Nominatim (the addresses found in `cache` don't count)
+    :param cache: A persistent cache, such as `NominatimCache` or
+        `RedisNominatimCache`, checked before sending queries and updated
+        with the results
+    :param concurrency: Number of batches to send to Nominatim at a time
+    :return: A tuple ``(locations, non_empty)``, the list of ``(lat, long)``
+        tuples for the addresses that were found and the number of non-empty
+        values
+    """
+    counts = {}  # Rows for each distinct address, in order of appearance
+    known = {}  # Results from the persistent cache
+    to_query = []
+    pending = []
     non_empty = 0
-    start = time.perf_counter()
     processed = 0
-    batch = {}
+    start = time.perf_counter()
+
+    def lookup(values):
+        if cache is not None:
+            found = cache.get_many(values)
+            PROM_NOMINATIM_CACHE_HITS.inc(len(found))
+            known.update(found)
+            values = [v for v in values if v not in found]
+        to_query.extend(values)
 
     for processed, value in enumerate(array):
         value = value.strip()
@@ -304,33 +549,156 @@ def nominatim_resolve_all(url, array, max_requests=MAX_NOMINATIM_REQUESTS):
 
         if len(value) > MAX_ADDRESS_LENGTH:
             continue
-        elif value in cache:
-            if cache[value] is not None:
-                locations.append(cache[value])
-        elif value in batch:
-            batch[value] += 1
+        elif value in counts:
+            counts[value] += 1
         else:
-            batch[value] = 1
-            if len(batch) == NOMINATIM_BATCH_SIZE:
-                not_found += _nominatim_batch(url, batch, locations, cache)
-                if len(cache) >= max_requests:
+            counts[value] = 1
+            pending.append(value)
+            if len(pending) == NOMINATIM_BATCH_SIZE:
+                lookup(pending)
+                pending = []
+                if len(to_query) >= max_requests:
                     break
 
-    if batch and len(cache) < max_requests:
-        not_found += _nominatim_batch(url, batch, locations, cache)
+    if pending and len(to_query) < max_requests:
+        lookup(pending)
+
+    # Query Nominatim, a few batches at a time
+    to_query = to_query[:max_requests]
+    batches = [
+        to_query[i:i + NOMINATIM_BATCH_SIZE]
+        for i in range(0, len(to_query), NOMINATIM_BATCH_SIZE)
+    ]
+    resolved = {}
+    try:
+        if len(batches) > 1 and concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [
+                    executor.submit(_nominatim_batch, url, batch)
+                    for batch in batches
+                ]
+                for future in futures:
+                    resolved.update(future.result())
+        else:
+            for batch in batches:
+                resolved.update(_nominatim_batch(url, batch))
+    finally:
+        # Store what we got, even if some batches failed
+        if cache is not None and resolved:
+            cache.set_many(resolved)
+    known.update(resolved)
+
+    locations = []
+    for value, count in counts.items():
+        loc = known.get(value)
+        if loc is not None:
+            locations.extend([loc] * count)
 
     logger.info(
-        "Performed %d Nominatim queries in %fs (%d hits). Found %d/%d",
-        len(cache),
+        "Performed %d Nominatim queries in %fs (%d hits, %d cached). "
+        + "Found %d/%d",
+        len(resolved),
         time.perf_counter() - start,
-        len(cache) - not_found,
+        sum(1 for loc in resolved.values() if loc is not None),
+        len(known) - len(resolved),
         len(locations),
         processed,
     )
     return locations, non_empty
 
 
-def disambiguate_admin_areas(admin_areas):
+class _LRUCache(object):
+    """Thread-safe mapping that drops the least recently used entries.
+    """
+    def __init__(self, name, size):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = PROM_ADMIN_CACHE_HITS.labels(name)
+        self._misses = PROM_ADMIN_CACHE_MISSES.labels(name)
+
+    def get(self, key, compute):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                self._entries.move_to_end(key)
+                self._hits.inc()
+                return value
+        self._misses.inc()
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_admin_names_cache = _LRUCache('names', ADMIN_CACHE_SIZE)
+_admin_parents_cache = _LRUCache('parents', ADMIN_CACHE_SIZE)
+_admin_cache_geo_data = None
+
+
+def _check_admin_cache(geo_data):
+    # The caches are only valid for one GeoData object
+    global _admin_cache_geo_data
+
+    if geo_data is not _admin_cache_geo_data:
+        _admin_names_cache.clear()
+        _admin_parents_cache.clear()
+        _admin_cache_geo_data = geo_data
+
+
+def resolve_name_all(geo_data, name):
+    """Get all the areas a name can refer to, memoized.
+
+    The results are kept in a process-wide LRU cache, so names that come up
+    again (in other columns or datasets) don't hit the database.
+
+    :param geo_data: The ``datamart_geo.GeoData`` object
+    :return: A list of ``datamart_geo.Area`` objects
+    """
+    _check_admin_cache(geo_data)
+    return _admin_names_cache.get(
+        name,
+        lambda: list(geo_data.resolve_name_all(name)),
+    )
+
+
+def resolve_names_all(geo_data, names):
+    """Get all the areas each name can refer to, memoized.
+
+    :return: A list of lists of ``datamart_geo.Area`` objects
+    """
+    return [resolve_name_all(geo_data, name) for name in names]
+
+
+def resolve_name(geo_data, name):
+    """Get the first area a name can refer to, or None, memoized.
+    """
+    areas = resolve_name_all(geo_data, name)
+    return areas[0] if areas else None
+
+
+def get_parent_area(area, geo_data=None):
+    """Get the closest parent of an area, memoized.
+
+    :param geo_data: The ``datamart_geo.GeoData`` object the area comes from.
+        If None, the parent is not memoized.
+    """
+    if geo_data is None:
+        return area.get_parent_area()
+    _check_admin_cache(geo_data)
+    return _admin_parents_cache.get(area.id, area.get_parent_area)
+
+
+def disambiguate_admin_areas(admin_areas, geo_data=None):
     """This takes admin areas resolved from names and tries to disambiguate.
 
     Each name in the input will have been resolved to multiple possible areas,
@@ -341,6 +709,9 @@ def disambiguate_admin_areas(admin_areas):
     or all states, but not a mix of counties and states), and if possible all
     in the same parent area (for example, states of the same country, or
     counties in states of the same country).
+
+    :param geo_data: The ``datamart_geo.GeoData`` object the areas come from,
+        used to memoize the parent areas
     """
     # Count possible options
     options = collections.Counter()
@@ -349,10 +720,10 @@ def disambiguate_admin_areas(admin_areas):
         options_for_entry = set()
         for area in candidates:
             level = area.type.value
-            area = area.get_parent_area()
+            area = get_parent_area(area, geo_data)
             while area:
                 options_for_entry.add((level, area))
-                area = area.get_parent_area()
+                area = get_parent_area(area, geo_data)
             options_for_entry.add((level, None))
         options.update(options_for_entry)
 
@@ -459,6 +830,47 @@ def location_to_bits(point, base, precision):
     return bits
 
 
+def location_codes(points, base, precision):
+    """Compute the bits of :func:`location_to_bits` for many points at once.
+
+    The bits are packed into integers, so this only works if there are no
+    more than 64 bits.
+
+    :param points: Array of ``(latitude, longitude)`` of shape ``(n, 2)``
+    :return: Array of uint64 codes, one per point
+    """
+    base_bits = base.bit_length() - 1
+    if 2 ** base_bits != base:
+        raise ValueError("Base is not a power of 2")
+    precision_bits = base_bits * precision
+    if precision_bits > 64:
+        raise ValueError("Too many bits")
+
+    latitudes = points[:, 0]
+    longitudes = points[:, 1]
+    lat_min = numpy.full(len(points), -90.0)
+    lat_max = numpy.full(len(points), 90.0)
+    long_min = numpy.full(len(points), -180.0)
+    long_max = numpy.full(len(points), 180.0)
+    codes = numpy.zeros(len(points), dtype=numpy.uint64)
+    one = numpy.uint64(1)
+    nb_bits = 0
+    while nb_bits < precision_bits:
+        for value, low, high in (
+            (longitudes, long_min, long_max),
+            (latitudes, lat_min, lat_max),
+        ):
+            if nb_bits == precision_bits:
+                break
+            mid = (low + high) / 2.0
+            bit = value > mid
+            numpy.copyto(low, mid, where=bit)
+            numpy.copyto(high, mid, where=~bit)
+            codes = (codes << one) | bit.astype(numpy.uint64)
+            nb_bits += 1
+    return codes
+
+
 def hash_location(point, base=32, precision=16):
     """Hash coordinates into short strings usable for prefix search.
 
@@ -531,25 +943,101 @@ class Geohasher(object):
         self.number_at_level = [0] * (precision)
 
     def add_points(self, points):
-        for point in points:
-            geohash = hash_location(point, self.base, self.precision)
-            # Add this hash to the tree
-            node = self.tree_root
-            for level, key in enumerate(geohash):
-                node[0] += 1
-                try:
-                    node = node[1][key]
-                except KeyError:
-                    new_node = [0, {}]
-                    node[1][key] = new_node
-                    node = new_node
-                    self.number_at_level[level] += 1
-
-                    # If this level has too many nodes, stop building it
-                    if self.number_at_level[level] > self.number:
-                        self.precision = level
-                        break
-            node[0] += 1
+        base_bits = self.base.bit_length() - 1
+        if base_bits * self.precision > 64:
+            # Codes don't fit in integers, add points one at a time
+            for point in points:
+                geohash = hash_location(point, self.base, self.precision)
+                self._add_hash(geohash, 1)
+            return
+
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+        if not len(points):
+            return
+        codes = location_codes(points, self.base, self.precision)
+        precision_bits = base_bits * self.precision
+
+        # Find the precision at which there are few enough distinct cells,
+        # also counting the cells already in the tree
+        existing = self._get_level_codes()
+        distinct = numpy.unique(codes)
+        for level in range(1, self.precision + 1):
+            shift = numpy.uint64(precision_bits - level * base_bits)
+            cells = distinct >> shift
+            cells = cells[numpy.append(True, cells[1:] != cells[:-1])]
+            if len(existing[level]):
+                cells = numpy.union1d(cells, existing[level])
+            if len(cells) > self.number:
+                self.precision = level - 1
+                break
+
+        # Count the points in each cell at that precision, and add the cells
+        # to the tree in the order they first appear in
+        if self.precision == 0:
+            self.tree_root[0] += len(points)
+            return
+        shift = numpy.uint64(precision_bits - self.precision * base_bits)
+        cells, first, counts = numpy.unique(
+            codes >> shift,
+            return_index=True,
+            return_counts=True,
+        )
+        mask = (1 << base_bits) - 1
+        for idx in numpy.argsort(first, kind='stable'):
+            code = int(cells[idx])
+            geohash = ''.join(
+                GEOHASH_CHARS[
+                    (code >> ((self.precision - 1 - level) * base_bits))
+                    & mask
+                ]
+                for level in range(self.precision)
+            )
+            self._add_hash(geohash, int(counts[idx]))
+
+    def add_hashes(self, hashes):
+        """Add cells with their counts, such as the output of `get_hashes()`.
+        """
+        for geohash, count in hashes:
+            self._add_hash(geohash[:self.precision], count)
+
+    def _add_hash(self, geohash, count):
+        """Add a hash to the tree, reducing precision if there are too many.
+        """
+        node = self.tree_root
+        for level, key in enumerate(geohash):
+            node[0] += count
+            try:
+                node = node[1][key]
+            except KeyError:
+                new_node = [0, {}]
+                node[1][key] = new_node
+                node = new_node
+                self.number_at_level[level] += 1
+
+                # If this level has too many nodes, stop building it
+                if self.number_at_level[level] > self.number:
+                    self.precision = level
+                    break
+        node[0] += count
+
+    def _get_level_codes(self):
+        """Get the codes of the cells in the tree, at each level.
+        """
+        base_bits = self.base.bit_length() - 1
+        levels = [[] for _ in range(self.precision + 1)]
+
+        def add_node(code, node, level):
+            levels[level].append(code)
+            if level == self.precision:
+                return
+            for k, n in node[1].items():
+                add_node(
+                    (code << base_bits) | GEOHASH_CHAR_VALUES[k],
+                    n, level + 1,
+                )
+
+        add_node(0, self.tree_root, 0)
+        return [numpy.array(codes, dtype=numpy.uint64) for codes in levels]
 
     def add_aab(self, box):
         base_bits = self.base.bit_length() - 1
@@ -640,6 +1128,7 @@ def median_smallest_distance(points, tree=None):
     if tree is None:
         # points = numpy.unique(points, axis=0)  # Too slow
         points = numpy.array(list(set(tuple(p) for p in points)))
+        from sklearn.neighbors._kd_tree import KDTree
         tree = KDTree(points)
 
     # Get the minimum distances to neighbors for a sample of points
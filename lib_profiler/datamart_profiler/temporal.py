@@ -1,9 +1,10 @@
 import collections
-from datetime import datetime
+from datetime import datetime, timedelta
 import dateutil.parser
 import dateutil.tz
 import logging
-import pandas
+import numpy
+import re
 
 from .warning_tools import raise_warnings
 
@@ -24,7 +25,7 @@ temporal_aggregation_keys = {
     'week': lambda dt: (
         # Simply using "%Y-%W" doesn't work at year boundaries
         # Map each timestamp to the first day of its week
-        (dt - pandas.Timedelta(days=dt.weekday())).strftime('%Y-%m-%d')
+        (dt - timedelta(days=dt.weekday())).strftime('%Y-%m-%d')
     ),
     'day': '%Y-%m-%d',
     'hour': '%Y-%m-%d %H',
@@ -33,10 +34,117 @@ temporal_aggregation_keys = {
 }
 
 
+# Same bins as temporal_aggregation_keys, on datetime64[ns] arrays (of the
+# wall time). The values are only compared, they don't have to be dates
+_temporal_aggregation_floors = {
+    'year': lambda a: a.astype('datetime64[Y]'),
+    'quarter': lambda a: a.astype('datetime64[M]').astype(numpy.int64) // 3,
+    'month': lambda a: a.astype('datetime64[M]'),
+    # 1970-01-01 is a Thursday, shift so weeks start on Monday
+    'week': lambda a: (a.astype('datetime64[D]').astype(numpy.int64) + 3) // 7,
+    'day': lambda a: a.astype('datetime64[D]'),
+    'hour': lambda a: a.astype('datetime64[h]'),
+    'minute': lambda a: a.astype('datetime64[m]'),
+    'second': lambda a: a.astype('datetime64[s]'),
+}
+assert _temporal_aggregation_floors.keys() == temporal_aggregation_keys.keys()
+
+
+def _to_datetime64(values):
+    """Get the distinct wall times of datetime values as datetime64[ns].
+
+    :return: A sorted array, or None if the values can't be converted (mixed
+        timezones, out of bounds for datetime64[ns])
+    """
+    import pandas
+
+    try:
+        if isinstance(values, (pandas.Index, pandas.Series, numpy.ndarray)):
+            index = pandas.DatetimeIndex(values)
+        else:
+            values = list(values)
+            offset = None
+            if values and values[0].tzinfo is not None:
+                tzinfo = values[0].tzinfo
+                if all(value.tzinfo is tzinfo for value in values):
+                    offset = tzinfo.utcoffset(None)
+            if offset is not None:
+                # Fixed offset (e.g. UTC), conversion is much faster
+                index = pandas.to_datetime(values, utc=True)
+                index = index.tz_localize(None) + offset
+            else:
+                index = pandas.DatetimeIndex(values)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return numpy.unique(index.values)
+
+
+def get_timestamps(values):
+    """Get the UNIX timestamps of datetime values, as a float32 array.
+
+    This gives the same result as calling ``timestamp()`` on each value.
+    """
+    import pandas
+
+    values = list(values)
+    if all(value.tzinfo is not None for value in values):
+        try:
+            index = pandas.to_datetime(values, utc=True)
+        except (TypeError, ValueError, OverflowError):
+            pass
+        else:
+            # Divide microseconds, which are exact in float64, like
+            # datetime.timestamp() does
+            micros = index.asi8 // 1000
+            return (micros.astype(numpy.float64) / 1e6).astype('float32')
+
+    # Naive datetimes are in local time, or out of bounds for datetime64[ns]
+    timestamps = numpy.empty(len(values), dtype='float32')
+    for j, dt in enumerate(values):
+        timestamps[j] = dt.timestamp()
+    return timestamps
+
+
 def get_temporal_resolution(values):
     """Returns the resolution of the temporal attribute.
     """
 
+    array = _to_datetime64(values)
+    if array is None or not len(array):
+        return _get_temporal_resolution_python(values)
+
+    if len(array) == 1:
+        import pandas
+
+        value = pandas.Timestamp(array[0])
+        if value.second:
+            return 'second'
+        elif value.minute:
+            return 'minute'
+        elif value.hour:
+            return 'hour'
+        else:
+            return 'day'
+
+    for resolution, floor in _temporal_aggregation_floors.items():
+        bins = floor(array)
+        nb_bins = 1 + numpy.count_nonzero(bins[1:] != bins[:-1])
+        avg_per_bin = len(array) / nb_bins
+        if avg_per_bin < 1.05:
+            # 5 % error tolerated
+            return resolution
+
+    return 'second'
+
+
+def _get_temporal_resolution_python(values):
+    """Pure Python version of :func:`get_temporal_resolution`.
+
+    Used for values that NumPy can't represent.
+    """
+
     if not isinstance(values, set):
         values = set(values)
 
@@ -100,3 +208,100 @@ def parse_date(string):
     if dt1.tzinfo is None:
         dt1 = dt1.replace(tzinfo=dateutil.tz.UTC)
     return dt1
+
+
+# Formats tried by the bulk parser, with a regex that a value has to fully
+# match for the format to be attempted. Those only contain formats that
+# dateutil parses the same way; day-first or 2-digit years are ambiguous and
+# left to dateutil, as are timezones (except for a literal 'Z' meaning UTC)
+DATE_FORMATS = [
+    (fmt, re.compile('^' + pattern + '$'))
+    for fmt, pattern in [
+        ('%Y-%m-%d', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}'),
+        ('%Y-%m-%d %H:%M', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2} [0-9]{1,2}:[0-9]{2}'),
+        ('%Y-%m-%d %H:%M:%S', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2} [0-9]{1,2}:[0-9]{2}:[0-9]{2}'),
+        ('%Y-%m-%d %H:%M:%S.%f', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2} [0-9]{1,2}:[0-9]{2}:[0-9]{2}\.[0-9]{1,6}'),
+        ('%Y-%m-%dT%H:%M', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}T[0-9]{1,2}:[0-9]{2}'),
+        ('%Y-%m-%dT%H:%M:%S', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}T[0-9]{1,2}:[0-9]{2}:[0-9]{2}'),
+        ('%Y-%m-%dT%H:%M:%SZ', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}T[0-9]{1,2}:[0-9]{2}:[0-9]{2}Z'),
+        ('%Y-%m-%dT%H:%M:%S.%f', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}T[0-9]{1,2}:[0-9]{2}:[0-9]{2}\.[0-9]{1,6}'),
+        ('%Y-%m-%dT%H:%M:%S.%fZ', r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}T[0-9]{1,2}:[0-9]{2}:[0-9]{2}\.[0-9]{1,6}Z'),
+        ('%Y-%m', r'[0-9]{4}-[0-9]{1,2}'),
+        ('%Y/%m/%d', r'[0-9]{4}/[0-9]{1,2}/[0-9]{1,2}'),
+        ('%Y%m%d', r'[0-9]{8}'),
+        ('%m/%d/%Y', r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{4}'),
+        ('%m/%d/%Y %H:%M', r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{4} [0-9]{1,2}:[0-9]{2}'),
+        ('%m/%d/%Y %H:%M:%S', r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{4} [0-9]{1,2}:[0-9]{2}:[0-9]{2}'),
+    ]
+]
+
+# Number of values looked at to pick formats
+DATE_FORMATS_SAMPLE = 200
+
+# Maximum number of formats to try on the whole column
+MAX_DATE_FORMATS = 3
+
+
+def infer_date_formats(values):
+    """Pick the candidate date formats that match a sample of the values.
+
+    :param values: A pandas.Series of strings
+    :returns: A list of ``(format, regex)`` pairs, most frequent first
+    """
+    values = values[values != '']
+    if len(values) > DATE_FORMATS_SAMPLE:
+        step = len(values) // DATE_FORMATS_SAMPLE
+        values = values.iloc[::step]
+
+    counts = collections.Counter()
+    for value in values:
+        for entry in DATE_FORMATS:
+            if entry[1].match(value):
+                counts[entry] += 1
+                break
+    return [entry for entry, _ in counts.most_common(MAX_DATE_FORMATS)]
+
+
+def parse_date_values(array):
+    """Parse an array of strings into dates, keeping non-dates as None.
+
+    Formats are inferred from a sample, and the values matching them are
+    parsed in bulk by pandas. Other values go through :func:`parse_date`.
+
+    :returns: An object array of the same length as the input, containing
+        timezone-aware datetimes or None
+    """
+    import pandas
+
+    values = pandas.Series(numpy.asarray(array, dtype=object))
+    results = numpy.full(len(values), None, dtype=object)
+    leftover = (values != '').values
+
+    for fmt, regex in infer_date_formats(values):
+        candidates = values[leftover]
+        candidates = candidates[candidates.str.match(regex)]
+        if not len(candidates):
+            continue
+        parsed = pandas.to_datetime(candidates, format=fmt, errors='coerce')
+        parsed = parsed[~parsed.isna()]
+        if not len(parsed):
+            continue
+        parsed = parsed.dt.tz_localize(dateutil.tz.UTC)
+        results[parsed.index] = parsed.dt.to_pydatetime()
+        leftover[parsed.index] = False
+
+    # Use the slow path for the rest
+    raw_values = values.values
+    for idx in numpy.nonzero(leftover)[0]:
+        results[idx] = parse_date(raw_values[idx])
+
+    return results
+
+
+def parse_dates(array):
+    """Parse the valid dates in an array of strings.
+
+    :returns: A list of timezone-aware datetimes, in order, skipping the
+        values that are not dates
+    """
+    return [dt for dt in parse_date_values(array) if dt is not None]
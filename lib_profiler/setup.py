@@ -23,6 +23,9 @@ setup(name='datamart-profiler',
       version='0.10',
       packages=['datamart_profiler'],
       install_requires=req,
+      extras_require={
+          'arrow': ['pyarrow>=6'],
+      },
       description="Data profiling library for Auctus",
       author="Remi Rampin",
       author_email='remi.rampin@nyu.edu',
@@ -6,6 +6,7 @@ import defusedxml
 import elasticsearch
 import io
 import itertools
+import json
 import lazo_index_service
 import logging
 import opentelemetry.trace
@@ -26,6 +27,7 @@ from datamart_fslock.cache import cache_get_or_set
 from datamart_geo import GeoData
 from datamart_materialize import DatasetTooBig
 from datamart_profiler import process_dataset
+from datamart_profiler.spatial import NominatimCache
 
 
 logger = logging.getLogger(__name__)
@@ -89,7 +91,7 @@ class LazoDeleteFirst(object):
 
 def materialize_and_process_dataset(
     dataset_id, metadata,
-    lazo_client, nominatim, geo_data,
+    lazo_client, nominatim, nominatim_cache, geo_data,
     profile_semaphore,
 ):
     with contextlib.ExitStack() as stack:
@@ -145,16 +147,28 @@ def materialize_and_process_dataset(
                         metadata=metadata,
                         lazo_client=lazo_client,
                         nominatim=nominatim,
+                        nominatim_cache=nominatim_cache,
                         geo_data=geo_data,
                         include_sample=True,
                         coverage=True,
                         plots=True,
+                        diagnostics=bool(
+                            os.environ.get('PROFILER_DIAGNOSTICS'),
+                        ),
                     )
                     logger.info(
                         "Profiling dataset %r took %.2fs",
                         dataset_id,
                         time.perf_counter() - start,
                     )
+                    # Log the diagnostics, don't index them
+                    diagnostics = metadata.pop('diagnostics', None)
+                    if diagnostics is not None:
+                        logger.info(
+                            "Profiling stages for %r: %s",
+                            dataset_id,
+                            json.dumps(diagnostics, sort_keys=True),
+                        )
 
         metadata['materialize'] = materialize
         return metadata
@@ -185,8 +199,10 @@ class Profiler(object):
         )
         if os.environ.get('NOMINATIM_URL'):
             self.nominatim = os.environ['NOMINATIM_URL']
+            self.nominatim_cache = NominatimCache('/cache/nominatim.sqlite3')
         else:
             self.nominatim = None
+            self.nominatim_cache = None
             logger.warning(
                 "$NOMINATIM_URL is not set, not resolving addresses"
             )
@@ -264,6 +280,7 @@ class Profiler(object):
                 metadata,
                 LazoDeleteFirst(self.lazo_client, self.es, dataset_id),
                 self.nominatim,
+                self.nominatim_cache,
                 self.geo_data,
                 self.profile_semaphore,
             )
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+"""Benchmark the profiler on synthetic datasets.
+
+This generates deterministic CSV files of different kinds and sizes, runs
+process_dataset() on them with each combination of options, and records the
+wall time and peak memory of each stage (from the profiler's tracing spans,
+recorded with datamart_profiler.diagnostics.StageRecorder; memory is the peak
+allocated during the stage as tracemalloc sees it, which includes NumPy
+arrays, measured in a separate run). The time it takes to import the profiler is also measured, in
+a new interpreter. Results are written as JSON, and two result files can be
+compared::
+
+    python scripts/benchmark_profiler.py -o new.json
+    python scripts/benchmark_profiler.py --compare old.json new.json
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import numpy
+import opentelemetry.trace
+import os
+import pandas
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from datamart_profiler.diagnostics import StageRecorder
+
+
+logger = logging.getLogger('benchmark_profiler')
+
+
+SEED = 42
+
+SIZES = [1000, 10000]
+
+# Options of process_dataset() that are benchmarked in all combinations
+OPTIONS = ['coverage', 'plots', 'include_sample']
+
+# Stages of the profile, from the names of the tracing spans
+STAGES = {
+    'load_data': ['profile/load_data'],
+    'identify_types': ['profile/identify_types'],
+    'coverage': [
+        'profile/numerical_ranges',
+        'profile/spatial_coverage',
+        'profile/temporal_coverage',
+    ],
+    'plots': [
+        'profile/numerical_plot',
+        'profile/temporal_plot',
+        'profile/categorical_plot',
+        'profile/textual_plot',
+    ],
+    'sample': ['profile/sample'],
+}
+
+WORDS = (
+    'the of and to in is was for on that with as by at from his her an '
+    'were are which this be has had not but they one their its new after '
+    'who first also two been more other some into time when year all can '
+    'city river school house music park data report market water street'
+).split()
+
+ADMIN_NAMES = [
+    'Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California', 'Colorado',
+    'Connecticut', 'Delaware', 'Florida', 'Georgia', 'Hawaii', 'Idaho',
+    'Illinois', 'Indiana', 'Iowa', 'Kansas', 'Kentucky', 'Louisiana', 'Maine',
+    'Maryland', 'Massachusetts', 'Michigan', 'Minnesota', 'Mississippi',
+    'Missouri', 'Montana', 'Nebraska', 'Nevada', 'New Hampshire',
+    'New Jersey', 'New Mexico', 'New York', 'North Carolina', 'North Dakota',
+    'Ohio', 'Oklahoma', 'Oregon', 'Pennsylvania', 'Rhode Island',
+    'South Carolina', 'South Dakota', 'Tennessee', 'Texas', 'Utah',
+    'Vermont', 'Virginia', 'Washington', 'West Virginia', 'Wisconsin',
+    'Wyoming',
+]
+
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%m/%d/%Y',
+    '%d %b %Y',
+    '%Y-%m-%dT%H:%M:%S',
+    '%B %d, %Y %H:%M',
+]
+
+
+def _dates(rand, rows):
+    seconds = rand.randint(0, 30 * 365 * 24 * 3600, rows)
+    return pandas.Timestamp('1995-01-01') + pandas.to_timedelta(
+        seconds, unit='s',
+    )
+
+
+def gen_wide_numeric(rand, rows):
+    columns = {}
+    for i in range(40):
+        if i % 2:
+            columns['int_%d' % i] = rand.randint(-1000, 100000, rows)
+        else:
+            columns['float_%d' % i] = rand.normal(i * 10.0, i + 1.0, rows)
+    return pandas.DataFrame(columns)
+
+
+def gen_long_categorical(rand, rows):
+    return pandas.DataFrame({
+        'id': numpy.arange(rows),
+        'color': rand.choice(['red', 'green', 'blue', 'yellow'], rows),
+        'category': rand.choice(['cat_%d' % i for i in range(50)], rows),
+        'flag': rand.choice(['true', 'false'], rows),
+        'grade': rand.choice(list('ABCDF'), rows),
+    })
+
+
+def gen_free_text(rand, rows):
+    words = numpy.array(WORDS, dtype=object)
+
+    def sentences(length):
+        lengths = rand.randint(length // 2, length, rows)
+        return [
+            ' '.join(rand.choice(words, n)).capitalize() + '.'
+            for n in lengths
+        ]
+
+    return pandas.DataFrame({
+        'title': sentences(8),
+        'description': sentences(40),
+    })
+
+
+def gen_dates(rand, rows):
+    columns = {}
+    for i, fmt in enumerate(DATE_FORMATS):
+        columns['date_%d' % i] = _dates(rand, rows).strftime(fmt)
+    return pandas.DataFrame(columns)
+
+
+def gen_latlong(rand, rows):
+    return pandas.DataFrame({
+        'name': rand.choice(['site_%d' % i for i in range(100)], rows),
+        'latitude': rand.uniform(25.0, 49.0, rows).round(6),
+        'longitude': rand.uniform(-124.0, -67.0, rows).round(6),
+        'value': rand.exponential(10.0, rows),
+    })
+
+
+def gen_wkt_points(rand, rows):
+    lat = rand.uniform(40.5, 40.9, rows)
+    long = rand.uniform(-74.2, -73.7, rows)
+    return pandas.DataFrame({
+        'location': [
+            'POINT (%.6f %.6f)' % (x, y) for x, y in zip(long, lat)
+        ],
+        'count': rand.poisson(4, rows),
+    })
+
+
+def gen_admin_names(rand, rows):
+    return pandas.DataFrame({
+        'state': rand.choice(ADMIN_NAMES, rows),
+        'population': rand.randint(1000, 1000000, rows),
+    })
+
+
+def gen_pivoted_years(rand, rows):
+    columns = {'country': ['country_%d' % i for i in range(rows)]}
+    for year in range(1990, 2021):
+        columns[str(year)] = rand.normal(100.0, 20.0, rows).round(2)
+    return pandas.DataFrame(columns)
+
+
+DATASETS = {
+    'wide_numeric': gen_wide_numeric,
+    'long_categorical': gen_long_categorical,
+    'free_text': gen_free_text,
+    'dates': gen_dates,
+    'latlong': gen_latlong,
+    'wkt_points': gen_wkt_points,
+    'admin_names': gen_admin_names,
+    'pivoted_years': gen_pivoted_years,
+}
+
+
+def generate(kind, rows, directory):
+    """Write a synthetic dataset, if it doesn't exist yet.
+
+    :return: The path to the CSV file
+    """
+    path = os.path.join(directory, '%s_%d.csv' % (kind, rows))
+    if not os.path.exists(path):
+        rand = numpy.random.RandomState(SEED)
+        data = DATASETS[kind](rand, rows)
+        data.to_csv(path + '.tmp', index=False)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+class _Tracer(opentelemetry.trace.NoOpTracer):
+    """Records each span as a stage of the current `StageRecorder`.
+    """
+    def __init__(self, provider):
+        self._provider = provider
+
+    @contextlib.contextmanager
+    def start_as_current_span(self, name, *args, **kwargs):
+        provider = self._provider
+        if provider.stage_span:
+            # This is the span that the recorder opens for the stage itself
+            provider.stage_span = False
+            yield opentelemetry.trace.INVALID_SPAN
+        else:
+            provider.stage_span = True
+            with provider.recorder.stage(name):
+                yield opentelemetry.trace.INVALID_SPAN
+
+
+class _TracerProvider(opentelemetry.trace.NoOpTracerProvider):
+    def __init__(self):
+        self.recorder = StageRecorder()
+        self.stage_span = False
+
+    def get_tracer(self, *args, **kwargs):
+        return _Tracer(self)
+
+
+def summarize_stages(spans):
+    stages = {}
+    for stage, names in STAGES.items():
+        entries = [spans[name] for name in names if name in spans]
+        if entries:
+            peaks = [
+                e['peak_memory'] for e in entries
+                if e['peak_memory'] is not None
+            ]
+            stages[stage] = {
+                'time': sum(e['time'] for e in entries),
+                'peak_memory': max(peaks) if peaks else None,
+            }
+    return stages
+
+
+def measure_import_time(repeat=3):
+    """Measure the time to import the profiler in a new interpreter.
+
+    :return: The best time, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import time\n'
+            'start = time.perf_counter()\n'
+            'import datamart_profiler.core\n'
+            'print(time.perf_counter() - start)\n',
+        ])
+        times.append(float(output))
+    return min(times)
+
+
+def run_one(provider, path, options, geo_data, trace_memory):
+    from datamart_profiler import process_dataset
+
+    provider.recorder = StageRecorder(memory=trace_memory)
+    tracer = provider.get_tracer(__name__)
+    with tracer.start_as_current_span('profile'):
+        process_dataset(path, geo_data=geo_data, **options)
+    return provider.recorder.stages
+
+
+def run(args):
+    provider = _TracerProvider()
+    opentelemetry.trace.set_tracer_provider(provider)
+
+    import datamart_profiler
+
+    # Check for datamart-geo
+    try:
+        from datamart_geo import GeoData
+        geo_data = GeoData.from_local_cache()
+    except (ImportError, FileNotFoundError):
+        logger.warning("datamart-geo data is not available")
+        geo_data = None
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for kind, rows in itertools.product(args.datasets, args.sizes):
+        path = generate(kind, rows, args.data_dir)
+        for values in itertools.product([False, True], repeat=len(OPTIONS)):
+            options = dict(zip(OPTIONS, values))
+            logger.info("Profiling %s, %d rows, %r", kind, rows, options)
+            times = []
+            spans = None
+            for _ in range(args.repeat):
+                run_spans = run_one(provider, path, options, geo_data, False)
+                times.append(run_spans['profile']['time'])
+                if spans is None or (
+                    run_spans['profile']['time'] < spans['profile']['time']
+                ):
+                    spans = run_spans
+            if args.memory:
+                memory_spans = run_one(
+                    provider, path, options, geo_data, True,
+                )
+                for name, span in spans.items():
+                    span['peak_memory'] = memory_spans[name]['allocated']
+            else:
+                for span in spans.values():
+                    span['peak_memory'] = None
+            profile = spans.pop('profile')
+            result = {
+                'dataset': kind,
+                'rows': rows,
+                'size': os.stat(path).st_size,
+                'options': options,
+                'wall_time': min(times),
+                'wall_times': times,
+                'peak_memory': profile['peak_memory'],
+                'spans': spans,
+            }
+            result['stages'] = summarize_stages(spans)
+            logger.info("%.3fs", result['wall_time'])
+            results.append(result)
+
+    output = {
+        'version': datamart_profiler.__version__,
+        'import_time': measure_import_time(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    else:
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=2, sort_keys=True)
+
+
+def _key(result):
+    return (
+        result['dataset'],
+        result['rows'],
+        tuple(sorted(result['options'].items())),
+    )
+
+
+def compare(old_file, new_file):
+    with open(old_file) as fp:
+        old_info = json.load(fp)
+    old = {_key(r): r for r in old_info['results']}
+    with open(new_file) as fp:
+        new = json.load(fp)
+    if 'import_time' in old_info and 'import_time' in new:
+        print("import time: %.3fs -> %.3fs" % (
+            old_info['import_time'], new['import_time'],
+        ))
+    new = new['results']
+
+    print("%-18s %7s %-16s %9s %9s %7s" % (
+        "dataset", "rows", "options", "old (s)", "new (s)", "ratio",
+    ))
+    for result in new:
+        old_result = old.get(_key(result))
+        if old_result is None:
+            continue
+        options = ','.join(
+            k for k, v in sorted(result['options'].items()) if v
+        ) or '-'
+        print("%-18s %7d %-16s %9.3f %9.3f %6.2fx" % (
+            result['dataset'], result['rows'], options[:16],
+            old_result['wall_time'], result['wall_time'],
+            old_result['wall_time'] / max(result['wall_time'], 1e-9),
+        ))
+        for stage, values in sorted(result['stages'].items()):
+            old_stage = old_result['stages'].get(stage)
+            if old_stage is None:
+                continue
+            memory = ''
+            if values['peak_memory'] and old_stage['peak_memory']:
+                memory = "  memory %.1f MB -> %.1f MB" % (
+                    old_stage['peak_memory'] / 1e6,
+                    values['peak_memory'] / 1e6,
+                )
+            print("    %-20s %9.3f %9.3f%s" % (
+                stage, old_stage['time'], values['time'], memory,
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        'benchmark_profiler',
+        description="Benchmark the profiler on synthetic datasets",
+    )
+    parser.add_argument('-v', action='count',
+                        default=0, dest='verbosity',
+                        help="augments verbosity level")
+    parser.add_argument('-o', '--output', action='store', default='-',
+                        help="file to write the results to (JSON)")
+    parser.add_argument('--data-dir', action='store',
+                        default=os.path.join(
+                            tempfile.gettempdir(), 'auctus-benchmark',
+                        ),
+                        help="where to keep the generated datasets")
+    parser.add_argument('--datasets', action='store',
+                        default=','.join(DATASETS),
+                        help="comma-separated kinds of datasets to use, "
+                             "from: %s" % ', '.join(DATASETS))
+    parser.add_argument('--sizes', action='store',
+                        default=','.join(str(s) for s in SIZES),
+                        help="comma-separated numbers of rows")
+    parser.add_argument('--repeat', action='store', type=int, default=1,
+                        help="number of timed runs, the fastest is kept")
+    parser.add_argument('--no-memory', action='store_false', default=True,
+                        dest='memory',
+                        help="don't do the extra run measuring memory")
+    parser.add_argument('--compare', action='store', nargs=2,
+                        metavar=('OLD', 'NEW'),
+                        help="compare two results files instead of running")
+    args = parser.parse_args()
+
+    # Set up logging
+    level = {
+        0: logging.WARNING,
+        1: logging.INFO,
+    }.get(args.verbosity, logging.DEBUG)
+    logging.basicConfig(level=level)
+    # Only show our own messages at INFO
+    if args.verbosity == 1:
+        logging.getLogger('datamart_profiler').setLevel(logging.WARNING)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.datasets = args.datasets.split(',')
+    for kind in args.datasets:
+        if kind not in DATASETS:
+            parser.error("Unknown dataset %r" % kind)
+    args.sizes = [int(s) for s in args.sizes.split(',')]
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
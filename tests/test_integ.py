@@ -345,7 +345,8 @@ class TestProfiler(DatamartTest):
 
 
 class TestProfileQuery(DatamartTest):
-    def check_result(self, response, metadata, token, fast=False):
+    def check_result(self, response, metadata, token, fast=False,
+                     status=None):
         # Some fields like 'name', 'description' won't be there
         metadata = {k: v for k, v in metadata.items()
                     if k not in {'id', 'name', 'description',
@@ -380,6 +381,8 @@ class TestProfileQuery(DatamartTest):
 
         # Expect token
         metadata['token'] = token
+        if status is not None:
+            metadata['status'] = status
 
         self.assertJson(response.json(), metadata)
 
@@ -396,6 +399,32 @@ class TestProfileQuery(DatamartTest):
             'd99a8e42e65fb84e2ad800be35a8834b30828227',
         )
 
+    def test_progressive(self):
+        """Profile the basic.csv file via the API, progressively"""
+        token = 'd99a8e42e65fb84e2ad800be35a8834b30828227'
+        with data('basic.csv') as basic_fp:
+            response = self.datamart_post(
+                '/profile/progressive',
+                files={'data': basic_fp},
+            )
+        obj = response.json()
+        self.assertIn(obj.pop('status'), ('profiling', 'done'))
+        self.assertEqual(obj['token'], token)
+        self.assertEqual(obj['nb_rows'], basic_metadata['nb_rows'])
+
+        response = self.datamart_get(
+            '/profile/status/' + token,
+            params={'wait': '60'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.check_result(response, basic_metadata, token, status='done')
+
+        response = self.datamart_get(
+            '/profile/status/' + '0' * 40,
+            check_status=False,
+        )
+        self.assertEqual(response.status_code, 404)
+
     def test_excel(self):
         """Profile the excel.xlsx file via the API"""
         with data('excel.xlsx') as excel_fp:
@@ -1,24 +1,39 @@
 import contextlib
 import csv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dateutil.tz import UTC
+import http.server
 import io
+import json
+import numpy
 import os
 import pandas
+import prometheus_client
 import random
 import requests
+import subprocess
+import sys
 import tempfile
 import textwrap
+import threading
+import tracemalloc
 import unittest
+import unittest.mock
+import urllib.parse
 
 import datamart_geo
 from datamart_profiler import process_dataset
+from datamart_profiler import core
 from datamart_profiler.core import expand_attribute_name, load_data
+from datamart_profiler import numerical
+from datamart_profiler import plots
 from datamart_profiler import profile_types
+from datamart_profiler import sketches
 from datamart_profiler import spatial
 from datamart_profiler.spatial import LATITUDE, LONGITUDE, LatLongColumn, \
     disambiguate_admin_areas
-from datamart_profiler.temporal import get_temporal_resolution, parse_date
+from datamart_profiler.temporal import get_temporal_resolution, \
+    get_timestamps, parse_date, parse_dates
 
 from .utils import DataTestCase, data
 
@@ -89,6 +104,92 @@ class TestCLI(unittest.TestCase):
         self.assertEqual(parse_size('123M'), 123000000)
         self.assertEqual(parse_size('123 M'), 123000000)
 
+    def test_batch(self):
+        """Test profiling files in batch mode, and resuming"""
+        from datamart_profiler.__main__ import list_files, profile_batch
+
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, 'sub'))
+            for name in ('one.csv', 'sub/two.csv', 'sub/three.txt'):
+                with open(os.path.join(tmp, name), 'w') as fp:
+                    fp.write('name,number\na,1\nb,2\n')
+            with open(os.path.join(tmp, 'bad.csv'), 'wb') as fp:
+                fp.write(b'\xff\xfe\xfd\n')
+            manifest = os.path.join(tmp, 'manifest.txt')
+            with open(manifest, 'w') as fp:
+                fp.write(os.path.join(tmp, 'bad.csv') + '\n\n')
+
+            files = list_files(
+                [os.path.join(tmp, 'sub'), os.path.join(tmp, '*.csv')],
+                manifest,
+            )
+            self.assertEqual(
+                [os.path.relpath(f, tmp) for f in files],
+                ['bad.csv', 'sub/three.txt', 'sub/two.csv', 'one.csv'],
+            )
+
+            output = os.path.join(tmp, 'output.jsonl')
+            self.assertEqual(profile_batch(files, output, {}, jobs=2), 1)
+            with open(output) as fp:
+                records = [json.loads(line) for line in fp]
+            self.assertEqual(
+                sorted(records, key=lambda r: r['file'])[0]['file'],
+                files[0],
+            )
+            self.assertEqual(
+                {r['file'] for r in records if 'metadata' in r},
+                set(files[1:]),
+            )
+            self.assertTrue(all(
+                r['metadata']['nb_rows'] == 2
+                for r in records if 'metadata' in r
+            ))
+
+            # Interrupted while writing, only the failed file is profiled
+            with open(output, 'a') as fp:
+                fp.write('{"file": "interr')
+            self.assertEqual(profile_batch(files, output, {}, jobs=1), 1)
+            with open(output) as fp:
+                lines = fp.read().splitlines()
+            self.assertEqual(len(lines), 6)
+            self.assertEqual(json.loads(lines[-1])['file'], files[0])
+
+
+class TestImports(unittest.TestCase):
+    def run_python(self, code):
+        return json.loads(subprocess.check_output([sys.executable, '-c', code]))
+
+    def test_lazy_imports(self):
+        """Test that heavy dependencies are only imported when needed"""
+        heavy = ['pandas', 'requests', 'scipy', 'sklearn']
+        for statement, expected in [
+            ('import datamart_profiler', []),
+            ('from datamart_profiler import parse_date', []),
+            ('from datamart_profiler import count_rows_to_skip', []),
+            ('import datamart_profiler.core', ['pandas']),
+        ]:
+            modules = self.run_python(
+                'import json, sys\n'
+                + statement + '\n'
+                + 'print(json.dumps(sorted(sys.modules)))\n'
+            )
+            self.assertEqual(
+                [m for m in heavy if m in modules],
+                expected,
+                statement,
+            )
+
+    def test_skip_rows_imports(self):
+        """Test that counting rows to skip only needs the standard library"""
+        modules = self.run_python(
+            'import json, sys\n'
+            'from datamart_profiler import count_rows_to_skip\n'
+            'print(json.dumps(sorted(sys.modules)))\n'
+        )
+        self.assertNotIn('datamart_profiler.core', modules)
+        for name in ['numpy', 'opentelemetry', 'prometheus_client', 'regex']:
+            self.assertNotIn(name, modules)
+
 
 class TestSample(unittest.TestCase):
     @contextlib.contextmanager
@@ -108,12 +209,16 @@ class TestSample(unittest.TestCase):
         with self.random_data(1000) as (tmp, filesize):
             self.assertEqual(filesize, 11901)
             data, metadata, column_names = load_data(tmp.name, 5000)
-            self.assertEqual(data.shape, (421, 2))
+            self.assertEqual(data.shape, (426, 2))
+            self.assertEqual(metadata['nb_rows'], 1000)
+            self.assertTrue(data['id'].astype(int).is_monotonic_increasing)
+            self.assertGreater(int(data['id'].iloc[-1]), 900)
 
         with self.random_data(600) as (tmp, filesize):
             self.assertEqual(filesize, 7101)
             data, metadata, column_names = load_data(tmp.name, 5000)
-            self.assertEqual(data.shape, (423, 2))
+            self.assertEqual(data.shape, (426, 2))
+            self.assertEqual(metadata['nb_rows'], 600)
 
         with self.random_data(425) as (tmp, filesize):
             self.assertEqual(filesize, 5001)
@@ -123,6 +228,71 @@ class TestSample(unittest.TestCase):
             data, metadata, column_names = load_data(tmp.name, 6000)
             self.assertEqual(data.shape, (425, 2))
 
+    def test_sample_multiline(self):
+        """Test sampling a file with line breaks in quoted values"""
+        with tempfile.NamedTemporaryFile('w+') as tmp:
+            writer = csv.writer(tmp)
+            writer.writerow(['id', 'text'])
+            for i in range(500):
+                writer.writerow([i, 'line one\n"line" two\n'])
+            tmp.flush()
+            data, metadata, column_names = load_data(tmp.name, 5000)
+        self.assertEqual(metadata['nb_rows'], 500)
+        self.assertEqual(data.shape[1], 2)
+        self.assertTrue(
+            (data['text'] == 'line one\n"line" two\n').all()
+        )
+
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestLoadEngine(unittest.TestCase):
+    DATA = (
+        b'id,,name,name,name.1\n'
+        b'1,a,"multi\nline",x,\n'
+        b'2,,"say ""hi""",y,z\n'
+    )
+
+    def test_column_names(self):
+        """Test that column names are mangled like pandas does"""
+        self.assertEqual(
+            core._mangle_column_names(['id', '', 'name', 'name', 'name.1']),
+            list(pandas.read_csv(io.BytesIO(self.DATA), dtype=str).columns),
+        )
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            load_data(io.BytesIO(self.DATA), engine='arrow')
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_pyarrow(self):
+        """Test loading with pyarrow, same result as pandas"""
+        expected, _, _ = load_data(io.BytesIO(self.DATA))
+        data, metadata, column_names = load_data(
+            io.BytesIO(self.DATA),
+            engine='pyarrow',
+        )
+        self.assertEqual(metadata['nb_rows'], 2)
+        self.assertEqual(column_names, ['id', '', 'name', 'name', 'name.1'])
+        self.assertTrue(
+            all(isinstance(dtype, pandas.StringDtype) for dtype in data.dtypes)
+        )
+        pandas.testing.assert_frame_equal(data.astype(object), expected)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_pyarrow_fallback(self):
+        """Test falling back to pandas for files pyarrow can't read"""
+        data, metadata, column_names = load_data(
+            io.BytesIO(b'a,b\n1,2\n3\n'),
+            engine='pyarrow',
+        )
+        self.assertEqual(data.dtypes.tolist(), [object, object])
+        self.assertEqual(data.values.tolist(), [['1', '2'], ['3', '']])
+
 
 class TestNames(unittest.TestCase):
     def test_names(self):
@@ -204,6 +374,79 @@ class TestIndex(unittest.TestCase):
         )
 
 
+class TestWorkers(unittest.TestCase):
+    def test_encode_column(self):
+        """Test encoding columns to share them with workers"""
+        from datamart_profiler.core import decode_column, encode_column
+
+        column = decode_column(encode_column(
+            pandas.Series(['b', 'a', '', 'b', '\u00e9t\u00e9', 'b']),
+        ))
+        self.assertEqual(list(column.uniques), ['b', 'a', '', '\u00e9t\u00e9'])
+        self.assertEqual(column.counts, [3, 1, 1, 1])
+        self.assertEqual(
+            list(column.array),
+            ['b', 'a', '', 'b', '\u00e9t\u00e9', 'b'],
+        )
+
+    def test_parallel(self):
+        """Test profiling columns in worker processes"""
+        with data('lat_longs.csv', 'r') as data_fp:
+            dataframe = pandas.read_csv(data_fp)
+        self.assertEqual(
+            process_dataset(dataframe, plots=True, workers=2),
+            process_dataset(dataframe, plots=True),
+        )
+
+    def test_parallel_metrics(self):
+        """Test that the stages of columns in workers are reported here"""
+        def count():
+            return prometheus_client.REGISTRY.get_sample_value(
+                'profile_column_stage_seconds_count',
+                {'stage': 'identify_types', 'structural_type': 'http://schema.org/Text'},
+            ) or 0
+
+        before = count()
+        dataframe = pandas.DataFrame({
+            'first': ['a', 'b', 'c'] * 10,
+            'second': ['d', 'e', 'f'] * 10,
+        })
+        metadata = process_dataset(dataframe, workers=2)
+        self.assertNotIn('diagnostics', metadata)
+        self.assertEqual(count(), before + 2)
+
+        # Workers leave it to the parent
+        with unittest.mock.patch.object(core, '_in_worker', True):
+            core.process_column(
+                pandas.Series(['a', 'b', 'c'] * 10),
+                {'name': 'third'},
+            )
+        self.assertEqual(count(), before + 2)
+
+    def test_shared_memory(self):
+        """Test that workers don't track the shared memory segments"""
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(create=True, size=16)
+        try:
+            proc = subprocess.run(
+                [
+                    sys.executable, '-c',
+                    'from datamart_profiler.core import '
+                    '_attach_shared_memory\n'
+                    '_attach_shared_memory(%r).close()\n' % shm.name,
+                ],
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+            self.assertNotIn(b'leaked', proc.stderr)
+            # Still there
+            shared_memory.SharedMemory(name=shm.name).close()
+        finally:
+            shm.close()
+            shm.unlink()
+
+
 class TestLatlongSelection(DataTestCase):
     def test_normalize_name(self):
         """Test normalizing column names"""
@@ -352,6 +595,23 @@ class TestDates(DataTestCase):
             None,
         )
 
+    def test_parse_bulk(self):
+        """Test parsing a column of dates with inferred formats"""
+        values = [
+            '2019-07-01', '2019-07-02', '', '2019-7-3', '2019-02-30',
+            '07/04/2019', 'Monday July 1, 2019', '2019-07-02T21:13:19-04:00',
+            '20190702', '2019-07-02T21:13:19.5Z',
+            'June 6 11:00', '2019-07-05', '12',
+        ]
+        self.assertEqual(
+            parse_dates(values),
+            [d for d in (parse_date(v) for v in values) if d is not None],
+        )
+        self.assertEqual(
+            parse_dates(['2019-07-01 10:00:00', '2019-07-01 11:30:00'])[1],
+            datetime(2019, 7, 1, 11, 30, tzinfo=UTC),
+        )
+
     def test_year(self):
         """Test the 'year' special-case"""
         dataframe = pandas.DataFrame({
@@ -432,6 +692,20 @@ class TestTemporalResolutions(unittest.TestCase):
 
         self.do_checks(get_res)
 
+    def test_timezones(self):
+        """Test guessing temporal resolution with timezones"""
+        # Bins are computed on the local time
+        tz = timezone(timedelta(hours=-5))
+        values = [datetime(2020, m, 1, tzinfo=tz) for m in range(1, 10)]
+        self.assertEqual(get_temporal_resolution(values), 'month')
+
+        # Mixed timezones
+        values = [
+            datetime(2020, 1, d, 12, tzinfo=tz if d % 2 else UTC)
+            for d in range(1, 20)
+        ]
+        self.assertEqual(get_temporal_resolution(values), 'day')
+
     def do_checks(self, get_res):
         self.assertEqual(
             get_res([
@@ -693,6 +967,603 @@ class TestTypes(unittest.TestCase):
             positive, negative,
         )
 
+    def test_count(self):
+        """Test counting structural types with the combined patterns"""
+        self.assertEqual(
+            profile_types.regular_exp_count([
+                '12', '', '1', '4.0', '-.4e17', 'https://auctus.vida-nyu.org/',
+                '/var/mail/fchirigati', 'POINT (-73.99 40.72)',
+                'NEW YORK (40.729753, -73.997174)', 'POINT(40.72, -73.99)',
+                '(40.729753, -73.997174)', 'POLYGON ((1 2 3 4), (5 6 7 8))',
+                'some free text here', 'short text', 'yes', 'N',
+            ]),
+            {
+                'empty': 1, 'int': 3, 'float': 1, 'url': 1, 'file': 1,
+                'point': 1, 'geo_combined': 1, 'other_point': 1,
+                'latlong_point': 1, 'polygon': 1, 'text': 1, 'bool': 3,
+            },
+        )
+
+    def test_count_trailing_newline(self):
+        """Test that patterns match before a newline, like the regexes do"""
+        self.assertEqual(
+            profile_types.regular_exp_count([
+                '12\n', 'NEW YORK (40.729753, -73.997174)\n',
+                'POINT(40.72, -73.99)\n', '(40.729753, -73.997174)\n',
+                'POLYGON ((1 2 3 4), (5 6 7 8))\n',
+                '(40.729753, -73.997174) ', '(40.729753, -73.997174)\n\n',
+            ]),
+            {
+                'int': 1, 'geo_combined': 1, 'other_point': 1,
+                'latlong_point': 1, 'polygon': 1,
+            },
+        )
+
+
+class TestDistinctValues(unittest.TestCase):
+    def test_expand(self):
+        """Test factorizing a column and expanding per-value results"""
+        column = profile_types.ColumnValues(['b', 'a', '', 'b', 'a', 'b'])
+        self.assertEqual(list(column.uniques), ['b', 'a', ''])
+        self.assertEqual(column.counts, [3, 2, 1])
+        self.assertEqual(column.distinct_values(), {'a', 'b'})
+        self.assertEqual(column.num_distinct(), 2)
+        self.assertEqual(list(column.non_empty_uniques()), ['b', 'a'])
+        self.assertEqual(
+            list(column.expand([[1, 2], [3, 4], None])),
+            [[1, 2], [3, 4], None, [1, 2], [3, 4], [1, 2]],
+        )
+
+    def test_numpy_strings(self):
+        """Test a column of numpy.str_ objects"""
+        rand = numpy.random.RandomState(1)
+        values = list(rand.choice(['NY', 'CA', 'TX', ''], 3000))
+        self.assertIsInstance(values[0], numpy.str_)
+        column = profile_types.ColumnValues(values)
+        self.assertEqual(column.num_distinct(), 3)
+        self.assertEqual(
+            sorted(column.non_empty_uniques()),
+            ['CA', 'NY', 'TX'],
+        )
+        metadata = process_dataset(pandas.DataFrame({'state': values}))
+        self.assertEqual(metadata['columns'][0]['num_distinct_values'], 3)
+
+    def test_numbers(self):
+        """Test parsing the numerical values of a column"""
+        column = profile_types.ColumnValues(['1', '2.5', '', '1', 'a', '-3e2'])
+        numbers = column.numbers()
+        self.assertEqual(numbers.dtype, numpy.float64)
+        self.assertEqual(
+            [None if numpy.isnan(n) else n for n in numbers],
+            [1.0, 2.5, None, 1.0, None, -300.0],
+        )
+        self.assertIs(column.unique_numbers(), column.unique_numbers())
+
+    def test_types(self):
+        """Test that types are weighted by the count of each value"""
+        array = ['2020-01-0%d' % (i % 3 + 1) for i in range(50)]
+        array[7] = 'nope'
+        structural_type, semantic_types, column_meta = \
+            profile_types.identify_types(array, 'when', None)
+        self.assertEqual(structural_type, 'http://schema.org/Text')
+        self.assertEqual(
+            set(semantic_types),
+            {
+                'http://schema.org/DateTime',
+                'http://schema.org/Enumeration',
+            },
+        )
+        self.assertEqual(len(semantic_types['http://schema.org/DateTime']), 49)
+        self.assertEqual(
+            semantic_types['http://schema.org/DateTime'][:2],
+            [
+                datetime(2020, 1, 1, tzinfo=UTC),
+                datetime(2020, 1, 2, tzinfo=UTC),
+            ],
+        )
+        self.assertEqual(column_meta, {'num_distinct_values': 4})
+
+
+class TestNativeTypes(unittest.TestCase):
+    """Test profiling DataFrame columns of numbers and datetimes directly"""
+    DATA = pandas.DataFrame({
+        'id': range(20),
+        'year': [2000 + i % 10 for i in range(20)],
+        'flag': [i % 2 for i in range(20)],
+        'when': [20200101 + i % 3 for i in range(20)],
+        'latitude': [40.5 + i / 10 for i in range(20)],
+        'number': [float(i % 4) if i % 5 else float('nan') for i in range(20)],
+        'timestamp': pandas.to_datetime(
+            ['2020-01-0%d' % (i % 3 + 1) if i % 7 else None
+             for i in range(20)],
+        ),
+        'name': ['a%d' % i for i in range(20)],
+    })
+
+    def test_column_values(self):
+        column = profile_types.ColumnValues(self.DATA['number'])
+        self.assertEqual(column.kind, 'float')
+        self.assertEqual(column.counts, [4, 4, 4, 4, 4])
+        self.assertEqual(column.num_distinct(), 4)
+        self.assertEqual(list(column.uniques), ['1.0', '2.0', '3.0', '0.0', ''])
+        self.assertEqual(
+            list(column.non_empty_uniques()),
+            ['1.0', '2.0', '3.0', '0.0'],
+        )
+        self.assertTrue(numpy.isnan(column.numbers()[0]))
+        self.assertEqual(column.numbers()[1], 1.0)
+
+    def test_dtypes(self):
+        """Test that native columns are profiled like their strings"""
+        metadata = process_dataset(self.DATA, plots=True)
+        expected = process_dataset(
+            self.DATA.astype(object).fillna('').astype(str),
+            plots=True,
+        )
+        self.assertEqual(metadata, expected)
+        self.assertEqual(
+            [col['structural_type'] for col in metadata['columns']],
+            [
+                'http://schema.org/Integer',
+                'http://schema.org/Text',
+                'http://schema.org/Integer',
+                'http://schema.org/Text',
+                'http://schema.org/Float',
+                'http://schema.org/Integer',
+                'http://schema.org/Text',
+                'http://schema.org/Text',
+            ],
+        )
+
+    def test_sample(self):
+        """Test including a sample of native columns"""
+        data = pandas.concat([self.DATA] * 3, ignore_index=True)
+        metadata = process_dataset(data, include_sample=True)
+        expected = process_dataset(
+            data.astype(object).fillna('').astype(str),
+            include_sample=True,
+        )
+        self.assertEqual(metadata['sample'], expected['sample'])
+        lines = metadata['sample'].split('\r\n')
+        self.assertEqual(
+            lines[:3],
+            [
+                'id,year,flag,when,latitude,number,timestamp,name',
+                '2,2002,0,20200103,40.7,2.0,2020-01-03 00:00:00,a2',
+                '3,2003,1,20200101,40.8,3.0,2020-01-01 00:00:00,a3',
+            ],
+        )
+        self.assertIn('0,2000,0,20200101,40.5,,,a0', lines)
+        self.assertIn('7,2007,1,20200102,41.2,3.0,,a7', lines)
+
+    def test_small_integer_dates(self):
+        """Test that integers under MIN_DATE_INTEGER are never dates"""
+        values = list(range(-9999, 10000)) + list(range(10000, 100000, 37))
+        self.assertTrue(all(
+            parse_date(str(value)) is None
+            for value in values
+            if abs(value) < profile_types.MIN_DATE_INTEGER
+        ))
+
+
+class TestRanges(unittest.TestCase):
+    def test_optimal(self):
+        """Test computing numerical ranges with 1-D segmentation"""
+        rand = random.Random(1)
+        values = (
+            [rand.uniform(0, 10) for _ in range(400)]
+            + [rand.uniform(100, 110) for _ in range(300)]
+            + [rand.uniform(1000, 1010) for _ in range(300)]
+        )
+        rand.shuffle(values)
+        for engine in ('optimal', 'kmeans'):
+            ranges = numerical.get_numerical_ranges(values, engine=engine)
+            self.assertEqual(len(ranges), 3)
+            for rg, (low, high) in zip(
+                ranges,
+                [(0, 10), (100, 110), (1000, 1010)],
+            ):
+                rg = rg['range']
+                self.assertTrue(low <= rg['gte'] < low + 1)
+                self.assertTrue(high - 1 < rg['lte'] <= high)
+
+        # Cluster of outliers is dropped
+        ranges = numerical.get_numerical_ranges(values + [1e6, 1e6 + 1])
+        self.assertEqual(len(ranges), 2)
+        self.assertTrue(ranges[-1]['range']['lte'] <= 1010)
+
+    def test_optimal_exact(self):
+        """Test that 1-D segmentation finds the best split"""
+        values = numpy.array([1.0, 9.0, 2.0, 10.0, 2.0, 30.0, 1.0])
+        clusters = numerical._optimal_segments(values, 3)
+        self.assertEqual(
+            [list(values[c]) for c in clusters],
+            [[1.0, 1.0, 2.0, 2.0], [9.0, 10.0], [30.0]],
+        )
+
+    def test_optimal_binned(self):
+        """Test 1-D segmentation with more distinct values than groups"""
+        values = numpy.concatenate([
+            numpy.linspace(0, 1, 5000),
+            numpy.linspace(50, 51, 5000),
+            numpy.linspace(100, 101, 2000),
+        ])
+        clusters = numerical._optimal_segments(values, 3)
+        self.assertEqual([len(c) for c in clusters], [5000, 5000, 2000])
+
+    def test_kmeans_timestamps(self):
+        """Test that K-Means clusters timestamps in their own precision"""
+        with data('daily.csv', 'r') as data_fp:
+            metadata = process_dataset(data_fp, ranges_engine='kmeans')
+        self.assertEqual(
+            metadata['temporal_coverage'][0]['ranges'],
+            [
+                {'range': {'gte': 1555977600.0, 'lte': 1556755200.0}},
+                {'range': {'gte': 1556841600.0, 'lte': 1557619200.0}},
+                {'range': {'gte': 1557705600.0, 'lte': 1558483200.0}},
+            ],
+        )
+
+    def test_small(self):
+        """Test computing ranges with fewer distinct values than ranges"""
+        self.assertEqual(
+            numerical.get_numerical_ranges([2.0, 2.0, 1.0]),
+            [
+                {'range': {'gte': 1.0, 'lte': 1.0}},
+                {'range': {'gte': 2.0, 'lte': 2.0}},
+            ],
+        )
+        self.assertEqual(numerical.get_numerical_ranges([]), [])
+        with self.assertRaises(ValueError):
+            numerical.get_numerical_ranges([1.0], engine='nope')
+
+
+class TestAdaptiveTypes(unittest.TestCase):
+    def test_ratio_decided(self):
+        """Test the bound used to stop inspecting rows"""
+        decided = profile_types._ratio_decided
+        self.assertTrue(decided(2000, 2000, 0.98))
+        self.assertFalse(decided(20, 20, 0.98))
+        self.assertTrue(decided(0, 2000, 0.98))
+        self.assertFalse(decided(1960, 2000, 0.98))
+        self.assertFalse(decided(0, 0, 0.98))
+
+    def test_clean(self):
+        """Test that clean columns are only partially inspected"""
+        rand = random.Random(1)
+        array = [str(rand.randint(0, 1000000)) for _ in range(20000)]
+        for i in range(0, 20000, 10):
+            array[i] = ''
+        structural_type, semantic_types, column_meta = \
+            profile_types.identify_types(array, 'number', None, adaptive=True)
+        self.assertEqual(structural_type, 'http://schema.org/Integer')
+        self.assertEqual(semantic_types, {})
+        self.assertEqual(column_meta['num_inspected_rows'], 2000)
+        self.assertAlmostEqual(
+            column_meta['missing_values_ratio'], 0.1, delta=0.02,
+        )
+        self.assertEqual(
+            column_meta['num_distinct_values'],
+            len(set(array)) - 1,
+        )
+
+    def test_borderline(self):
+        """Test that columns close to the threshold are fully inspected"""
+        array = ['12'] * 9800 + ['a%d' % i for i in range(200)]
+        random.Random(1).shuffle(array)
+        structural_type, semantic_types, column_meta = \
+            profile_types.identify_types(array, 'number', None, adaptive=True)
+        self.assertEqual(structural_type, 'http://schema.org/Integer')
+        self.assertEqual(column_meta['num_inspected_rows'], 10000)
+        self.assertEqual(column_meta['unclean_values_ratio'], 0.02)
+
+    def test_incremental_count(self):
+        """Test that each distinct value is only classified once"""
+        array = ['12'] * 9800 + ['a%d' % i for i in range(100)] + ['yes'] * 100
+        random.Random(2).shuffle(array)
+        column = profile_types.ColumnValues(array)
+        with unittest.mock.patch.object(
+            profile_types, '_structural_class',
+            wraps=profile_types._structural_class,
+        ) as structural_class:
+            re_count, num_rows = \
+                profile_types.adaptive_regular_exp_count(column)
+        self.assertEqual(num_rows, 10000)
+        self.assertEqual(structural_class.call_count, 102)
+        self.assertEqual(re_count, profile_types.regular_exp_count(array))
+
+    def test_dates(self):
+        """Test identifying dates from part of the rows"""
+        array = [
+            '2020-%02d-%02d' % (i % 12 + 1, i % 28 + 1)
+            for i in range(10000)
+        ]
+        structural_type, semantic_types, column_meta = \
+            profile_types.identify_types(array, 'when', None, adaptive=True)
+        self.assertEqual(structural_type, 'http://schema.org/Text')
+        self.assertEqual(
+            len(semantic_types['http://schema.org/DateTime']),
+            10000,
+        )
+        self.assertLess(column_meta['num_inspected_rows'], 10000)
+
+        array = ['%d' % (i * 7919 % 100003) for i in range(10000)]
+        self.assertFalse(profile_types.adaptive_maybe_dates(
+            profile_types.ColumnValues(array),
+        ))
+        structural_type, semantic_types, column_meta = \
+            profile_types.identify_types(array, 'when', None, adaptive=True)
+        self.assertEqual(structural_type, 'http://schema.org/Integer')
+        self.assertNotIn('http://schema.org/DateTime', semantic_types)
+
+
+class TestPlots(unittest.TestCase):
+    def test_text(self):
+        """Test the histogram of words"""
+        for extra in ['', ' Ünïcode']:
+            column = profile_types.ColumnValues(numpy.array(
+                [
+                    'Hello, world', 'hello;WORLD', '', 'foo bar',
+                    'Bar-baz' + extra, 'hello', 'foo bar', 'qux_1',
+                ],
+                dtype=object,
+            ))
+            self.assertEqual(
+                plots.histogram_text(column)['data'],
+                [
+                    {'bin': 'hello', 'count': 3},
+                    {'bin': 'bar', 'count': 3},
+                    {'bin': 'world', 'count': 2},
+                    {'bin': 'foo', 'count': 2},
+                    {'bin': 'baz', 'count': 1},
+                ],
+            )
+        column = profile_types.ColumnValues(numpy.array([], dtype=object))
+        self.assertEqual(plots.histogram_text(column)['data'], [])
+
+    def test_categorical(self):
+        """Test the histogram of most common values"""
+        column = profile_types.ColumnValues(numpy.array(
+            ['b', 'a', '', '', '', 'c', 'd', 'e', 'f', 'e', 'a', 'f'],
+            dtype=object,
+        ))
+        self.assertEqual(
+            plots.histogram_categorical(column)['data'],
+            [
+                {'bin': 'a', 'count': 2},
+                {'bin': 'b', 'count': 1},
+                {'bin': 'c', 'count': 1},
+                {'bin': 'e', 'count': 2},
+                {'bin': 'f', 'count': 2},
+            ],
+        )
+
+    def test_timestamps(self):
+        """Test converting datetimes to timestamps"""
+        datetimes = [
+            datetime(2020, 3, 4, 5, 6, 7, 891011, tzinfo=UTC),
+            datetime(1950, 1, 1, tzinfo=timezone(timedelta(hours=-5))),
+            datetime(2270, 1, 1, tzinfo=UTC),  # Out of bounds for pandas
+        ]
+        for values in (datetimes[:2], datetimes):
+            timestamps = get_timestamps(values)
+            self.assertEqual(timestamps.dtype, numpy.float32)
+            self.assertEqual(
+                list(timestamps),
+                [numpy.float32(dt.timestamp()) for dt in values],
+            )
+
+
+class TestSketches(unittest.TestCase):
+    def test_moments(self):
+        rand = numpy.random.RandomState(1)
+        values = rand.normal(5.0, 2.0, 1000)
+        moments = sketches.Moments.from_values(values[:300]).merge(
+            sketches.Moments.from_values(values[300:]),
+        )
+        self.assertEqual(moments.count, 1000)
+        self.assertAlmostEqual(moments.mean, values.mean())
+        self.assertAlmostEqual(moments.stddev, values.std())
+        self.assertEqual(moments.minimum, values.min())
+        self.assertEqual(moments.maximum, values.max())
+
+    def test_hyperloglog(self):
+        first = sketches.HyperLogLog()
+        first.add(['v%d' % i for i in range(30000)])
+        second = sketches.HyperLogLog.from_json(
+            sketches.HyperLogLog().to_json(),
+        )
+        second.add(['v%d' % i for i in range(20000, 50000)])
+        self.assertLess(abs(first.count() - 30000), 1500)
+        self.assertLess(abs(first.merge(second).count() - 50000), 2500)
+
+    def test_hyperloglog_exact(self):
+        small = sketches.HyperLogLog()
+        small.add(['a', 'b', 'c', 'b'])
+        self.assertTrue(small.exact)
+        self.assertEqual(small.count(), 3)
+        small = sketches.HyperLogLog.from_json(small.to_json())
+        other = sketches.HyperLogLog()
+        other.add(['c', 'd'])
+        merged = small.merge(other)
+        self.assertTrue(merged.exact)
+        self.assertEqual(merged.count(), 4)
+
+        # Switches to registers past the limit
+        big = sketches.HyperLogLog()
+        big.add(['v%d' % i for i in range(sketches.HLL_EXACT_LIMIT)])
+        self.assertTrue(big.exact)
+        big = big.merge(other)
+        self.assertFalse(big.exact)
+        self.assertLess(abs(big.count() - sketches.HLL_EXACT_LIMIT - 2), 30)
+
+    def test_quantiles(self):
+        values = numpy.concatenate([
+            numpy.arange(0.0, 1000.0),
+            numpy.arange(3000.0, 3500.0),
+            numpy.arange(5500.0, 6000.0),
+        ])
+        numpy.random.RandomState(2).shuffle(values)
+        sketch = sketches.QuantileSketch.from_values(values[:500]).merge(
+            sketches.QuantileSketch.from_values(values[500:]),
+        )
+        self.assertLessEqual(len(sketch.means), sketches.QUANTILE_CENTROIDS)
+        self.assertEqual(sketch.weights.sum(), 2000)
+        self.assertEqual(sketch.means[0], 0.0)
+        self.assertEqual(sketch.means[-1], 5999.0)
+        ranges = numerical.get_numerical_ranges(
+            sketch.means,
+            weights=sketch.weights,
+        )
+        exact = numerical.get_numerical_ranges(values)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(len(exact), 3)
+        for rg, exact_rg in zip(ranges, exact):
+            self.assertLess(
+                abs(rg['range']['gte'] - exact_rg['range']['gte']),
+                50,
+            )
+            self.assertLess(
+                abs(rg['range']['lte'] - exact_rg['range']['lte']),
+                50,
+            )
+
+    def test_append(self):
+        rand = numpy.random.RandomState(3)
+        df = pandas.DataFrame({
+            'number': rand.normal(10.0, 3.0, 2000),
+            'category': rand.choice(['a', 'b', 'c'], 2000),
+        })
+        whole = process_dataset(df, indexes=False, plots=True, sketches=True)
+        first = process_dataset(
+            df.iloc[:1200].reset_index(drop=True),
+            indexes=False, plots=True, sketches=True,
+        )
+        merged = process_dataset(
+            df.iloc[1200:].reset_index(drop=True),
+            indexes=False, plots=True, append_to=first,
+        )
+        self.assertEqual(merged['nb_rows'], 2000)
+        self.assertEqual(merged['nb_profiled_rows'], 2000)
+        self.assertEqual(
+            [col['name'] for col in merged['columns']],
+            ['number', 'category'],
+        )
+        self.assertAlmostEqual(
+            merged['columns'][0]['mean'],
+            whole['columns'][0]['mean'],
+        )
+        self.assertAlmostEqual(
+            merged['columns'][0]['stddev'],
+            whole['columns'][0]['stddev'],
+        )
+        self.assertTrue(check_ranges(0.0, 25.0)(
+            merged['columns'][0]['coverage'],
+        ))
+        self.assertEqual(
+            sum(b['count'] for b in merged['columns'][0]['plot']['data']),
+            2000,
+        )
+        self.assertEqual(merged['columns'][1]['num_distinct_values'], 3)
+        self.assertEqual(
+            merged['columns'][1]['plot'],
+            whole['columns'][1]['plot'],
+        )
+        self.assertEqual(
+            merged['sketches']['columns'][0]['num_rows'],
+            2000,
+        )
+
+        with self.assertRaises(ValueError):
+            process_dataset(
+                df.iloc[1200:].reset_index(drop=True),
+                indexes=False, append_to=whole['columns'],
+            )
+
+    def test_append_sampled(self):
+        """Test appending several times to a profile computed on a sample"""
+        rand = numpy.random.RandomState(4)
+        numbers = rand.randint(0, 100, 20000)
+        appended = [rand.randint(50, 150, 200), rand.randint(50, 150, 200)]
+        with tempfile.NamedTemporaryFile('w+', suffix='.csv') as tmp:
+            pandas.DataFrame({'number': numbers}).to_csv(tmp, index=False)
+            tmp.flush()
+            profile = process_dataset(
+                tmp.name, load_max_size=30000, indexes=False, sketches=True,
+            )
+        self.assertEqual(profile['nb_rows'], 20000)
+        self.assertLess(profile['nb_profiled_rows'], 20000)
+
+        for values in appended:
+            profile = process_dataset(
+                pandas.DataFrame({'number': [str(v) for v in values]}),
+                indexes=False, append_to=profile,
+            )
+        whole = numpy.concatenate([numbers] + appended)
+        self.assertEqual(profile['nb_rows'], 20400)
+        moments = sketches.Moments.from_json(
+            profile['sketches']['columns'][0]['moments'],
+        )
+        self.assertAlmostEqual(moments.count, 20400, delta=1)
+        self.assertEqual(profile['sketches']['columns'][0]['num_rows'], 20400)
+        self.assertAlmostEqual(
+            profile['columns'][0]['mean'], whole.mean(), delta=1.0,
+        )
+
+    def test_append_missing(self):
+        """Test appending rows where a column is empty"""
+        first = process_dataset(
+            pandas.DataFrame({
+                'number': [str(i) for i in range(100)],
+                'name': ['n%d' % i for i in range(100)],
+            }),
+            indexes=False, sketches=True,
+        )
+        self.assertEqual(first['columns'][0]['mean'], 49.5)
+        self.assertNotIn('missing_values_ratio', first['columns'][0])
+
+        merged = process_dataset(
+            pandas.DataFrame({
+                'number': [''] * 100,
+                'name': ['m%d' % i for i in range(100)],
+            }),
+            indexes=False, append_to=first,
+        )
+        self.assertEqual(merged['nb_rows'], 200)
+        self.assertEqual(merged['columns'][0]['mean'], 49.5)
+        self.assertEqual(merged['columns'][0]['missing_values_ratio'], 0.5)
+        self.assertIn('moments', merged['sketches']['columns'][0])
+
+        # The numerical sketches are still there for the next append
+        merged = process_dataset(
+            pandas.DataFrame({
+                'number': [str(i) for i in range(1000, 3000, 10)],
+                'name': ['o%d' % i for i in range(200)],
+            }),
+            indexes=False, append_to=merged,
+        )
+        self.assertEqual(merged['nb_rows'], 400)
+        self.assertAlmostEqual(
+            merged['columns'][0]['mean'],
+            (sum(range(100)) + sum(range(1000, 3000, 10))) / 300,
+        )
+        self.assertEqual(merged['columns'][0]['missing_values_ratio'], 0.25)
+
+        # Appending to an empty column keeps its type
+        first = process_dataset(
+            pandas.DataFrame({'number': [''] * 10}),
+            indexes=False, sketches=True,
+        )
+        merged = process_dataset(
+            pandas.DataFrame({'number': ['1', '2']}),
+            indexes=False, append_to=first,
+        )
+        self.assertEqual(
+            merged['columns'][0]['structural_type'],
+            'https://metadata.datadrivendiscovery.org/types/MissingData',
+        )
+        self.assertNotIn('missing_values_ratio', merged['columns'][0])
+
 
 class TestTruncate(unittest.TestCase):
     def test_simple(self):
@@ -722,6 +1593,124 @@ class TestTruncate(unittest.TestCase):
         )
 
 
+class TestAdminCache(unittest.TestCase):
+    """Test memoizing the resolution of admin areas"""
+    class FakeArea(object):
+        def __init__(self, geodata, id, parent):
+            self.geodata = geodata
+            self.id = id
+            self.parent = parent
+            self.type = datamart_geo.Type(0 if parent is None else 1)
+            self.levels = [id if parent is None else parent.id, id]
+
+        def get_parent_area(self):
+            self.geodata.queries.append(('parent', self.id))
+            return self.parent
+
+    class FakeGeoData(object):
+        def __init__(self):
+            self.queries = []
+            country = TestAdminCache.FakeArea(self, 'US', None)
+            self.areas = {
+                name: TestAdminCache.FakeArea(self, name, country)
+                for name in ('NY', 'NJ', 'CT')
+            }
+
+        def resolve_name_all(self, name):
+            self.queries.append(('name', name))
+            if name in self.areas:
+                yield self.areas[name]
+
+    def get_hits(self, kind):
+        return prometheus_client.REGISTRY.get_sample_value(
+            'profile_%s_total' % kind,
+            {'cache': 'names'},
+        ) or 0
+
+    def test_memoize(self):
+        geo_data = self.FakeGeoData()
+        hits = self.get_hits('admin_cache_hits')
+        misses = self.get_hits('admin_cache_misses')
+        for _ in range(3):
+            areas = spatial.resolve_names_all(
+                geo_data, ['NY', 'NJ', 'CT', 'nope'],
+            )
+            level, result = disambiguate_admin_areas(
+                areas[:3], geo_data,
+            )
+            self.assertEqual(level, 1)
+            self.assertEqual([a.id for a in result], ['NY', 'NJ', 'CT'])
+        self.assertIsNone(spatial.resolve_name(geo_data, 'nope'))
+        self.assertEqual(
+            sorted(geo_data.queries),
+            [
+                ('name', 'CT'), ('name', 'NJ'), ('name', 'NY'),
+                ('name', 'nope'),
+                ('parent', 'CT'), ('parent', 'NJ'), ('parent', 'NY'),
+                ('parent', 'US'),
+            ],
+        )
+        self.assertEqual(self.get_hits('admin_cache_hits') - hits, 9)
+        self.assertEqual(self.get_hits('admin_cache_misses') - misses, 4)
+
+        # Another GeoData object doesn't use the same cache
+        other = self.FakeGeoData()
+        spatial.resolve_name(other, 'NY')
+        self.assertEqual(other.queries, [('name', 'NY')])
+
+    def test_lru(self):
+        cache = spatial._LRUCache('test', 2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        self.assertEqual(cache.get('a', lambda: 0), 1)
+        cache.get('c', lambda: 3)
+        self.assertEqual(cache.get('a', lambda: 0), 1)
+        self.assertEqual(cache.get('b', lambda: 0), 0)
+
+
+class TestDiagnostics(unittest.TestCase):
+    """Test recording the time and memory of each profiling stage"""
+    def test_diagnostics(self):
+        metadata = process_dataset(
+            pandas.DataFrame({
+                'name': ['a%d' % i for i in range(50)],
+                'number': list(range(50)),
+            }),
+            plots=True,
+            diagnostics=True,
+        )
+        self.assertFalse(tracemalloc.is_tracing())
+        diagnostics = metadata['diagnostics']
+        self.assertEqual(
+            set(diagnostics['stages']),
+            {'load_data', 'columns', 'spatial_coverage', 'temporal_coverage'},
+        )
+        self.assertEqual(diagnostics['stages']['load_data']['rows'], 50)
+        self.assertEqual(
+            [col['name'] for col in diagnostics['columns']],
+            ['name', 'number'],
+        )
+        stages = diagnostics['columns'][1]['stages']
+        self.assertEqual(
+            set(stages),
+            {
+                'identify_types', 'parse_numerical_values',
+                'numerical_ranges', 'numerical_plot',
+            },
+        )
+        for stage in stages.values():
+            self.assertEqual(stage['rows'], 50)
+            self.assertGreaterEqual(stage['time'], 0)
+            self.assertGreater(stage['allocated'], 0)
+
+        # Not included by default
+        metadata = process_dataset(
+            pandas.DataFrame({'number': list(range(50))}),
+        )
+        self.assertNotIn('diagnostics', metadata)
+        self.assertNotIn('diagnostics', metadata['columns'][0])
+
+
 class TestNominatim(DataTestCase):
     """Test resolving addresses, mocking Nominatim queries"""
     def test_profile(self):
@@ -854,6 +1843,81 @@ class TestNominatim(DataTestCase):
         finally:
             spatial.nominatim_query = old_query
 
+    def test_server(self):
+        """Test resolving addresses with a fake Nominatim server and cache"""
+        requested = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urllib.parse.parse_qs(
+                    urllib.parse.urlparse(self.path).query,
+                )
+                batch = [q['q'] for q in json.loads(query['batch'][0])]
+                requested.extend(batch)
+                results = []
+                for address in batch:
+                    number = int(address.split()[0])
+                    if number % 2:
+                        results.append([])
+                    else:
+                        results.append([{'lat': number, 'lon': -number}])
+                body = json.dumps({'batch': results}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:%d/' % server.server_address[1]
+        addresses = ['%d Main St' % i for i in range(50)] * 2
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = spatial.NominatimCache(os.path.join(tmp, 'cache.db'))
+            try:
+                res, non_empty = spatial.nominatim_resolve_all(
+                    url, addresses, cache=cache,
+                )
+                self.assertEqual(non_empty, 100)
+                self.assertEqual(sorted(requested), sorted(addresses[:50]))
+                self.assertEqual(len(res), 50)
+                self.assertEqual(
+                    res[:3],
+                    [(0.0, -0.0), (0.0, -0.0), (2.0, -2.0)],
+                )
+
+                # Everything comes from the cache the second time
+                del requested[:]
+                res2, non_empty = spatial.nominatim_resolve_all(
+                    url, addresses, cache=cache,
+                )
+                self.assertEqual(requested, [])
+                self.assertEqual(res2, res)
+
+                # Budget of requests
+                cache.ttl = -1
+                res, non_empty = spatial.nominatim_resolve_all(
+                    url, ['%d Other St' % i for i in range(100)],
+                    max_requests=40, cache=cache,
+                )
+                self.assertEqual(len(requested), 40)
+                self.assertEqual(len(res), 20)
+
+                # Expired entries are not used
+                del requested[:]
+                spatial.nominatim_resolve_all(
+                    url, ['%d Other St' % i for i in range(20)], cache=cache,
+                )
+                self.assertEqual(len(requested), 20)
+            finally:
+                server.shutdown()
+                server.server_close()
+
 
 class TestGeo(DataTestCase):
     @classmethod
@@ -1239,6 +2303,44 @@ class TestGeo(DataTestCase):
         )
 
 
+class TestSpatialRanges(unittest.TestCase):
+    def test_summarized(self):
+        """Test computing spatial ranges from weighted geohash cells"""
+        rand = numpy.random.RandomState(1)
+        points = numpy.concatenate([
+            numpy.column_stack([
+                rand.normal(40.7, 0.05, 30000),
+                rand.normal(-73.9, 0.05, 30000),
+            ]),
+            numpy.column_stack([
+                rand.normal(34.0, 0.1, 20000),
+                rand.normal(-118.2, 0.1, 20000),
+            ]),
+            numpy.zeros((100, 2)),
+        ])
+
+        centroids, counts = spatial.summarize_points(points, 1000)
+        self.assertTrue(500 < len(centroids) <= 1000)
+        self.assertEqual(counts.sum(), len(points))
+        self.assertEqual(centroids.shape, (len(counts), 2))
+
+        summarized = spatial.get_spatial_ranges(points)
+        old_max = spatial.MAX_RANGES_POINTS
+        spatial.MAX_RANGES_POINTS = len(points)
+        try:
+            exact = spatial.get_spatial_ranges(points)
+        finally:
+            spatial.MAX_RANGES_POINTS = old_max
+        self.assertEqual(len(summarized), 2)
+        self.assertEqual(len(exact), 2)
+        for rg1, rg2 in zip(summarized, exact):
+            self.assertTrue(numpy.allclose(
+                rg1['range']['coordinates'],
+                rg2['range']['coordinates'],
+                atol=0.01,
+            ))
+
+
 class TestGeoHash(unittest.TestCase):
     def test_bit_encoding(self):
         self.assertEqual(
@@ -1404,6 +2506,64 @@ class TestGeoHash(unittest.TestCase):
             [('', 4)],
         )
 
+    def test_location_codes(self):
+        """Test computing cell codes for all points at once"""
+        points = numpy.array([
+            (40.6962574, -73.9849621), (48.8588376, 2.2768489), (0.0, 0.0),
+        ])
+        for base, precision in [(4, 16), (32, 12), (2, 7)]:
+            base_bits = base.bit_length() - 1
+            self.assertEqual(
+                [
+                    '{0:0{1}b}'.format(code, base_bits * precision)
+                    for code in spatial.location_codes(
+                        points, base, precision,
+                    )
+                ],
+                [
+                    ''.join(
+                        str(b)
+                        for b in spatial.location_to_bits(
+                            point, base, precision,
+                        )[:base_bits * precision]
+                    )
+                    for point in points
+                ],
+            )
+
+    def test_sketch_points_mixed(self):
+        """Test adding points in several batches and with boxes"""
+        rand = random.Random(1)
+        points = [
+            (rand.uniform(40.0, 41.0), rand.uniform(-75.0, -73.0))
+            for _ in range(500)
+        ]
+        for number in (1, 10, 1000):
+            vectorized = spatial.Geohasher(number=number)
+            vectorized.add_points(points[:200])
+            vectorized.add_aab((-74.5, -74.0, 40.0, 40.5))
+            vectorized.add_points(numpy.array(points[200:]))
+
+            one_by_one = spatial.Geohasher(number=number)
+            for point in points[:200]:
+                one_by_one._add_hash(
+                    spatial.hash_location(point, 4, one_by_one.precision),
+                    1,
+                )
+            one_by_one.add_aab((-74.5, -74.0, 40.0, 40.5))
+            for point in points[200:]:
+                one_by_one._add_hash(
+                    spatial.hash_location(point, 4, one_by_one.precision),
+                    1,
+                )
+
+            self.assertEqual(vectorized.precision, one_by_one.precision)
+            self.assertEqual(vectorized.total, 501)
+            self.assertEqual(
+                vectorized.get_hashes_json(),
+                one_by_one.get_hashes_json(),
+            )
+
     def test_sketch_aab(self):
         builder = spatial.Geohasher(
             base=4,
@@ -1439,6 +2599,37 @@ class TestGeoHash(unittest.TestCase):
         )
 
 
+class TestParseWkt(unittest.TestCase):
+    def test_parse(self):
+        """Test parsing a column of WKT points into an array"""
+        column = pandas.Series([
+            'POINT (-73.9926 40.7317)', '', 'POINT(2.35 48.85)',
+            '(12.5,41.9)', 'POINT (200.0 40.0)', 'nope', '',
+            'POINT (-73.9926 40.7317) ',
+        ])
+        for col in (column, column.astype('string')):
+            points, non_empty = spatial.parse_wkt_column(col)
+            self.assertEqual(points.dtype, numpy.float64)
+            self.assertEqual(
+                points.tolist(),
+                [[40.7317, -73.9926], [48.85, 2.35], [41.9, 12.5]],
+            )
+            self.assertEqual(non_empty, 6)
+
+        points, non_empty = spatial.parse_wkt_column(
+            pandas.Series(['(40.7317, -73.9926)', '(100.0, 40.0)']),
+            latlong=True,
+        )
+        self.assertEqual(points.tolist(), [[40.7317, -73.9926]])
+        self.assertEqual(non_empty, 2)
+
+        points, non_empty = spatial.parse_wkt_column(
+            pandas.Series([], dtype=object),
+        )
+        self.assertEqual(points.shape, (0, 2))
+        self.assertEqual(non_empty, 0)
+
+
 class TestMedianDist(unittest.TestCase):
     def test_median_dist(self):
         """Test determining the median distance of points"""
@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from apiserver.profile import Profile, ProfileStatus
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestProgressiveProfile(unittest.TestCase):
+    TOKEN = 'd99a8e42e65fb84e2ad800be35a8834b30828227'
+
+    def test_failure(self):
+        """Test that the error is reported if the background profile fails"""
+        redis = FakeRedis()
+        redis.set('profile-fast:' + self.TOKEN, b'{"nb_rows": 3}')
+
+        async def profile():
+            app = mock.Mock(
+                redis=redis,
+                nb_requests=0,
+                close_condition=asyncio.Condition(),
+            )
+            handler = mock.Mock(application=app)
+            handler.handle_data_parameter.side_effect = ValueError(
+                "Invalid CSV",
+            )
+            Profile.profile_in_background(handler, b'data', self.TOKEN)
+
+            # Fast profile while profiling
+            Profile.send_progressive(handler, self.TOKEN)
+            handler.send_json.assert_called_once_with({
+                'nb_rows': 3,
+                'token': self.TOKEN,
+                'status': 'profiling',
+            })
+
+            while redis.exists('profile-pending:' + self.TOKEN):
+                await asyncio.sleep(0.01)
+            self.assertEqual(app.nb_requests, 0)
+            return handler
+
+        handler = asyncio.run(profile())
+
+        # Posting the token again gets the error
+        Profile.send_progressive(handler, self.TOKEN)
+        handler.send_error_json.assert_called_once_with(
+            500,
+            "Error profiling data: Invalid CSV",
+        )
+
+        # So does the status endpoint
+        status = mock.Mock(
+            application=mock.Mock(redis=redis),
+            send_error_json=mock.AsyncMock(),
+        )
+        status.get_query_argument.return_value = '0'
+        asyncio.run(ProfileStatus.get(status, self.TOKEN))
+        status.send_error_json.assert_called_once_with(
+            500,
+            "Error profiling data: Invalid CSV",
+        )